@@ -1,11 +1,11 @@
 from django.db import models
-from django.core.cache import cache
-from django.core.cache.utils import make_template_fragment_key
-from django.shortcuts import render
+from django.shortcuts import get_object_or_404, render
+from django.utils.http import urlencode
 from django import forms
-from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
+from django.db.models import prefetch_related_objects
+from django.db.models.query import BaseIterable
 from modelcluster.contrib.taggit import ClusterTaggableManager
-from taggit.models import TaggedItemBase
+from taggit.models import Tag, TaggedItemBase
 
 from wagtail.api import APIField 
 from modelcluster.fields import ParentalKey, ParentalManyToManyField
@@ -16,15 +16,23 @@ from wagtail.admin.edit_handlers import (
     InlinePanel,
 
 )
-from wagtail.core.models import Page, Orderable
+from wagtail.core.models import Page, PageManager, Orderable
 from wagtail.core.fields import StreamField
+from wagtail.core.query import PageQuerySet
+from wagtail.images.models import Image
 
 from wagtail.snippets.edit_handlers import SnippetChooserPanel
 from wagtail.images.edit_handlers import ImageChooserPanel
-from wagtail.images.api.fields import ImageRenditionField 
 from wagtail.contrib.routable_page.models import RoutablePageMixin, route
 from wagtail.snippets.models import register_snippet
 
+from core.cache import Fragment, invalidation
+from core.images import PrefetchedImageRenditionField, attach_renditions, prefetch_renditions
+from core.page_cache import CachedPageMixin
+from core.pages import specific_in_bulk
+from core.streams import PrefetchingStreamBlock, StreamRepresentationField
+from core.pagination import paginate
+from core.renditions import register_filter_spec
 from streams import blocks 
 
 from rest_framework.fields import Field
@@ -66,14 +74,16 @@ class BlogAuthorOrderable(Orderable):
     def author_image(self):
         return self.author.image
 
+    api_image_rendition = 'fill-200x250'
+
     api_fields = [
         APIField('author_name'),
         APIField('author_website'),
         #APIField('author_image', serializer=ImageSerializedField()),
         APIField(
             'image',
-            serializer=ImageRenditionField(
-                'fill-200x250',
+            serializer=PrefetchedImageRenditionField(
+                api_image_rendition,
                  source='author_image'
             )
         ),
@@ -130,6 +140,7 @@ class BlogCategory(models.Model):
         verbose_name='slug',
         allow_unicode=True,
         max_length=255,
+        db_index=True,
         help_text='A slug to indentify posts by this category',
     )
 
@@ -176,22 +187,46 @@ class BlogListingPage(RoutablePageMixin, Page):
     def get_context(self, request, *args, **kwargs):
         """ Adding custom stuff to our context """
         context = super().get_context(request, *args, **kwargs)
-        all_posts = BlogDetailPage.objects.live().public().order_by('-first_published_at')
-        paginator = Paginator(all_posts, 2)
-        page = request.GET.get('page')
-
-        try:
-            posts = paginator.page(page)
-        except PageNotAnInteger:
-            posts = paginator.page(1)
-        except EmptyPage:
-            posts = paginator.page(paginator.num_pages)
-
-        context['posts'] = posts
+        all_posts = BlogDetailPage.objects.live().public().for_listing()
+
+        # Filters come from the category/tag routes or the ?category= and ?tag= links
+        filters = {}
+        category_slug = kwargs.get('category') or request.GET.get('category')
+        if category_slug:
+            category = get_object_or_404(BlogCategory, slug=category_slug)
+            all_posts = all_posts.filter(categories=category)
+            filters['category'] = category.slug
+            context['active_category'] = category
+
+        tag_slug = kwargs.get('tag') or request.GET.get('tag')
+        if tag_slug:
+            tag = get_object_or_404(Tag, slug=tag_slug)
+            all_posts = all_posts.filter(tagged_items__tag=tag)
+            filters['tag'] = tag.slug
+            context['active_tag'] = tag
+
+        context['posts'] = paginate(request, all_posts, 2, ['-first_published_at', '-id'])
+        context['filter_querystring'] = urlencode(filters)
+        # Every filter and page combination is cached as its own fragment
+        context['listing_cache_key'] = ':'.join([
+            filters.get('category', ''),
+            filters.get('tag', ''),
+            request.GET.get('cursor') or request.GET.get('page') or '',
+        ])
         
         context['categories'] = BlogCategory.objects.all()
         return context
 
+    @route(r'^category/(?P<category>[-\w]+)/$', name='category')
+    def category_posts(self, request, category, *args, **kwargs):
+        context = self.get_context(request, *args, category=category, **kwargs)
+        return render(request, self.get_template(request), context)
+
+    @route(r'^tag/(?P<tag>[-\w]+)/$', name='tag')
+    def tag_posts(self, request, tag, *args, **kwargs):
+        context = self.get_context(request, *args, tag=tag, **kwargs)
+        return render(request, self.get_template(request), context)
+
     @route(r'^latest/?$', name='latest_posts')
     def latest_blog_posts(self, request, *args, **kwargs):
         context = self.get_context(request, *args, **kwargs)
@@ -218,9 +253,47 @@ class BlogPageTag(TaggedItemBase):
     )
 
 
-class BlogDetailPage(Page):
+class BlogListingIterable(BaseIterable):
+    """ Yields specific blog posts with everything the listing templates use.
+
+    Costs one query per post type plus a fixed number of prefetch queries,
+    no matter how many posts are in the page.
+    """
+
+    def __iter__(self):
+        pks_and_types = list(self.queryset.values_list('pk', 'content_type'))
+        posts = specific_in_bulk(pks_and_types, select_related=['banner_image'])
+        posts = [posts[pk] for pk, _ in pks_and_types if pk in posts]
+        prefetch_related_objects(posts, 'blog_authors__author', 'categories')
+
+        renditions = prefetch_renditions(
+            [post.banner_image for post in posts],
+            BlogDetailPage.listing_rendition,
+        )
+        for post in posts:
+            post.banner_rendition = renditions.get(post.banner_image_id)
+            yield post
+
+
+class BlogDetailPageQuerySet(PageQuerySet):
+
+    def for_listing(self):
+        """ Specific posts with banner renditions, authors and categories loaded in bulk """
+        clone = self._chain()
+        clone._iterable_class = BlogListingIterable
+        return clone
+
+
+BlogDetailPageManager = PageManager.from_queryset(BlogDetailPageQuerySet)
+
+
+class BlogDetailPage(CachedPageMixin, Page):
     """ Parental blog Detail page """
 
+    objects = BlogDetailPageManager()
+
+    listing_rendition = register_filter_spec('fill-250x250')
+
     subpage_types = []
     parent_page_types = [
         'blog.BlogListingPage'
@@ -245,15 +318,16 @@ class BlogDetailPage(Page):
     categories = ParentalManyToManyField('blog.BlogCategory', blank=True)
 
     content = StreamField(
-        [
+        PrefetchingStreamBlock([
             ('title_and_text', blocks.TitleAndTextBlock()),
             ('full_richtext', blocks.RichTextBlock()),
             ('cards', blocks.CardBlock()),
             ('cta', blocks.CTABlock()),
-        ],
+        ], required=False),
         null=True,
         blank=True
     )
+    rendered_stream_fields = ['content']
 
     content_panels = Page.content_panels + [
         FieldPanel('custom_title'),
@@ -276,13 +350,23 @@ class BlogDetailPage(Page):
 
     api_fields = [
         APIField('blog_authors'),
-        APIField('content'),
+        APIField('content', serializer=StreamRepresentationField()),
     ]
 
-    def save(self, *args, **kwargs):
-        key = make_template_fragment_key('blog_post_preview', [self.id])
-        cache.delete(key)
-        return super().save(*args, **kwargs)
+    @classmethod
+    def prefetch_api_fields(cls, posts, fields=None):
+        """ Authors, their images and image renditions for many posts, in a fixed number of queries """
+        if fields is not None and 'blog_authors' not in fields:
+            return
+        prefetch_related_objects(posts, 'blog_authors__author__image')
+        attach_renditions(
+            [
+                blog_author.author.image
+                for post in posts for blog_author in post.blog_authors.all()
+            ],
+            [BlogAuthorOrderable.api_image_rendition],
+        )
+
 
 
 class ArticleBlogPage(BlogDetailPage):
@@ -346,4 +430,36 @@ class VideoBlogPage(BlogDetailPage):
         ),
         FieldPanel('youtube_video_id'),
         StreamFieldPanel('content'),
-    ]
\ No newline at end of file
+    ]
+
+
+@invalidation.register(BlogDetailPage)
+def blog_post_changed(post):
+    """ A post shows up in its own preview and on the listing page """
+    yield Fragment('blog_post_preview')
+    yield Fragment('blog_listing')
+    yield from BlogListingPage.objects.parent_of(post)
+
+
+@invalidation.register(BlogAuthor)
+def blog_author_changed(author):
+    """ Authors are shown on the detail pages of their posts """
+    yield from BlogDetailPage.objects.filter(blog_authors__author=author)
+
+
+@invalidation.register(BlogCategory)
+def blog_category_changed(category):
+    """ Categories are listed on the listing page and on their posts """
+    yield Fragment('blog_listing')
+    yield from BlogDetailPage.objects.filter(categories=category)
+    yield from BlogListingPage.objects.all()
+
+
+@invalidation.register(Image)
+def blog_image_changed(image):
+    """ Banner images are part of the post previews, author images of the posts """
+    posts = BlogDetailPage.objects.filter(banner_image=image)
+    if posts.exists():
+        yield Fragment('blog_post_preview')
+        yield from posts
+    yield from BlogDetailPage.objects.filter(blog_authors__author__image=image)
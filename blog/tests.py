@@ -1,3 +1,292 @@
-from django.test import TestCase
+import json
+import shutil
+import tempfile
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from wagtail.core.models import Site
+from wagtail.images.models import Image
+from wagtail.images.tests.utils import get_test_image_file
+
+from core.cache import get_generation, get_generations
+
+from .models import (
+    ArticleBlogPage,
+    BlogAuthor,
+    BlogAuthorOrderable,
+    BlogCategory,
+    BlogDetailPage,
+    BlogListingPage,
+    VideoBlogPage,
+)
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(
+    MEDIA_ROOT=MEDIA_ROOT,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage',
+)
+class BlogTestCase(TestCase):
+    """ Builds a blog listing page with a few posts to test against """
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        root = Site.objects.get(is_default_site=True).root_page
+        self.listing = root.add_child(instance=BlogListingPage(
+            title='Blog', slug='blog', custom_title='Blog',
+        ))
+        self.category = BlogCategory.objects.create(name='News', slug='news')
+        self.author = BlogAuthor.objects.create(name='Author', image=self.make_image())
+
+    def make_image(self):
+        return Image.objects.create(title='Test image', file=get_test_image_file())
+
+    def make_post(self, model=ArticleBlogPage, **kwargs):
+        count = BlogDetailPage.objects.count()
+        kwargs.setdefault('custom_title', 'Post %d' % count)
+        kwargs.setdefault('first_published_at', timezone.now())
+        if model is VideoBlogPage:
+            kwargs.setdefault('youtube_video_id', 'abc')
+        post = model(
+            title='Post %d' % count,
+            slug='post-%d' % count,
+            banner_image=self.make_image(),
+            **kwargs
+        )
+        post.blog_authors = [BlogAuthorOrderable(author=self.author)]
+        self.listing.add_child(instance=post)
+        post.categories.add(self.category)
+        post.save()
+        return post
+
+
+class BlogListingQueryTestCase(BlogTestCase):
+
+    def count_listing_queries(self):
+        # Warm up first so missing renditions are generated outside the count
+        list(BlogDetailPage.objects.live().for_listing())
+        with CaptureQueriesContext(connection) as queries:
+            for post in BlogDetailPage.objects.live().for_listing():
+                post.banner_rendition.url
+                post.banner_rendition.alt
+                post.subtitle if isinstance(post, ArticleBlogPage) else post.youtube_video_id
+                [orderable.author.name for orderable in post.blog_authors.all()]
+                [category.slug for category in post.categories.all()]
+        return len(queries)
+
+    def test_for_listing_returns_specific_posts(self):
+        article = self.make_post(subtitle='Sub')
+        video = self.make_post(model=VideoBlogPage)
+
+        posts = list(BlogDetailPage.objects.live().for_listing().order_by('pk'))
+
+        self.assertEqual([type(post) for post in posts], [ArticleBlogPage, VideoBlogPage])
+        self.assertEqual([post.pk for post in posts], [article.pk, video.pk])
+        self.assertEqual(posts[0].subtitle, 'Sub')
+        self.assertEqual(posts[0].banner_rendition.filter_spec, 'fill-250x250')
+
+    def test_listing_query_count_is_constant(self):
+        self.make_post()
+        self.make_post(model=VideoBlogPage)
+        few = self.count_listing_queries()
+
+        for i in range(4):
+            self.make_post()
+            self.make_post(model=VideoBlogPage)
+        many = self.count_listing_queries()
+
+        self.assertEqual(few, many)
+
+    def test_missing_original_gets_a_placeholder(self):
+        post = self.make_post()
+        post.banner_image.file.storage.delete(post.banner_image.file.name)
+
+        [listed] = BlogDetailPage.objects.live().for_listing()
+        self.assertEqual(listed.banner_rendition.url, '/media/not-found')
+        self.assertEqual(self.client.get('/blog/').status_code, 200)
+
+
+class BlogAPIQueryTestCase(BlogTestCase):
+
+    def make_post(self, **kwargs):
+        post = super().make_post(**kwargs)
+        # Every post gets its own author and author image, so nothing is shared
+        author = BlogAuthor.objects.create(name='Author %d' % post.pk, image=self.make_image())
+        BlogAuthorOrderable.objects.create(page=post, author=author)
+        return post
+
+    def count_api_queries(self):
+        params = {'type': 'blog.BlogDetailPage', 'fields': 'blog_authors'}
+        # Warm up first so missing renditions are generated outside the count,
+        # clearing the cached payloads before each request
+        cache.clear()
+        self.client.get('/api/v2/pages/', params)
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/v2/pages/', params)
+        for item in response.json()['items']:
+            self.assertEqual(len(item['blog_authors']), 2)
+            self.assertTrue(item['blog_authors'][1]['image']['url'].endswith('.fill-200x250.png'))
+        return len(queries)
+
+    def test_api_query_count_is_constant(self):
+        self.make_post()
+        few = self.count_api_queries()
+
+        for i in range(4):
+            self.make_post()
+            self.make_post(model=VideoBlogPage)
+        many = self.count_api_queries()
+
+        self.assertEqual(few, many)
+
+    def test_missing_original_is_an_error(self):
+        post = self.make_post()
+        image = post.blog_authors.all()[1].author.image
+        image.file.storage.delete(image.file.name)
+
+        params = {'type': 'blog.BlogDetailPage', 'fields': 'blog_authors'}
+        [item] = self.client.get('/api/v2/pages/', params).json()['items']
+        self.assertEqual(item['blog_authors'][1]['image'], {'error': 'SourceImageIOError'})
+        self.assertTrue(item['blog_authors'][0]['image']['url'].endswith('.fill-200x250.png'))
+
+
+class BlogExportTestCase(BlogTestCase):
+
+    def export(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/v2/export/', {'type': 'blog.BlogDetailPage', **params})
+            lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        return [json.loads(line) for line in lines], len(queries)
+
+    def publish_post(self, **kwargs):
+        post = self.make_post(**kwargs)
+        post.save_revision().publish()
+        return post
+
+    def test_export_streams_posts_in_publish_order(self):
+        first, second = self.publish_post(), self.publish_post(model=VideoBlogPage)
+        records, queries = self.export()
+        self.assertEqual([record['id'] for record in records], [first.pk, second.pk])
+        self.assertEqual(records[0]['blog_authors'][0]['author_name'], 'Author')
+
+        since = records[0]['meta']['last_published_at']
+        records, queries = self.export(since=since)
+        self.assertEqual([record['id'] for record in records], [second.pk])
+
+    def test_export_queries_are_chunked(self):
+        # Each count follows a warm up, so missing renditions are generated outside it
+        self.publish_post()
+        self.export()
+        few = self.export()[1]
+        for i in range(6):
+            self.publish_post()
+        self.export()
+        self.assertEqual(self.export()[1], few)
+
+    def test_bad_parameters(self):
+        self.assertEqual(self.client.get('/api/v2/export/', {'since': 'yesterday'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/v2/export/', {'type': 'home.HomePage'}).status_code, 400)
+
+
+class BlogListingCursorTestCase(BlogTestCase):
+
+    def get_posts(self, **params):
+        request = RequestFactory().get('/blog/', params)
+        return self.listing.get_context(request)['posts']
+
+    @override_settings(PAGINATION_MODE='cursor')
+    def test_cursor_pages_walk_every_post_once(self):
+        created = [self.make_post() for i in range(5)]
+
+        seen = []
+        posts = self.get_posts()
+        self.assertFalse(posts.has_previous())
+        while True:
+            seen.extend(post.pk for post in posts)
+            if not posts.next_cursor:
+                break
+            posts = self.get_posts(cursor=posts.next_cursor)
+
+        self.assertEqual(seen, [post.pk for post in reversed(created)])
+
+        previous = self.get_posts(cursor=posts.previous_cursor)
+        self.assertEqual([post.pk for post in previous], seen[2:4])
+        self.assertTrue(previous.has_next())
+
+    def test_posts_without_a_publish_date_come_last(self):
+        created = [self.make_post(first_published_at=None) for i in range(2)]
+        created += [self.make_post() for i in range(3)]
+        expected = [post.pk for post in created[2:][::-1] + created[:2][::-1]]
+
+        pages = [self.get_posts(page=page) for page in (1, 2, 3)]
+        self.assertEqual([post.pk for posts in pages for post in posts], expected)
+
+        with override_settings(PAGINATION_MODE='cursor'):
+            pages = [self.get_posts()]
+            while pages[-1].next_cursor:
+                pages.append(self.get_posts(cursor=pages[-1].next_cursor))
+            self.assertEqual([post.pk for posts in pages for post in posts], expected)
+
+            previous = self.get_posts(cursor=pages[-1].previous_cursor)
+            self.assertEqual([post.pk for post in previous], expected[2:4])
+
+    def test_bad_cursor_falls_back_to_first_page(self):
+        self.make_post()
+        posts = self.get_posts(cursor='not-a-cursor')
+        self.assertEqual(len(posts), 1)
+        self.assertIsNone(posts.next_cursor)
+
+
+class BlogListingFilterTestCase(BlogTestCase):
+
+    def test_category_and_tag_filters(self):
+        in_category = self.make_post()
+        other = self.make_post()
+        other.categories.clear()
+        other.tags.add('django')
+        other.save()
+
+        response = self.client.get(self.listing.url + '?category=news')
+        self.assertEqual([post.pk for post in response.context['posts']], [in_category.pk])
+
+        response = self.client.get(self.listing.url + 'tag/django/')
+        self.assertEqual([post.pk for post in response.context['posts']], [other.pk])
+        self.assertEqual(response.context['filter_querystring'], 'tag=django')
+
+        response = self.client.get(self.listing.url + 'category/missing/')
+        self.assertEqual(response.status_code, 404)
+
+
+class BlogCacheInvalidationTestCase(BlogTestCase):
+
+    def test_publishing_a_post_bumps_preview_and_listing_generations(self):
+        post = self.make_post()
+        before = get_generations('blog_post_preview', 'blog_listing')
+
+        post.save_revision().publish()
+
+        after = get_generations('blog_post_preview', 'blog_listing')
+        self.assertGreater(after['blog_post_preview'], before['blog_post_preview'])
+        self.assertGreater(after['blog_listing'], before['blog_listing'])
+
+    def test_editing_a_banner_image_bumps_the_preview_generation(self):
+        post = self.make_post()
+        before = get_generation('blog_post_preview')
+
+        post.banner_image.title = 'Renamed'
+        post.banner_image.save()
+
+        self.assertGreater(get_generation('blog_post_preview'), before)
 
-# Create your tests here.
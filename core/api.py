@@ -0,0 +1,365 @@
+""" Cached, conditional versions of wagtail's v2 API endpoints.
+
+Listing and detail payloads are cached as serialized data, keyed on the
+host, path and query string plus the generation of the endpoint's namespace.
+The pages namespace is bumped by core.signals whenever the invalidation
+registry reports pages as changed (publishes, moves, deletes and changes to
+the snippets and images shown on pages), images and documents by the handlers
+below. Each payload gets an ETag from its key and the newest last_published_at
+(or created_at) at the time it was built, so clients polling with
+If-None-Match get a 304 from a single cache lookup. Last-Modified is only
+informative, If-Modified-Since alone never gets a 304.
+
+The pages endpoint also takes ?expand=, a comma separated list of dotted
+paths to related images and pages (e.g. banner_image,carousel_images.carousel_image)
+to inline in the same response, with ?rendition= picking an image rendition.
+
+PageExportView streams every live page of a few types as newline-delimited
+JSON, in the same format as the pages endpoint's items, for bulk consumers.
+"""
+import datetime
+import functools
+import hashlib
+import json
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Max
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date, quote_etag, urlencode
+from django.views.generic import View
+
+from rest_framework.fields import DateTimeField
+from rest_framework.response import Response
+
+from wagtail.api.v2.utils import BadRequestError
+from wagtail.api.v2.views import PagesAPIViewSet
+from wagtail.core.models import Page, PageViewRestriction
+from wagtail.documents import get_document_model
+from wagtail.documents.api.v2.views import DocumentsAPIViewSet
+from wagtail.images import get_image_model
+from wagtail.images.api.v2.views import ImagesAPIViewSet
+
+from .cache import Fragment, get_generation, invalidation
+from .images import get_rendition_or_error, prefetch_rendition_specs, rendition_representation
+from .pages import specific_in_bulk
+from .renditions import discover_filter_specs
+from .streams import api_stream_fields, prefetch_stream_representations
+
+PAGES_API_NAMESPACE = 'api:pages'
+IMAGES_API_NAMESPACE = 'api:images'
+DOCUMENTS_API_NAMESPACE = 'api:documents'
+
+
+class CachedAPIViewSetMixin:
+    """ Serves listing and detail payloads from the cache until cache_namespace is bumped """
+
+    cache_namespace = None
+
+    def get_last_modified(self):
+        """ When the newest object this endpoint serves last changed, for the ETag and Last-Modified """
+        return None
+
+    def cache_key(self, request):
+        key = '|'.join([
+            request.get_host(),
+            request.path,
+            urlencode(sorted(request.GET.items())),
+            str(get_generation(self.cache_namespace)),
+        ])
+        return 'api_response:%s' % hashlib.md5(key.encode()).hexdigest()
+
+    def serve_cached(self, request, view, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return view(request, *args, **kwargs)
+
+        key = self.cache_key(request)
+        cached = cache.get(key)
+        if cached is None:
+            response = view(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+
+            last_modified = self.get_last_modified()
+            version = '%s:%s' % (key, last_modified.isoformat() if last_modified else '')
+            cached = {
+                'data': response.data,
+                'etag': quote_etag(hashlib.md5(version.encode()).hexdigest()),
+                'last_modified': int(last_modified.timestamp()) if last_modified else None,
+            }
+            cache.set(key, cached, getattr(settings, 'API_CACHE_TIMEOUT', 60 * 60 * 24 * 7))
+
+        # Renaming an author or editing an image leaves the newest last_published_at
+        # (or created_at) alone, only the ETag follows the generation
+        response = get_conditional_response(request, etag=cached['etag'])
+        if response is None:
+            response = Response(cached['data'])
+        response['ETag'] = cached['etag']
+        if cached['last_modified']:
+            response['Last-Modified'] = http_date(cached['last_modified'])
+        return response
+
+    def listing_view(self, request):
+        return self.serve_cached(request, super().listing_view)
+
+    def detail_view(self, request, pk):
+        return self.serve_cached(request, super().detail_view, pk)
+
+
+def prefetch_api_fields(model, pages, fields=None):
+    """ Load what the api fields of many pages of one type need, in a fixed number of queries.
+
+    The stored StreamField representations are loaded for every page type,
+    other things by the page type's prefetch_api_fields(pages, fields)
+    classmethod. fields is None when every api field is shown.
+    """
+    if any(fields is None or field.name in fields for field in api_stream_fields(model)):
+        prefetch_stream_representations(pages)
+    if hasattr(model, 'prefetch_api_fields'):
+        model.prefetch_api_fields(pages, fields)
+
+
+@functools.lru_cache()
+def expandable_renditions():
+    # Only the specs the site already uses, so requests can't make up new ones to generate
+    return frozenset(discover_filter_specs())
+
+
+def find_nested(value, path):
+    """ The related object dicts at a dotted path in serialized data, through lists on the way """
+    if isinstance(value, list):
+        return [found for item in value for found in find_nested(item, path)]
+    if not isinstance(value, dict):
+        return []
+    if not path:
+        return [value] if 'meta' in value else []
+    return find_nested(value.get(path[0]), path[1:])
+
+
+class PageExpansionMixin:
+    """ Inlines the related images and pages named by ?expand=, in a few bulk queries.
+
+    Images gain their width and height, and a rendition when ?rendition= names
+    one. Pages are replaced by all of their listing fields.
+    """
+
+    def get_expand_paths(self):
+        expand = self.request.GET.get('expand')
+        return [name.strip().split('.') for name in expand.split(',') if name.strip()] if expand else []
+
+    def get_expand_rendition(self):
+        spec = self.request.GET.get('rendition')
+        if spec and spec not in expandable_renditions():
+            raise BadRequestError("rendition isn't used on the site: %s" % spec)
+        return spec
+
+    def listing_view(self, request):
+        response = super().listing_view(request)
+        self.expand(response.data['items'])
+        return response
+
+    def detail_view(self, request, pk):
+        response = super().detail_view(request, pk)
+        self.expand([response.data])
+        return response
+
+    def expand(self, items):
+        paths = self.get_expand_paths()
+        if not paths:
+            return
+        spec = self.get_expand_rendition()
+
+        images, pages = {}, {}
+        Image = get_image_model()
+        for item in items:
+            for path in paths:
+                for nested in find_nested(item, path):
+                    try:
+                        model = apps.get_model(nested['meta']['type'])
+                    except (LookupError, ValueError):
+                        continue
+                    if issubclass(model, Image):
+                        images.setdefault(nested['id'], []).append(nested)
+                    elif issubclass(model, Page):
+                        pages.setdefault(nested['id'], []).append(nested)
+
+        if images:
+            self.expand_images(images, spec)
+        if pages:
+            self.expand_pages(pages)
+
+    def expand_images(self, nested_images, spec):
+        images = get_image_model().objects.in_bulk(nested_images.keys())
+        renditions = prefetch_rendition_specs(
+            images.values(), [spec], get_rendition=get_rendition_or_error,
+        ) if spec else {}
+        for pk, image in images.items():
+            rendition = renditions.get((pk, spec))
+            for nested in nested_images[pk]:
+                nested['width'], nested['height'] = image.width, image.height
+                if rendition is not None:
+                    nested['rendition'] = rendition_representation(rendition)
+
+    def expand_pages(self, nested_pages):
+        pks_and_types = self.get_base_queryset().filter(
+            pk__in=nested_pages.keys(),
+        ).values_list('pk', 'content_type')
+        specific = specific_in_bulk(pks_and_types)
+
+        by_model = {}
+        for page in specific.values():
+            by_model.setdefault(type(page), []).append(page)
+        context = self.get_serializer_context()
+        for model, model_pages in by_model.items():
+            serializer_class = self._get_serializer_class(
+                self.request.wagtailapi_router, model, [('*', False, None)],
+            )
+            prefetch_api_fields(model, model_pages, serializer_class.Meta.fields)
+            for page in model_pages:
+                data = serializer_class(page, context=context).data
+                for nested in nested_pages[page.pk]:
+                    nested.clear()
+                    nested.update(data)
+
+
+class CachedPagesAPIViewSet(CachedAPIViewSetMixin, PageExpansionMixin, PagesAPIViewSet):
+    cache_namespace = PAGES_API_NAMESPACE
+    known_query_parameters = PagesAPIViewSet.known_query_parameters.union(['expand', 'rendition'])
+
+    def get_serializer(self, instance, *args, **kwargs):
+        """ Loads what the api fields need for the whole page of results at once """
+        if kwargs.get('many'):
+            pages, fields = list(instance), self.get_serializer_class().Meta.fields
+        else:
+            pages, fields = [instance], None
+        by_model = {}
+        for page in pages:
+            by_model.setdefault(type(page), []).append(page)
+        for model, model_pages in by_model.items():
+            prefetch_api_fields(model, model_pages, fields)
+        return super().get_serializer(instance, *args, **kwargs)
+
+    def get_last_modified(self):
+        return self.get_base_queryset().aggregate(newest=Max('last_published_at'))['newest']
+
+
+class CachedImagesAPIViewSet(CachedAPIViewSetMixin, ImagesAPIViewSet):
+    cache_namespace = IMAGES_API_NAMESPACE
+
+    def get_last_modified(self):
+        return self.model.objects.aggregate(newest=Max('created_at'))['newest']
+
+
+class CachedDocumentsAPIViewSet(CachedAPIViewSetMixin, DocumentsAPIViewSet):
+    cache_namespace = DOCUMENTS_API_NAMESPACE
+
+    def get_last_modified(self):
+        return self.model.objects.aggregate(newest=Max('created_at'))['newest']
+
+
+class PageExportView(View):
+    """ Streams live pages as newline-delimited JSON, oldest change first.
+
+    Each line is a pages endpoint item with every listing field, plus
+    meta.last_published_at. Pass the newest last_published_at seen as
+    ?since= to only get the pages published after it. ?type= picks some of
+    the exported types, comma separated.
+
+        api_export = PageExportView.as_view(router=api_router, models=[BlogDetailPage])
+    """
+
+    router = None
+    models = []
+    chunk_size = 200
+    endpoint_class = CachedPagesAPIViewSet
+
+    def get(self, request):
+        try:
+            since = self.parse_since(request.GET.get('since'))
+            models = self.parse_models(request.GET.get('type'))
+        except ValueError as e:
+            return JsonResponse({'message': str(e)}, status=400)
+
+        response = StreamingHttpResponse(
+            self.stream(request, models, since), content_type='application/x-ndjson',
+        )
+        response['Cache-Control'] = 'no-cache'
+        return response
+
+    def parse_since(self, since):
+        if not since:
+            return None
+        # A + in the offset arrives as a space when it isn't escaped
+        parsed = parse_datetime(since.replace(' ', '+'))
+        if parsed is None:
+            raise ValueError("since isn't a datetime: %s" % since)
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed, datetime.timezone.utc)
+        return parsed
+
+    def parse_models(self, types):
+        if not types:
+            return self.models
+        by_name = {model._meta.label_lower: model for model in self.models}
+        try:
+            return [by_name[name.strip().lower()] for name in types.split(',')]
+        except KeyError as e:
+            raise ValueError("type can't be exported: %s" % e.args[0])
+
+    def get_queryset(self, model, since):
+        queryset = model.objects.live().public()
+        if since is not None:
+            queryset = queryset.filter(last_published_at__gt=since)
+        return queryset.order_by('last_published_at', 'pk')
+
+    def chunks(self, queryset):
+        # iterator() can't prefetch, so the prefetching happens one chunk at a time
+        chunk = []
+        for page in queryset.iterator(chunk_size=self.chunk_size):
+            chunk.append(page)
+            if len(chunk) == self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def stream(self, request, models, since):
+        view = self.endpoint_class()
+        view.request = request
+        context = {'request': request, 'view': view, 'router': self.router}
+        last_published_at = DateTimeField()
+
+        for model in models:
+            serializer_class = self.endpoint_class._get_serializer_class(
+                self.router, model, [('*', False, None)],
+            )
+            for chunk in self.chunks(self.get_queryset(model, since)):
+                prefetch_api_fields(model, chunk, serializer_class.Meta.fields)
+                for page in chunk:
+                    data = serializer_class(page, context=context).data
+                    data['meta']['last_published_at'] = last_published_at.to_representation(
+                        page.last_published_at
+                    )
+                    yield json.dumps(data, cls=DjangoJSONEncoder) + '\n'
+
+
+@invalidation.register(get_image_model())
+def api_image_changed(image):
+    yield Fragment(IMAGES_API_NAMESPACE)
+
+
+@invalidation.register(get_document_model())
+def api_document_changed(document):
+    yield Fragment(DOCUMENTS_API_NAMESPACE)
+
+
+@invalidation.register(PageViewRestriction)
+def api_restriction_changed(restriction):
+    """ Restricted pages and everything below them leave the API, lifting one brings them back """
+    yield Fragment(PAGES_API_NAMESPACE)
+    yield from Page.objects.descendant_of(restriction.page, inclusive=True).only('pk')
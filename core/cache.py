@@ -0,0 +1,148 @@
+""" Cache generations and the invalidation registry.
+
+Cached fragments include the generation number of their namespace in their
+key, so bumping one counter invalidates every key in the family, whatever
+else it varies on.
+
+Models register a handler saying which fragment namespaces and pages depend
+on them. The receivers in core.signals run those handlers whenever a
+registered model is published, unpublished, moved, saved or deleted, so
+cached fragments can keep long timeouts without going stale.
+"""
+import time
+from collections import namedtuple
+
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.backends.memcached import BaseMemcachedCache
+from django.dispatch import Signal
+
+from wagtail.core.models import Page
+
+
+def cache_is_shared():
+    """ Whether other processes see the default cache, which a management command's changes need """
+    return not isinstance(caches['default'], (LocMemCache, DummyCache))
+
+
+def cache_is_atomic():
+    """ Whether incr() and add() on the default cache can't interleave with another process's """
+    backend = caches['default']
+    return (
+        isinstance(backend, (BaseMemcachedCache, LocMemCache, DummyCache))
+        or type(backend).__module__.startswith('django_redis.')
+    )
+
+
+def generation_key(namespace):
+    return 'generation:%s' % namespace
+
+
+def initial_generation():
+    # Counters start from the clock, so one that got evicted from the cache
+    # comes back higher and never reuses the keys of an older generation
+    return time.time_ns() // 1000
+
+
+def get_generations(*namespaces):
+    """ The current generation of each namespace, fetched in one cache call """
+    keys = {generation_key(namespace): namespace for namespace in namespaces}
+    found = cache.get_many(keys.keys())
+    generations = {}
+    for key, namespace in keys.items():
+        if key not in found:
+            cache.add(key, initial_generation(), None)
+            found[key] = cache.get(key)
+        generations[namespace] = found[key]
+    return generations
+
+
+def get_generation(namespace):
+    return get_generations(namespace)[namespace]
+
+
+def bump_generation(namespace):
+    """ Invalidates every key built with the namespace's current generation """
+    key = generation_key(namespace)
+    if not cache_is_atomic():
+        # incr() is a get and a set here, so a bump racing another one could
+        # be lost. A fresh value from the clock replaces the counter instead,
+        # still moving past the current one if the clock is behind it
+        generation = max(initial_generation(), (cache.get(key) or 0) + 1)
+        cache.set(key, generation, None)
+        return generation
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, initial_generation(), None)
+        return cache.get(key)
+
+
+Fragment = namedtuple('Fragment', ['name'])
+
+# Yielded by handlers for changes that show up on every page, like the menu
+EVERY_PAGE = 'every-page'
+
+# Sent with the pages affected by a change, for page level caches to purge
+pages_invalidated = Signal()
+
+
+class Invalidation:
+    """ The fragments and pages affected by one change """
+
+    def __init__(self, fragments=(), pages=()):
+        self.fragments = set(fragments)
+        self.pages = list(pages)
+
+    def __bool__(self):
+        return bool(self.fragments or self.pages)
+
+
+class InvalidationRegistry:
+    """ Maps models to handlers that yield the Fragment namespaces and Pages a change affects """
+
+    def __init__(self):
+        self._handlers = {}
+
+    def register(self, *models):
+        """ Decorator registering a handler for one or more models and their subclasses """
+        def decorator(handler):
+            for model in models:
+                self._handlers.setdefault(model, []).append(handler)
+            return handler
+        return decorator
+
+    def is_registered(self, model):
+        return any(klass in self._handlers for klass in model.__mro__)
+
+    def collect(self, instance):
+        """ Run every handler registered for the instance's class and its parents """
+        invalidation = Invalidation()
+        for klass in type(instance).__mro__:
+            for handler in self._handlers.get(klass, []):
+                for item in handler(instance):
+                    if isinstance(item, Fragment):
+                        invalidation.fragments.add(item)
+                    else:
+                        invalidation.pages.append(item)
+        return invalidation
+
+    def purge(self, invalidation, sender=None):
+        for fragment in invalidation.fragments:
+            bump_generation(fragment.name)
+        if invalidation.pages:
+            pages_invalidated.send(sender=sender, pages=invalidation.pages)
+
+    def invalidate(self, instance):
+        self.purge(self.collect(instance), sender=type(instance))
+
+
+invalidation = InvalidationRegistry()
+
+
+@invalidation.register(Page)
+def page_changed(page):
+    """ A page is always affected by its own changes, and so is the sitemap """
+    yield page
+    yield Fragment('sitemap')
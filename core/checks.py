@@ -0,0 +1,22 @@
+""" System checks for the settings the caches rely on """
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+from .cache import cache_is_atomic, cache_is_shared
+
+
+@register(Tags.caches)
+def check_atomic_cache(app_configs, **kwargs):
+    """ The search hit slots, generations and autocomplete changes need incr() and add() to be atomic """
+    if not getattr(settings, 'CACHE_REQUIRE_ATOMIC', False):
+        return []
+    if cache_is_shared() and cache_is_atomic():
+        return []
+    return [Error(
+        "The default cache's incr() and add() aren't atomic across processes.",
+        hint=(
+            "Use memcached (or redis) as the default cache, concurrent search hits, "
+            "cache generation bumps and autocomplete changes can be lost otherwise."
+        ),
+        id='core.E001',
+    )]
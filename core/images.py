@@ -0,0 +1,174 @@
+""" Image helpers shared by the page models and templates """
+import re
+from collections import OrderedDict
+
+from django.conf import settings
+
+from wagtail.images import get_image_model
+from wagtail.images.api.fields import ImageRenditionField
+from wagtail.images.models import Filter, SourceImageIOError
+from wagtail.images.shortcuts import get_rendition_or_not_found
+
+FILL_RE = re.compile(r'^fill-(\d+)x(\d+)(-c\d+)?$')
+WIDTH_RE = re.compile(r'^width-(\d+)$')
+
+# Stands in for the rendition of an image whose original file is missing, in the API
+SOURCE_IMAGE_ERROR = 'SourceImageIOError'
+
+
+def prefetch_rendition_specs(images, filter_specs, get_rendition=get_rendition_or_not_found):
+    """ Fetch the renditions of many images for many specs in one query, only generating the missing ones.
+
+    Returns a dict mapping (image id, filter spec) to renditions. Missing ones
+    are generated with get_rendition(image, filter), which by default gives
+    images whose original file is missing the placeholder {% image %} outputs.
+    """
+    images = {image.pk: image for image in images if image is not None}
+    if not images:
+        return {}
+
+    filters = {spec: Filter(spec=spec) for spec in filter_specs}
+    focal_point_keys = {
+        (pk, spec): filter.get_cache_key(image)
+        for pk, image in images.items() for spec, filter in filters.items()
+    }
+    Rendition = get_image_model().get_rendition_model()
+
+    renditions = {}
+    existing = Rendition.objects.filter(image_id__in=images.keys(), filter_spec__in=filters.keys())
+    for rendition in existing:
+        key = (rendition.image_id, rendition.filter_spec)
+        if rendition.focal_point_key == focal_point_keys.get(key):
+            # Reuse the image we already have so rendition.alt doesn't query again
+            rendition.image = images[rendition.image_id]
+            renditions[key] = rendition
+
+    for (pk, spec) in focal_point_keys:
+        if (pk, spec) not in renditions:
+            renditions[pk, spec] = get_rendition(images[pk], filters[spec])
+
+    return renditions
+
+
+def prefetch_renditions(images, filter_spec):
+    """ Fetch the renditions of many images in one query, only generating the missing ones.
+
+    Returns a dict mapping image ids to renditions.
+    """
+    renditions = prefetch_rendition_specs(images, [filter_spec])
+    return {pk: rendition for (pk, spec), rendition in renditions.items()}
+
+
+def get_rendition_or_error(image, filter):
+    """ The rendition, or SOURCE_IMAGE_ERROR when the original file is missing """
+    try:
+        return image.get_rendition(filter)
+    except SourceImageIOError:
+        return SOURCE_IMAGE_ERROR
+
+
+def attach_renditions(images, filter_specs):
+    """ Fetch the renditions of many images for many specs in one query, for PrefetchedImageRenditionField.
+
+    Sets image.prefetched_renditions to {filter spec: rendition} on each image.
+    """
+    images = [image for image in images if image is not None]
+    renditions = prefetch_rendition_specs(images, filter_specs, get_rendition=get_rendition_or_error)
+    for image in images:
+        image.prefetched_renditions = {
+            spec: renditions[image.pk, spec] for spec in filter_specs
+        }
+
+
+class PrefetchedImageRenditionField(ImageRenditionField):
+    """ ImageRenditionField that uses the image's prefetched_renditions when it has them """
+
+    def to_representation(self, image):
+        rendition = getattr(image, 'prefetched_renditions', {}).get(self.filter_spec)
+        if rendition is None:
+            return super().to_representation(image)
+        return rendition_representation(rendition)
+
+
+def rendition_representation(rendition):
+    """ A rendition as ImageRenditionField shows it in the API """
+    if rendition == SOURCE_IMAGE_ERROR:
+        return OrderedDict([('error', SOURCE_IMAGE_ERROR)])
+    return OrderedDict([
+        ('url', rendition.url),
+        ('width', rendition.width),
+        ('height', rendition.height),
+        ('alt', rendition.alt),
+    ])
+
+
+def srcset_specs(filter_spec, widths=None):
+    """ The narrower variants of a fill-WxH or width-W spec, for srcset. Other specs have none """
+    if widths is None:
+        widths = getattr(settings, 'IMAGE_SRCSET_WIDTHS', [])
+
+    fill = FILL_RE.match(filter_spec)
+    if fill:
+        width, height, crop = int(fill.group(1)), int(fill.group(2)), fill.group(3) or ''
+        return [
+            'fill-%dx%d%s' % (w, round(height * w / width), crop) for w in widths if w < width
+        ]
+    width = WIDTH_RE.match(filter_spec)
+    if width:
+        return ['width-%d' % w for w in widths if w < int(width.group(1))]
+    return []
+
+
+def webp_spec(filter_spec):
+    return '%s|format-webp' % filter_spec
+
+
+def responsive_specs(filter_spec):
+    """ Every spec a ResponsiveImage of filter_spec is made of """
+    specs = [filter_spec] + srcset_specs(filter_spec)
+    return specs + [webp_spec(spec) for spec in specs]
+
+
+class ResponsiveImage:
+    """ A rendition plus its narrower and WebP variants. Behaves like the rendition in templates """
+
+    def __init__(self, rendition, variants, webp_variants):
+        self.rendition = rendition
+        self.variants = variants
+        self.webp_variants = webp_variants
+
+    def __getattr__(self, name):
+        return getattr(self.rendition, name)
+
+    @staticmethod
+    def _srcset(renditions):
+        widths = {}
+        for rendition in renditions:
+            # Placeholders for missing originals have no width to offer
+            if rendition.width:
+                # Small originals give the same width more than once
+                widths.setdefault(rendition.width, rendition)
+        return ', '.join('%s %dw' % (r.url, width) for width, r in sorted(widths.items()))
+
+    @property
+    def srcset(self):
+        return self._srcset(self.variants)
+
+    @property
+    def webp_srcset(self):
+        return self._srcset(self.webp_variants)
+
+
+def prefetch_responsive_renditions(images, filter_spec):
+    """ Like prefetch_renditions, with ResponsiveImages for every image, still in one query """
+    images = [image for image in images if image is not None]
+    specs = [filter_spec] + srcset_specs(filter_spec)
+    renditions = prefetch_rendition_specs(images, responsive_specs(filter_spec))
+    return {
+        image.pk: ResponsiveImage(
+            renditions[image.pk, filter_spec],
+            [renditions[image.pk, spec] for spec in specs],
+            [renditions[image.pk, webp_spec(spec)] for spec in specs],
+        )
+        for image in images
+    }
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core.sitemaps import rebuild_sitemap
+
+
+class Command(BaseCommand):
+    help = "Build the sitemap entry of every page, e.g. for pages published before the sitemap was stored"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        entries = rebuild_sitemap(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS("Built the sitemap entries of %d pages" % entries))
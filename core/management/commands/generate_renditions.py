@@ -0,0 +1,86 @@
+from django.core.management.base import BaseCommand
+
+from wagtail.images import get_image_model
+
+from core.renditions import discover_filter_specs, generate_missing_renditions, missing_filter_specs
+
+
+class Command(BaseCommand):
+    help = "Generate the missing renditions for every filter spec the site uses"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help="List the specs and count the missing renditions without generating them",
+        )
+        parser.add_argument(
+            '--workers', type=int, default=None,
+            help="Number of worker processes, defaults to the number of CPUs. 1 runs in this process",
+        )
+        parser.add_argument(
+            '--spec', action='append', dest='specs',
+            help="Only generate this filter spec (can be repeated)",
+        )
+        parser.add_argument(
+            '--image', action='append', type=int, dest='image_ids',
+            help="Only generate renditions of this image id (can be repeated)",
+        )
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def batches(self, images, batch_size):
+        """ The images, batch_size at a time in pk order """
+        last_pk = 0
+        while True:
+            batch = list(images.filter(pk__gt=last_pk).order_by('pk')[:batch_size])
+            if not batch:
+                return
+            yield batch
+            last_pk = batch[-1].pk
+
+    def handle(self, *args, **options):
+        specs = options['specs'] or discover_filter_specs()
+        self.stdout.write("Filter specs: %s" % ', '.join(specs))
+
+        images = get_image_model().objects.all()
+        if options['image_ids']:
+            images = images.filter(pk__in=options['image_ids'])
+
+        spec_counts = dict.fromkeys(specs, 0)
+        image_count = created = done = 0
+        failed = []
+
+        def progress(batch_done, batch_total, image_id, error):
+            if error:
+                failed.append(image_id)
+                self.stderr.write("[%d] image %s failed: %s" % (done + batch_done, image_id, error))
+            elif options['verbosity'] > 1 or (done + batch_done) % 50 == 0:
+                self.stdout.write("[%d] image %s" % (done + batch_done, image_id))
+
+        # Missing renditions are looked up and generated a batch at a time, so
+        # neither the images nor the id list of the query grow with the library
+        for batch in self.batches(images, options['batch_size']):
+            missing = missing_filter_specs(batch, specs)
+            image_count += len(missing)
+            for image_specs in missing.values():
+                for spec in image_specs:
+                    spec_counts[spec] += 1
+            if not options['dry_run']:
+                created += generate_missing_renditions(missing, workers=options['workers'], progress=progress)
+                done += len(missing)
+
+        rendition_count = sum(spec_counts.values())
+        if options['dry_run']:
+            for spec in specs:
+                self.stdout.write("  %s: %d missing" % (spec, spec_counts[spec]))
+            self.stdout.write("%d renditions missing across %d images" % (rendition_count, image_count))
+            return
+
+        if not image_count:
+            self.stdout.write("All renditions are up to date")
+            return
+
+        self.stdout.write(self.style.SUCCESS(
+            "Generated %d renditions for %d images" % (created, image_count)
+        ))
+        if failed:
+            self.stderr.write("%d images failed" % len(failed))
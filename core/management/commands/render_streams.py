@@ -0,0 +1,14 @@
+from core.streams import rendered_stream_fields, store_stream_renderings
+from .store_stream_representations import Command as StoreCommand
+
+
+class Command(StoreCommand):
+    help = "Store the HTML of every live page's rendered StreamFields, e.g. after turning on STREAMFIELD_RENDER_ON_PUBLISH"
+
+    stored_name = 'renderings'
+
+    def stream_fields(self, model):
+        return rendered_stream_fields(model)
+
+    def store(self, pages):
+        return len(store_stream_renderings(pages))
@@ -0,0 +1,14 @@
+from core.streams import store_stream_references, stream_fields
+from .store_stream_representations import Command as StoreCommand
+
+
+class Command(StoreCommand):
+    help = "Record what every live page's StreamFields show, e.g. for pages published before it was recorded"
+
+    stored_name = 'references'
+
+    def stream_fields(self, model):
+        return stream_fields(model)
+
+    def store(self, pages):
+        return len(store_stream_references(pages))
@@ -0,0 +1,49 @@
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+
+from wagtail.core.models import Page, get_page_models
+
+from core.pages import specific_in_bulk
+from core.streams import api_stream_fields, store_stream_representations
+
+
+class Command(BaseCommand):
+    help = "Store the API representation of every live page's StreamFields, e.g. for pages published before it was stored"
+
+    stored_name = 'representations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+
+    def batches(self, content_types, batch_size):
+        """ Specific live pages of the content types, batch_size at a time """
+        last_pk = 0
+        while True:
+            rows = list(
+                Page.objects.live().filter(pk__gt=last_pk, content_type__in=content_types)
+                .order_by('pk').values_list('pk', 'content_type_id')[:batch_size]
+            )
+            if not rows:
+                return
+            yield list(specific_in_bulk(rows).values())
+            last_pk = rows[-1][0]
+
+    def stream_fields(self, model):
+        return api_stream_fields(model)
+
+    def store(self, pages):
+        return store_stream_representations(pages)
+
+    def handle(self, *args, **options):
+        models = [model for model in get_page_models() if self.stream_fields(model)]
+        content_types = ContentType.objects.get_for_models(*models).values()
+
+        pages = fields = 0
+        for batch in self.batches(list(content_types), options['batch_size']):
+            fields += self.store(batch)
+            pages += len(batch)
+            self.stdout.write("Stored %d pages" % pages)
+
+        self.stdout.write(self.style.SUCCESS(
+            "Stored %d StreamField %s of %d pages" % (fields, self.stored_name, pages)
+        ))
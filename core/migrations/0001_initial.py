@@ -0,0 +1,29 @@
+# Generated by Django 3.1.1 on 2026-10-18 11:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('wagtailcore', '0052_pagelogentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StreamFieldRepresentation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('field_name', models.CharField(max_length=255)),
+                ('source_hash', models.CharField(max_length=32)),
+                ('data', models.JSONField()),
+                ('page', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='wagtailcore.page')),
+            ],
+            options={
+                'unique_together': {('page', 'field_name')},
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.1.1 on 2026-10-18 12:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wagtailcore', '0052_pagelogentry'),
+        ('core', '0002_stream_renderings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SitemapEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('xml', models.TextField()),
+                ('lastmod', models.DateTimeField(null=True)),
+                ('page', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='wagtailcore.page')),
+                ('site', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='wagtailcore.site')),
+            ],
+        ),
+    ]
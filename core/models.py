@@ -1,3 +1,48 @@
 from django.db import models
 
-# Create your models here.
+
+class StreamFieldRepresentation(models.Model):
+    """ The API representation of a live page's StreamField, serialized when the page is published """
+
+    page = models.ForeignKey('wagtailcore.Page', on_delete=models.CASCADE, related_name='+')
+    field_name = models.CharField(max_length=255)
+    # Of the raw stream it was serialized from, a mismatch means the page changed some other way
+    source_hash = models.CharField(max_length=32)
+    data = models.JSONField()
+
+    class Meta:
+        unique_together = [('page', 'field_name')]
+
+
+class StreamFieldRendering(models.Model):
+    """ The HTML of a live page's StreamField, rendered when the page is published """
+
+    page = models.ForeignKey('wagtailcore.Page', on_delete=models.CASCADE, related_name='+')
+    field_name = models.CharField(max_length=255)
+    source_hash = models.CharField(max_length=32)
+    # Of the block templates it was rendered with, a mismatch means they changed in a deploy
+    templates_hash = models.CharField(max_length=32)
+    html = models.TextField()
+
+    class Meta:
+        unique_together = [('page', 'field_name')]
+
+
+class StreamFieldReference(models.Model):
+    """ A page, image, document or snippet shown in one of a page's rendered StreamFields """
+
+    page = models.ForeignKey('wagtailcore.Page', on_delete=models.CASCADE, related_name='+')
+    content_type = models.ForeignKey('contenttypes.ContentType', on_delete=models.CASCADE, related_name='+')
+    object_id = models.PositiveIntegerField()
+
+    class Meta:
+        index_together = [('content_type', 'object_id')]
+
+
+class SitemapEntry(models.Model):
+    """ The <url> elements of a live, public page in the sitemap, built when the page is published """
+
+    page = models.OneToOneField('wagtailcore.Page', on_delete=models.CASCADE, related_name='+')
+    site = models.ForeignKey('wagtailcore.Site', on_delete=models.CASCADE, related_name='+')
+    xml = models.TextField()
+    lastmod = models.DateTimeField(null=True)
@@ -0,0 +1,129 @@
+""" Whole-response cache for anonymous visitors.
+
+Page types opt in with CachedPageMixin, other views with the cache_response
+decorator. Responses are keyed on the host, path and an allow-list of query
+parameters, plus generation counters that core.signals bumps whenever the
+invalidation registry reports a page as changed.
+"""
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, has_vary_header
+from django.utils.http import http_date, quote_etag, urlencode
+
+from .cache import EVERY_PAGE, bump_generation, get_generations
+
+# Bumped for changes that show up on every page, like the menu or footer
+PAGE_NAMESPACE = 'page_response'
+
+
+def page_namespace(page_id):
+    return '%s:%s' % (PAGE_NAMESPACE, page_id)
+
+
+def is_cacheable_request(request):
+    if not getattr(settings, 'PAGE_CACHE_ENABLED', False):
+        return False
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    if getattr(request, 'is_preview', False):
+        return False
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return False
+    allowed = getattr(settings, 'PAGE_CACHE_QUERY_PARAMS', ['page'])
+    return all(param in allowed for param in request.GET)
+
+
+def is_cacheable_response(request, response):
+    # Anything that sets a cookie or varies on one is specific to one visitor.
+    # A form's CSRF token only gets its cookie once the view has returned, by
+    # which time the middleware's flag on the request is all there is to see
+    return (
+        response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+        and not request.META.get('CSRF_COOKIE_USED')
+        and not has_vary_header(response, 'Cookie')
+    )
+
+
+def response_cache_key(request, namespaces):
+    generations = get_generations(PAGE_NAMESPACE, *namespaces)
+    key = '|'.join([
+        request.get_host(),
+        request.path,
+        urlencode(sorted(request.GET.items())),
+        ':'.join(str(generations[namespace]) for namespace in sorted(generations)),
+    ])
+    return 'page_response:%s' % hashlib.md5(key.encode()).hexdigest()
+
+
+def serve_cached(request, render, namespaces=(), last_modified=None):
+    """ Serve a response from the cache, or call render() and cache what it returns """
+    if not is_cacheable_request(request):
+        return render()
+
+    key = response_cache_key(request, namespaces)
+    cached = cache.get(key)
+    if cached is None:
+        response = render()
+        if hasattr(response, 'render') and not response.is_rendered:
+            response.render()
+        if not is_cacheable_response(request, response):
+            return response
+
+        # The key changes with every publish, so it's a good enough version
+        version = '%s:%s' % (key, last_modified.isoformat() if last_modified else '')
+        cached = {
+            'content': response.content,
+            'content_type': response['Content-Type'],
+            'etag': quote_etag(hashlib.md5(version.encode()).hexdigest()),
+            'last_modified': int(last_modified.timestamp()) if last_modified else None,
+        }
+        cache.set(key, cached, getattr(settings, 'PAGE_CACHE_TIMEOUT', 60 * 60 * 24 * 7))
+
+    # Only the ETag changes with the generations, a menu edit leaves the page's
+    # Last-Modified alone, so If-Modified-Since can't tell whether it's fresh
+    response = get_conditional_response(request, etag=cached['etag'])
+    if response is None:
+        response = HttpResponse(cached['content'], content_type=cached['content_type'])
+    response['ETag'] = cached['etag']
+    if cached['last_modified']:
+        response['Last-Modified'] = http_date(cached['last_modified'])
+    return response
+
+
+def cache_response(*namespaces):
+    """ View decorator caching anonymous responses until one of the namespaces is bumped """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(request, *args, **kwargs):
+            return serve_cached(request, lambda: view(request, *args, **kwargs), namespaces)
+        return wrapped
+    return decorator
+
+
+def purge_pages(pages):
+    """ Drop the cached responses of the given pages, or of every page for EVERY_PAGE """
+    if EVERY_PAGE in pages:
+        bump_generation(PAGE_NAMESPACE)
+        return
+    for page_id in {page.pk for page in pages}:
+        bump_generation(page_namespace(page_id))
+
+
+class CachedPageMixin:
+    """ Opts a page type into the anonymous response cache """
+
+    def serve(self, request, *args, **kwargs):
+        serve = super().serve
+        return serve_cached(
+            request,
+            lambda: serve(request, *args, **kwargs),
+            namespaces=[page_namespace(self.pk)],
+            last_modified=self.last_published_at,
+        )
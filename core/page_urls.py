@@ -0,0 +1,133 @@
+""" Page id -> url index.
+
+Working out a page's url needs its row and the site root paths. The index
+keeps (url, full_url) for every page in the shared cache, updated
+incrementally when pages are published, moved or deleted. Each process also
+keeps the entries it has used, until the next change to the index.
+
+Within a request (see PageUrlsMiddleware) or a page_url_scope() block the
+index's generation is only checked once, rather than on every url looked up.
+"""
+import threading
+from contextlib import contextmanager
+
+from django.core.cache import cache
+
+from wagtail.core.models import Page, Site
+
+from .cache import EVERY_PAGE, Fragment, bump_generation, get_generations, invalidation
+
+INDEX_NAMESPACE = 'page_urls'
+
+# Bumped when sites change, which changes every url at once
+SITES_NAMESPACE = 'sites'
+
+_local = {'generation': None, 'urls': {}}
+
+# The generations seen by this thread's current scope, if it's in one
+_scope = threading.local()
+
+
+def _entry_key(sites_generation, page_id):
+    return 'page_url:%s:%s' % (sites_generation, page_id)
+
+
+def _local_urls():
+    """ This process's copy of the index, emptied whenever the index changes """
+    generations = getattr(_scope, 'generations', None)
+    if generations is None:
+        generations = get_generations(INDEX_NAMESPACE, SITES_NAMESPACE)
+        if getattr(_scope, 'active', False):
+            _scope.generations = generations
+    if _local['generation'] != generations:
+        _local['generation'] = generations
+        _local['urls'] = {}
+    return _local['urls'], generations[SITES_NAMESPACE]
+
+
+@contextmanager
+def page_url_scope():
+    """ Check the index's generation once for all the urls looked up inside the block """
+    outer = getattr(_scope, 'active', False), getattr(_scope, 'generations', None)
+    _scope.active, _scope.generations = True, None
+    try:
+        yield
+    finally:
+        _scope.active, _scope.generations = outer
+
+
+class PageUrlsMiddleware:
+    """ Looks up every url in a request against the generation the first one saw """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with page_url_scope():
+            return self.get_response(request)
+
+
+def build_page_urls(pages):
+    return {page.pk: (page.get_url(), page.get_full_url()) for page in pages}
+
+
+def get_page_urls(page_ids):
+    """ (url, full_url) for each page id, in at most one cache and one page query """
+    urls, sites_generation = _local_urls()
+    page_ids = {int(page_id) for page_id in page_ids if page_id}
+
+    missing = page_ids.difference(urls)
+    if missing:
+        keys = {_entry_key(sites_generation, page_id): page_id for page_id in missing}
+        for key, entry in cache.get_many(keys.keys()).items():
+            urls[keys[key]] = entry
+
+    missing = page_ids.difference(urls)
+    if missing:
+        built = build_page_urls(Page.objects.filter(pk__in=missing).only('pk', 'url_path'))
+        cache.set_many({
+            _entry_key(sites_generation, page_id): entry for page_id, entry in built.items()
+        }, None)
+        urls.update(built)
+
+    return {page_id: urls.get(page_id, (None, None)) for page_id in page_ids}
+
+
+def get_page_url(page, full=False):
+    """ The url of a page or page id, like page.url (or page.full_url) but from the index """
+    page_id = getattr(page, 'pk', page)
+    if not page_id:
+        return None
+    url, full_url = get_page_urls([page_id])[int(page_id)]
+    return full_url if full else url
+
+
+def refresh_page_urls(page, descendants=False):
+    """ Rebuild a page's entry, and its descendants' too if its url has (or may have) changed """
+    urls, sites_generation = _local_urls()
+    old = cache.get(_entry_key(sites_generation, page.pk))
+    built = build_page_urls([page])
+
+    if descendants or old != built[page.pk]:
+        descendants = Page.objects.descendant_of(page).only('pk', 'url_path')
+        built.update(build_page_urls(descendants))
+
+    cache.set_many({
+        _entry_key(sites_generation, page_id): entry for page_id, entry in built.items()
+    }, None)
+    bump_generation(INDEX_NAMESPACE)
+    _scope.generations = None
+
+
+def forget_page_url(page):
+    urls, sites_generation = _local_urls()
+    cache.delete(_entry_key(sites_generation, page.pk))
+    bump_generation(INDEX_NAMESPACE)
+    _scope.generations = None
+
+
+@invalidation.register(Site)
+def site_changed(site):
+    """ A new hostname, port or root page can change every url """
+    yield Fragment(SITES_NAMESPACE)
+    yield EVERY_PAGE
@@ -0,0 +1,24 @@
+""" Loading many pages as their specific types without a query per page """
+from django.contrib.contenttypes.models import ContentType
+
+
+def specific_in_bulk(pks_and_types, select_related=()):
+    """ {pk: specific page} for (pk, content type id) pairs, with one query per page type.
+
+    select_related names that a page type doesn't have are skipped for that type.
+    """
+    pks_by_model = {}
+    for pk, content_type_id in pks_and_types:
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        if model is not None:
+            pks_by_model.setdefault(model, []).append(pk)
+
+    pages = {}
+    for model, pks in pks_by_model.items():
+        field_names = {field.name for field in model._meta.get_fields()}
+        related = [name for name in select_related if name.split('__')[0] in field_names]
+        queryset = model.objects.filter(pk__in=pks)
+        if related:
+            queryset = queryset.select_related(*related)
+        pages.update(queryset.in_bulk())
+    return pages
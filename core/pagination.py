@@ -0,0 +1,199 @@
+""" Keyset (seek) pagination.
+
+Instead of ``OFFSET n`` the next page is fetched with a ``WHERE`` on the sort
+key of the last row shown, so deep pages cost the same as the first one. The
+position is handed to the client as an opaque cursor.
+"""
+import base64
+import json
+from collections.abc import Sequence
+
+from django.conf import settings
+from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
+from django.db.models import F, Q
+from django.utils.functional import cached_property
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(direction, keys):
+    """ Pack a direction ('after' or 'before') and sort key values into a url safe string """
+    data = json.dumps([direction, keys], default=str, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """ The reverse of encode_cursor, raises InvalidCursor for anything it can't read """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        direction, keys = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (TypeError, ValueError):
+        raise InvalidCursor(cursor)
+    if direction not in ('after', 'before') or not isinstance(keys, list):
+        raise InvalidCursor(cursor)
+    return direction, keys
+
+
+class KeysetPage(Sequence):
+    """ One page of results, with the same looping interface as Django's Page """
+
+    def __init__(self, paginator, direction=None, keys=None):
+        self.paginator = paginator
+        self.direction = direction
+        self.keys = keys
+
+    @cached_property
+    def _results(self):
+        """ Fetch one row more than needed so we know whether there's another page """
+        per_page = self.paginator.per_page
+        backwards = self.direction == 'before'
+        queryset = self.paginator.queryset_for(self.direction, self.keys)
+        rows = list(self.paginator.slice(queryset, per_page + 1))
+        has_more = len(rows) > per_page
+        rows = rows[:per_page]
+        if backwards:
+            rows.reverse()
+        return rows, has_more
+
+    @property
+    def object_list(self):
+        return self._results[0]
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __repr__(self):
+        return '<KeysetPage %s %s>' % (self.direction or 'first', self.keys or '')
+
+    def has_next(self):
+        if self.direction == 'before':
+            return True
+        return self._results[1]
+
+    def has_previous(self):
+        if self.direction == 'before':
+            return self._results[1]
+        return self.direction == 'after'
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    @property
+    def next_cursor(self):
+        if self.has_next() and self.object_list:
+            return encode_cursor('after', self.paginator.keys_for(self.object_list[-1]))
+        return None
+
+    @property
+    def previous_cursor(self):
+        if self.has_previous() and self.object_list:
+            return encode_cursor('before', self.paginator.keys_for(self.object_list[0]))
+        return None
+
+
+def order_by(ordering):
+    """ Order expressions for field names, with NULLs before every value whichever way they sort.
+
+    Databases disagree on where NULLs go, so both pagination modes put them
+    in the same place and seek_filter() knows where to find them.
+    """
+    return [
+        F(field[1:]).desc(nulls_last=True) if field.startswith('-') else F(field).asc(nulls_first=True)
+        for field in ordering
+    ]
+
+
+class KeysetPaginator:
+    """ Paginates a queryset on a unique ordering, e.g. ('-first_published_at', '-id').
+
+    The last field in the ordering must be unique so every row has a distinct position.
+    Other fields may be NULL.
+    """
+
+    def __init__(self, queryset, per_page, ordering):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.ordering = list(ordering)
+
+    @cached_property
+    def count(self):
+        """ Only runs a COUNT(*) when a template actually asks for it """
+        return self.queryset.count()
+
+    def page(self, cursor=None):
+        """ Returns the page for a cursor, or the first page for a missing or bad cursor """
+        if not cursor:
+            return KeysetPage(self)
+        try:
+            direction, keys = decode_cursor(cursor)
+        except InvalidCursor:
+            return KeysetPage(self)
+        if len(keys) != len(self.ordering):
+            return KeysetPage(self)
+        return KeysetPage(self, direction, keys)
+
+    def keys_for(self, obj):
+        return [getattr(obj, field.lstrip('-')) for field in self.ordering]
+
+    def queryset_for(self, direction, keys):
+        ordering = self.ordering
+        if direction == 'before':
+            ordering = [self.flip(field) for field in ordering]
+        queryset = self.queryset.order_by(*order_by(ordering))
+        if keys is not None:
+            queryset = queryset.filter(self.seek_filter(ordering, keys))
+        return queryset
+
+    def slice(self, queryset, limit):
+        """ Hook for subclasses that need to run the query differently """
+        return queryset[:limit]
+
+    @staticmethod
+    def flip(field):
+        return field[1:] if field.startswith('-') else '-' + field
+
+    @staticmethod
+    def seek_filter(ordering, keys):
+        """ Rows that sort strictly after ``keys``: (a > x) OR (a = x AND b > y) OR ...
+
+        NULLs sort before every value, as order_by() puts them.
+        """
+        q = Q()
+        equal = Q()
+        for field, key in zip(ordering, keys):
+            name = field.lstrip('-')
+            descending = field.startswith('-')
+            if key is None:
+                # Only values come after a NULL going up, nothing going down
+                after = None if descending else Q(**{name + '__isnull': False})
+                same = Q(**{name + '__isnull': True})
+            else:
+                after = Q(**{name + ('__lt' if descending else '__gt'): key})
+                if descending:
+                    after |= Q(**{name + '__isnull': True})
+                same = Q(**{name: key})
+            if after is not None:
+                q |= equal & after
+            equal &= same
+        return q
+
+
+def paginate(request, queryset, per_page, ordering):
+    """ Paginate by cursor or by page number, depending on PAGINATION_MODE and the querystring """
+    cursor = request.GET.get('cursor')
+    if cursor or getattr(settings, 'PAGINATION_MODE', 'page') == 'cursor':
+        return KeysetPaginator(queryset, per_page, ordering).page(cursor)
+
+    paginator = Paginator(queryset.order_by(*order_by(ordering)), per_page)
+    page = request.GET.get('page')
+    try:
+        return paginator.page(page)
+    except PageNotAnInteger:
+        return paginator.page(1)
+    except EmptyPage:
+        return paginator.page(paginator.num_pages)
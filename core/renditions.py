@@ -0,0 +1,190 @@
+""" Rendition pre-generation.
+
+The filter specs the site uses come from the image tags in the project's
+templates (including responsive variants), ImageRenditionField declarations in api_fields, and specs that
+code registers with register_filter_spec. Renditions that are missing for
+those specs can then be generated ahead of the first visitor: for every
+image with the generate_renditions command, and for new uploads in a
+background thread.
+"""
+import logging
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connection, connections
+from django.template import engines
+
+from wagtail.images import get_image_model
+from wagtail.images.api.fields import ImageRenditionField
+from wagtail.images.models import Filter
+
+from .images import responsive_specs
+
+logger = logging.getLogger(__name__)
+
+IMAGE_TAG_RE = re.compile(r'{%\s*image\s+\S+\s+(.*?)\s*%}')
+IMAGE_RENDITIONS_TAG_RE = re.compile(r'{%\s*image_renditions\s+\S+\s+["\']([^"\']+)["\']([^%]*)%}')
+RESPONSIVE_IMAGE_TAG_RE = re.compile(r'{%\s*responsive_image\s+\S+\s+["\']([^"\']+)["\']')
+
+_registered_specs = set()
+
+
+def register_filter_spec(spec):
+    """ Declare a spec used from code, so it gets pre-generated too. Returns the spec """
+    _registered_specs.add(spec)
+    return spec
+
+
+def template_filter_specs(path):
+    with open(path, encoding='utf-8') as template:
+        source = template.read()
+    specs = set()
+    for arguments in IMAGE_TAG_RE.findall(source):
+        arguments = arguments.split(' as ')[0].split()
+        # Everything else is an attribute like class="..."; variables can't be known ahead
+        filters = [argument for argument in arguments if '=' not in argument]
+        if filters and all(re.match(r'^[\w-]+$', f) for f in filters):
+            specs.add('|'.join(filters))
+    for spec, arguments in IMAGE_RENDITIONS_TAG_RE.findall(source):
+        specs.update(responsive_specs(spec) if 'responsive=True' in arguments else [spec])
+    for spec in RESPONSIVE_IMAGE_TAG_RE.findall(source):
+        specs.update(responsive_specs(spec))
+    return specs
+
+
+def project_template_paths():
+    base_dir = os.path.abspath(settings.BASE_DIR)
+    for engine in engines.all():
+        for template_dir in engine.template_dirs:
+            template_dir = os.path.abspath(str(template_dir))
+            # Only our own templates, not the admin's or other packages'
+            if not template_dir.startswith(base_dir) or 'site-packages' in template_dir:
+                continue
+            for root, dirs, files in os.walk(template_dir):
+                for name in files:
+                    if name.endswith(('.html', '.txt')):
+                        yield os.path.join(root, name)
+
+
+def api_filter_specs():
+    specs = set()
+    for model in apps.get_models():
+        for api_field in getattr(model, 'api_fields', None) or []:
+            serializer = getattr(api_field, 'serializer', None)
+            if isinstance(serializer, ImageRenditionField):
+                specs.add(serializer.filter_spec)
+    return specs
+
+
+def discover_filter_specs():
+    """ Every filter spec the templates, the API and registered code ask for """
+    specs = set(_registered_specs) | api_filter_specs()
+    for path in set(project_template_paths()):
+        specs |= template_filter_specs(path)
+    return sorted(specs)
+
+
+def missing_filter_specs(images, specs):
+    """ Map each image id to the specs it has no rendition for yet, for a batch of images """
+    Rendition = get_image_model().get_rendition_model()
+    filters = [Filter(spec=spec) for spec in specs]
+    images = list(images)
+
+    existing = set(
+        Rendition.objects.filter(
+            image_id__in=[image.pk for image in images],
+            filter_spec__in=[filter.spec for filter in filters],
+        ).values_list('image_id', 'filter_spec', 'focal_point_key')
+    )
+
+    missing = {}
+    for image in images:
+        specs = [
+            filter.spec for filter in filters
+            if (image.pk, filter.spec, filter.get_cache_key(image)) not in existing
+        ]
+        if specs:
+            missing[image.pk] = specs
+    return missing
+
+
+def generate_renditions(image_id, specs):
+    """ Create the renditions of one image, returning how many were made. Runs in pool workers """
+    image = get_image_model().objects.filter(pk=image_id).first()
+    if image is None:
+        return 0
+    for spec in specs:
+        image.get_rendition(spec)
+    return len(specs)
+
+
+def generate_missing_renditions(missing, workers=None, progress=None):
+    """ Generate renditions for {image_id: specs} across a process pool.
+
+    progress(done, total, image_id, error) is called as each image finishes.
+    Returns the number of renditions created.
+    """
+    total = len(missing)
+    created = 0
+    if not total:
+        return created
+
+    if workers == 1:
+        results = ((image_id, _run(image_id, specs)) for image_id, specs in missing.items())
+        for done, (image_id, (count, error)) in enumerate(results, 1):
+            created += count
+            if progress:
+                progress(done, total, image_id, error)
+        return created
+
+    # Forked workers open their own connections, the parent's can't be shared
+    connections.close_all()
+    context = multiprocessing.get_context('fork')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = {
+            pool.submit(_run, image_id, specs): image_id for image_id, specs in missing.items()
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            count, error = future.result()
+            created += count
+            if progress:
+                progress(done, total, futures[future], error)
+    return created
+
+
+def _run(image_id, specs):
+    """ (renditions created, error) for one image. A missing or broken file is reported, not raised """
+    try:
+        return generate_renditions(image_id, specs), None
+    except IOError as e:
+        return 0, str(e)
+
+
+_upload_executor = None
+_upload_executor_lock = threading.Lock()
+
+
+def _generate_for_upload(image_id):
+    try:
+        image = get_image_model().objects.filter(pk=image_id).first()
+        if image is not None:
+            missing = missing_filter_specs([image], discover_filter_specs())
+            _, error = _run(image_id, missing.get(image_id, []))
+            if error:
+                logger.warning("Couldn't pre-generate renditions for image %s: %s", image_id, error)
+    finally:
+        connection.close()
+
+
+def generate_renditions_in_background(image):
+    """ Queue rendition generation for a new upload, off the request thread """
+    global _upload_executor
+    with _upload_executor_lock:
+        if _upload_executor is None:
+            _upload_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='renditions')
+    _upload_executor.submit(_generate_for_upload, image.pk)
@@ -0,0 +1,122 @@
+""" Cached expansion of rich text from its database format to front-end HTML.
+
+Wagtail's expand_db_html looks up every linked page and document with its own
+queries. expand_rich_text looks up all the link targets of a text at once,
+pages through the page url index and documents with one query, and caches
+the HTML it expands to under a hash of the source. The page urls it used are
+cached with it and compared with the index on every read, so the HTML is
+expanded again as soon as a linked page's url changes. Changes to images and
+documents, which can be embedded or linked, bump the 'rich_text' generation.
+
+Rich text fields go through the |cached_richtext filter in core_tags, rich
+text blocks through CachedRichTextBlock.
+"""
+import hashlib
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.html import escape
+
+from wagtail.core import blocks
+from wagtail.core.models import Page
+from wagtail.core.rich_text import RichText, features
+from wagtail.core.rich_text.rewriters import EmbedRewriter, LinkRewriter, MultiRuleRewriter
+from wagtail.documents import get_document_model
+from wagtail.documents.models import Document
+from wagtail.images.models import Image
+
+from .cache import Fragment, get_generation, invalidation
+from .page_urls import get_page_urls
+from .streams import collect_rich_text_references
+
+RICH_TEXT_NAMESPACE = 'rich_text'
+
+
+def rich_text_cache_key(source):
+    return 'rich_text:%s:%s' % (
+        get_generation(RICH_TEXT_NAMESPACE), hashlib.md5(source.encode()).hexdigest(),
+    )
+
+
+def link_targets(source):
+    """ The ids of the pages and the documents source links to """
+    references = defaultdict(set)
+    collect_rich_text_references(source, references)
+    return references[Page], references[get_document_model()]
+
+
+def link_rule(urls):
+    """ A link rule taking the href of each target from urls, by id """
+    def rule(attrs):
+        try:
+            url = urls.get(int(attrs['id']))
+        except (KeyError, ValueError):
+            url = None
+        return '<a href="%s">' % escape(url) if url else '<a>'
+    return rule
+
+
+def expand(source):
+    """ expand_db_html(source) with the link targets looked up in bulk, and the page urls it used """
+    page_ids, document_ids = link_targets(source)
+    page_urls = {page_id: url for page_id, (url, full_url) in get_page_urls(page_ids).items()}
+    documents = get_document_model().objects.in_bulk(document_ids) if document_ids else {}
+
+    link_rules = {
+        linktype: handler.expand_db_attributes for linktype, handler in features.get_link_types().items()
+    }
+    link_rules['page'] = link_rule(page_urls)
+    link_rules['document'] = link_rule({pk: document.url for pk, document in documents.items()})
+    embed_rules = {
+        embedtype: handler.expand_db_attributes for embedtype, handler in features.get_embed_types().items()
+    }
+
+    rewriter = MultiRuleRewriter([LinkRewriter(link_rules), EmbedRewriter(embed_rules)])
+    return rewriter(source), page_urls
+
+
+def expand_rich_text(source):
+    """ Like expand_db_html(source), from the cache unless a page it links to has a new url """
+    if not source:
+        return ''
+    key = rich_text_cache_key(source)
+    cached = cache.get(key)
+    if cached is not None:
+        current = get_page_urls(cached['pages'].keys())
+        if all(current[page_id][0] == url for page_id, url in cached['pages'].items()):
+            return cached['html']
+
+    html, page_urls = expand(source)
+    # Deleted pages don't come back, so links to them don't need checking
+    page_urls = {page_id: url for page_id, url in page_urls.items() if url is not None}
+    timeout = getattr(settings, 'RICH_TEXT_CACHE_TIMEOUT', 60 * 60 * 24 * 7)
+    cache.set(key, {'html': html, 'pages': page_urls}, timeout)
+    return html
+
+
+class CachedRichText(RichText):
+    """ A RichText rendered with expand_rich_text """
+
+    def __html__(self):
+        return render_to_string('wagtailcore/shared/richtext.html', {'html': expand_rich_text(self.source)})
+
+
+class CachedRichTextBlock(blocks.RichTextBlock):
+    """ A RichTextBlock whose values are CachedRichTexts """
+
+    def get_default(self):
+        return CachedRichText(super().get_default().source)
+
+    def to_python(self, value):
+        return CachedRichText(value)
+
+    def value_from_form(self, value):
+        return CachedRichText(super().value_from_form(value).source)
+
+
+@invalidation.register(Image, Document)
+def rich_text_embed_changed(obj):
+    """ Images are embedded in rich text, documents linked to by their file's url """
+    yield Fragment(RICH_TEXT_NAMESPACE)
@@ -0,0 +1,185 @@
+""" Feeds model changes into the cache invalidation registry and the work done on publish and upload """
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from wagtail.contrib.settings.models import BaseSetting
+from wagtail.core.models import Page, PageViewRestriction, Site
+from wagtail.core.signals import page_published, page_unpublished, post_page_move
+from wagtail.images import get_image_model
+
+from .api import PAGES_API_NAMESPACE
+from .cache import Invalidation, bump_generation, invalidation, pages_invalidated
+from .page_cache import purge_pages
+from .page_urls import forget_page_url, refresh_page_urls
+from .renditions import generate_renditions_in_background
+from .sitemaps import (
+    forget_sitemap_pages, rebuild_sitemap, remove_from_sitemap, update_sitemap, update_sitemap_below,
+)
+from .streams import (
+    api_stream_fields, referenced_models, render_referencing, rendered_stream_fields,
+    rendering_enabled, store_stream_references, store_stream_renderings, store_stream_representations,
+    stream_fields,
+)
+
+
+# The url index goes first, so the receivers below already see the new urls
+@receiver(page_published)
+def page_url_published(sender, instance, **kwargs):
+    refresh_page_urls(instance)
+
+
+@receiver(post_page_move)
+def page_url_moved(sender, instance, **kwargs):
+    # instance still has the url_path from before the move
+    refresh_page_urls(Page.objects.get(pk=instance.pk), descendants=True)
+
+
+@receiver(post_delete)
+def page_url_deleted(sender, instance, **kwargs):
+    if isinstance(instance, Page):
+        forget_page_url(instance)
+
+
+@receiver(page_published)
+def stream_representations_published(sender, instance, **kwargs):
+    if api_stream_fields(type(instance)):
+        store_stream_representations([instance])
+
+
+@receiver(page_published)
+def stream_references_published(sender, instance, **kwargs):
+    if stream_fields(type(instance)):
+        store_stream_references([instance])
+
+
+@receiver(page_published)
+def stream_renderings_published(sender, instance, **kwargs):
+    if rendering_enabled() and rendered_stream_fields(type(instance)):
+        store_stream_renderings([instance])
+
+
+def render_streams_showing(model, pks):
+    """ Render the streams showing the objects again, and purge the pages they're on """
+    pages = render_referencing(model, pks)
+    if pages:
+        invalidation.purge(Invalidation(pages=pages), sender=model)
+
+
+@receiver(page_published)
+@receiver(page_unpublished)
+@receiver(post_page_move)
+def stream_reference_page_changed(sender, instance, **kwargs):
+    # Links to the page show its url, and a move changes the urls below it as well
+    if rendering_enabled():
+        pks = [instance.pk]
+        if 'url_path_before' in kwargs:
+            descendants = Page.objects.get(pk=instance.pk).get_descendants()
+            pks.extend(descendants.values_list('pk', flat=True))
+        render_streams_showing(Page, pks)
+
+
+@receiver(post_save)
+def stream_reference_saved(sender, instance, raw=False, **kwargs):
+    # Saving a page only creates a draft, they're handled on publish above
+    if raw or isinstance(instance, Page) or not rendering_enabled():
+        return
+    if sender in referenced_models():
+        render_streams_showing(sender, [instance.pk])
+
+
+@receiver(post_delete)
+def stream_reference_deleted(sender, instance, **kwargs):
+    # A deleted page is sent as its base Page as well as its specific type
+    if rendering_enabled() and sender in referenced_models():
+        render_streams_showing(sender, [instance.pk])
+
+
+@receiver(page_published)
+def sitemap_page_published(sender, instance, **kwargs):
+    update_sitemap([instance.pk])
+
+
+@receiver(page_unpublished)
+def sitemap_page_unpublished(sender, instance, **kwargs):
+    # Also sent while a live page is being deleted, when it must not get a new entry
+    remove_from_sitemap([instance.pk])
+
+
+@receiver(post_page_move)
+def sitemap_page_moved(sender, instance, **kwargs):
+    # instance still has the path from before the move
+    update_sitemap_below(Page.objects.get(pk=instance.pk))
+
+
+@receiver(post_save, sender=PageViewRestriction)
+@receiver(post_delete, sender=PageViewRestriction)
+def sitemap_restriction_changed(sender, instance, raw=False, **kwargs):
+    # Restricted pages and everything below them are left out
+    page = Page.objects.filter(pk=instance.page_id).first()
+    if page is not None and not raw:
+        update_sitemap_below(page)
+
+
+@receiver(post_save, sender=Site)
+def sitemap_site_changed(sender, instance, raw=False, **kwargs):
+    # A new hostname, port or root page changes every location
+    if not raw:
+        rebuild_sitemap()
+
+
+@receiver(post_delete)
+def sitemap_page_deleted(sender, instance, **kwargs):
+    # The entry goes with the page
+    if sender is Page:
+        forget_sitemap_pages([instance.pk])
+
+
+@receiver(page_published)
+@receiver(page_unpublished)
+@receiver(post_page_move)
+def page_changed(sender, instance, **kwargs):
+    invalidation.invalidate(instance)
+
+
+@receiver(post_save)
+def model_saved(sender, instance, created=False, raw=False, **kwargs):
+    # Saving a page only creates a draft, the live site changes on publish
+    if raw or isinstance(instance, Page) or not invalidation.is_registered(sender):
+        return
+    # Settings rows are created with their defaults the first time they're read
+    if created and isinstance(instance, BaseSetting):
+        return
+    invalidation.invalidate(instance)
+
+
+@receiver(pre_delete)
+def model_deleting(sender, instance, **kwargs):
+    # Collect while the related rows still exist, purge once the delete is done
+    if invalidation.is_registered(sender):
+        instance._cache_invalidation = invalidation.collect(instance)
+
+
+@receiver(post_delete)
+def model_deleted(sender, instance, **kwargs):
+    pending = getattr(instance, '_cache_invalidation', None)
+    if pending:
+        invalidation.purge(pending, sender=sender)
+
+
+@receiver(pages_invalidated)
+def purge_page_responses(sender, pages, **kwargs):
+    purge_pages(pages)
+
+
+@receiver(pages_invalidated)
+def purge_pages_api(sender, pages, **kwargs):
+    # Listings can include any page, so every cached payload goes
+    bump_generation(PAGES_API_NAMESPACE)
+
+
+@receiver(post_save, sender=get_image_model())
+def image_uploaded(sender, instance, created=False, raw=False, **kwargs):
+    if created and not raw and getattr(settings, 'RENDITIONS_GENERATE_ON_UPLOAD', False):
+        transaction.on_commit(lambda: generate_renditions_in_background(instance))
@@ -0,0 +1,227 @@
+""" Sitemap built incrementally at publish time, served as a sharded, gzipped sitemap index.
+
+Each live, public page keeps its <url> elements in a SitemapEntry, built from
+its get_sitemap_urls() whenever it's published, unpublished, moved or has its
+view restrictions changed, so requests never work out page urls. Pages are
+split into shards of SITEMAP_SHARD_SIZE by id, which keeps every page in the
+same shard for good. A change only bumps the generation of its own shard, so
+the other shards stay cached, and of the index, which is a single query.
+
+Shards and the index are cached gzipped, and served that way to clients that
+accept it, with the newest lastmod they list as Last-Modified. Unpublishing
+can leave that the same or move it back, so conditional requests are
+answered from an ETag made from the cache key, which has the generation in it.
+"""
+import gzip
+import hashlib
+import re
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, IntegerField, Max
+from django.db.models.functions import Cast
+from django.http import Http404, HttpResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.html import escape
+from django.utils.http import http_date, quote_etag
+from django.utils.text import compress_string
+
+from wagtail.core.models import Page, Site
+
+from .cache import bump_generation, get_generation
+from .models import SitemapEntry
+
+# Bumped by any page change, for the index
+SITEMAP_NAMESPACE = 'sitemap'
+
+SITEMAP_TIMEOUT = 60 * 60 * 24 * 7
+
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n'
+
+ACCEPTS_GZIP = re.compile(r'\bgzip\b')
+
+
+def shard_size():
+    return getattr(settings, 'SITEMAP_SHARD_SIZE', 1000)
+
+
+def shard_of(page_id):
+    return page_id // shard_size()
+
+
+def shard_namespace(shard):
+    return '%s:%d' % (SITEMAP_NAMESPACE, shard)
+
+
+def w3c_date(value):
+    if timezone.is_aware(value):
+        value = timezone.localtime(value)
+    return value.strftime('%Y-%m-%d')
+
+
+def url_element(url):
+    """ A <url> element, like the ones django.contrib.sitemaps renders """
+    parts = ['<loc>%s</loc>' % escape(url['location'])]
+    if url.get('lastmod'):
+        parts.append('<lastmod>%s</lastmod>' % w3c_date(url['lastmod']))
+    if url.get('changefreq'):
+        parts.append('<changefreq>%s</changefreq>' % escape(url['changefreq']))
+    if url.get('priority'):
+        parts.append('<priority>%s</priority>' % escape(url['priority']))
+    return '<url>%s</url>' % ''.join(parts)
+
+
+def build_entry(page):
+    """ An unsaved SitemapEntry for a specific page, or None when it isn't routable or opts out """
+    url_parts = page.get_url_parts()
+    if url_parts is None:
+        return None
+    urls = page.get_sitemap_urls(None)
+    if not urls:
+        return None
+    lastmods = [url['lastmod'] for url in urls if url.get('lastmod')]
+    return SitemapEntry(
+        page_id=page.pk,
+        site_id=url_parts[0],
+        xml=''.join(url_element(url) for url in urls),
+        lastmod=max(lastmods) if lastmods else None,
+    )
+
+
+def update_sitemap(page_ids):
+    """ Build the entries of the pages again, dropping the ones that aren't live and public """
+    page_ids = set(page_ids)
+    pages = Page.objects.live().public().filter(pk__in=page_ids).specific()
+    entries = [entry for entry in map(build_entry, pages) if entry is not None]
+    with transaction.atomic():
+        SitemapEntry.objects.filter(page_id__in=page_ids).delete()
+        SitemapEntry.objects.bulk_create(entries)
+    forget_sitemap_pages(page_ids)
+    return len(entries)
+
+
+def remove_from_sitemap(page_ids):
+    SitemapEntry.objects.filter(page_id__in=page_ids).delete()
+    forget_sitemap_pages(page_ids)
+
+
+def update_sitemap_below(page):
+    """ update_sitemap() for a page and its descendants """
+    update_sitemap(Page.objects.descendant_of(page, inclusive=True).values_list('pk', flat=True))
+
+
+def rebuild_sitemap(batch_size=500):
+    """ update_sitemap() for every page, batch_size at a time. Returns the number of entries """
+    last_pk, entries = 0, 0
+    while True:
+        page_ids = list(
+            Page.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size]
+        )
+        if not page_ids:
+            return entries
+        entries += update_sitemap(page_ids)
+        last_pk = page_ids[-1]
+
+
+def forget_sitemap_pages(page_ids):
+    """ Drop the cached shards of the pages, and the index """
+    for shard in {shard_of(page_id) for page_id in page_ids}:
+        bump_generation(shard_namespace(shard))
+    bump_generation(SITEMAP_NAMESPACE)
+
+
+def _cache_key(request, name, namespace):
+    key = '|'.join([request.scheme, request.get_host(), name, str(get_generation(namespace))])
+    return 'sitemap:%s' % hashlib.md5(key.encode()).hexdigest()
+
+
+def _site(request):
+    site = Site.find_for_request(request)
+    if site is None:
+        raise Http404
+    return site
+
+
+def _build(key, xml, last_modified):
+    return {
+        'content': compress_string((XML_HEADER + xml).encode()),
+        'etag': hashlib.md5(key.encode()).hexdigest(),
+        'last_modified': int(last_modified.timestamp()) if last_modified else None,
+    }
+
+
+def _serve(request, cached):
+    gzipped = bool(ACCEPTS_GZIP.search(request.META.get('HTTP_ACCEPT_ENCODING', '')))
+    # The gzipped and plain responses are different bytes, so they get different ETags
+    etag = quote_etag(cached['etag'] + ('-gzip' if gzipped else ''))
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        if gzipped:
+            response = HttpResponse(cached['content'], content_type='application/xml')
+            response['Content-Encoding'] = 'gzip'
+        else:
+            response = HttpResponse(gzip.decompress(cached['content']), content_type='application/xml')
+    patch_vary_headers(response, ['Accept-Encoding'])
+    response['ETag'] = etag
+    if cached['last_modified']:
+        response['Last-Modified'] = http_date(cached['last_modified'])
+    return response
+
+
+def sitemap_index(request):
+    """ The <sitemapindex> of the shards of the request's site """
+    key = _cache_key(request, 'index', SITEMAP_NAMESPACE)
+    cached = cache.get(key)
+    if cached is None:
+        site = _site(request)
+        shards = list(
+            SitemapEntry.objects.filter(site=site)
+            .annotate(shard=Cast(F('page_id') / shard_size(), IntegerField()))
+            .values('shard').annotate(newest=Max('lastmod')).order_by('shard')
+        )
+        elements = []
+        for shard in shards:
+            # On the same root as the entries, whatever host the request came in on
+            element = '<loc>%s</loc>' % escape(
+                site.root_url + reverse('sitemap_shard', args=[shard['shard']])
+            )
+            if shard['newest']:
+                element += '<lastmod>%s</lastmod>' % w3c_date(shard['newest'])
+            elements.append('<sitemap>%s</sitemap>' % element)
+        newest = [shard['newest'] for shard in shards if shard['newest']]
+        cached = _build(
+            key,
+            '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">%s</sitemapindex>\n'
+            % ''.join(elements),
+            max(newest) if newest else None,
+        )
+        cache.set(key, cached, SITEMAP_TIMEOUT)
+    return _serve(request, cached)
+
+
+def sitemap_shard(request, shard):
+    """ The <urlset> of one shard of the request's site, in one query """
+    key = _cache_key(request, 'shard:%d' % shard, shard_namespace(shard))
+    cached = cache.get(key)
+    if cached is None:
+        entries = list(
+            SitemapEntry.objects.filter(
+                site=_site(request),
+                page_id__gte=shard * shard_size(),
+                page_id__lt=(shard + 1) * shard_size(),
+            ).order_by('page_id').values_list('xml', 'lastmod')
+        )
+        if not entries:
+            raise Http404
+        newest = [lastmod for xml, lastmod in entries if lastmod]
+        cached = _build(
+            key,
+            '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">%s</urlset>\n'
+            % ''.join(xml for xml, lastmod in entries),
+            max(newest) if newest else None,
+        )
+        cache.set(key, cached, SITEMAP_TIMEOUT)
+    return _serve(request, cached)
@@ -0,0 +1,376 @@
+""" StreamField helpers shared by the page models
+
+Wagtail converts each chooser in a stream with its own query, so a list of
+cards costs a query per image and per page. PrefetchingStreamBlock collects
+every chosen id in the stream first and loads them with one query per model.
+
+The API representation of a stream only depends on the stream itself, so
+it's serialized once when the page is published and stored as a
+StreamFieldRepresentation. StreamRepresentationField serves it from there,
+as long as the page's stream still hashes the same.
+
+The pages, images, documents and snippets the streams of a page show are
+recorded as StreamFieldReferences when it's published, so the cached
+responses of the pages linking to a page are purged when it changes.
+
+With STREAMFIELD_RENDER_ON_PUBLISH, the HTML of the rendered_stream_fields
+of a page type is stored at publish too, as a StreamFieldRendering, and
+{% render_stream %} emits it instead of rendering every block. core.signals
+renders the streams showing an object again when it changes, going by the
+references. A rendering made with block templates that have changed since
+is rendered again the next time the page is viewed.
+"""
+import functools
+import hashlib
+import json
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Subquery
+from django.template.loader import get_template
+from django.utils.safestring import mark_safe
+
+from rest_framework.fields import Field
+
+from wagtail.core import blocks
+from wagtail.core.blocks.stream_block import StreamValue
+from wagtail.core.fields import StreamField
+from wagtail.core.models import Page, get_page_models
+from wagtail.core.rich_text.rewriters import FIND_A_TAG, FIND_EMBED_TAG, extract_attrs
+from wagtail.documents import get_document_model
+from wagtail.images import get_image_model
+
+from .cache import invalidation
+from .models import StreamFieldReference, StreamFieldRendering, StreamFieldRepresentation
+from .page_urls import get_page_urls
+
+
+def collect_references(block, value, references, rich_text=False):
+    """ Add the ids chosen anywhere in a raw block value to references, by model
+
+    With rich_text=True the pages, images and documents linked or embedded in
+    rich text are added as well.
+    """
+    if value is None:
+        return
+    if isinstance(block, blocks.ChooserBlock):
+        references[block.target_model].add(value)
+    elif isinstance(block, blocks.RichTextBlock):
+        if rich_text:
+            collect_rich_text_references(value, references)
+    elif isinstance(block, blocks.StructBlock):
+        for name, child_block in block.child_blocks.items():
+            collect_references(child_block, value.get(name), references, rich_text)
+    elif isinstance(block, blocks.ListBlock):
+        for item in value:
+            collect_references(block.child_block, item, references, rich_text)
+    elif isinstance(block, blocks.StreamBlock):
+        for item in value:
+            child_block = block.child_blocks.get(item['type'])
+            if child_block is not None:
+                collect_references(child_block, item['value'], references, rich_text)
+
+
+def collect_rich_text_references(html, references):
+    """ Add the pages, images and documents in rich text's database format to references """
+    models = {'page': Page, 'image': get_image_model(), 'document': get_document_model()}
+    tags = [(FIND_A_TAG, 'linktype'), (FIND_EMBED_TAG, 'embedtype')]
+    for pattern, type_attr in tags:
+        for match in pattern.finditer(html):
+            attrs = extract_attrs(match.group(1))
+            model = models.get(attrs.get(type_attr))
+            if model is not None and attrs.get('id', '').isdigit():
+                references[model].add(int(attrs['id']))
+
+
+def fetch_references(references):
+    """ One query per model, plus one batch for the urls of the pages """
+    objects = {model: model.objects.in_bulk(ids) for model, ids in references.items()}
+    page_ids = [
+        page_id for model, ids in references.items() if issubclass(model, Page) for page_id in ids
+    ]
+    if page_ids:
+        get_page_urls(page_ids)
+    return objects
+
+
+def to_python(block, value, objects):
+    """ Like block.to_python(value), taking chosen objects from objects instead of the database """
+    if isinstance(block, blocks.ChooserBlock):
+        if value is None or isinstance(value, block.target_model):
+            return value
+        return objects[block.target_model].get(value)
+    if isinstance(block, blocks.StructBlock):
+        return block._to_struct_value([
+            (
+                name,
+                to_python(child_block, value[name], objects) if name in value else child_block.get_default()
+            )
+            for name, child_block in block.child_blocks.items()
+        ])
+    if isinstance(block, blocks.ListBlock):
+        return [to_python(block.child_block, item, objects) for item in value]
+    if isinstance(block, blocks.StreamBlock):
+        return StreamValue(block, [
+            (item['type'], to_python(block.child_blocks[item['type']], item['value'], objects), item.get('id'))
+            for item in value
+            if item['type'] in block.child_blocks
+        ])
+    return block.to_python(value)
+
+
+class PrefetchingStreamValue(StreamValue):
+    """ Converts the whole stream on first access, with every chosen object loaded in bulk """
+
+    def __getitem__(self, i):
+        if self.is_lazy and not self._bound_blocks:
+            self._convert_all()
+        return super().__getitem__(i)
+
+    def _convert_all(self):
+        references = defaultdict(set)
+        collect_references(self.stream_block, self.stream_data, references)
+        objects = fetch_references(references)
+
+        for i, item in enumerate(self.stream_data):
+            child_block = self.stream_block.child_blocks[item['type']]
+            self._bound_blocks[i] = StreamValue.StreamChild(
+                child_block, to_python(child_block, item['value'], objects), id=item.get('id')
+            )
+
+
+class PrefetchingStreamBlock(blocks.StreamBlock):
+    """ A StreamBlock whose values are PrefetchingStreamValues, for use in StreamField(...) """
+
+    def to_python(self, value):
+        return PrefetchingStreamValue(self, [
+            child_data for child_data in value
+            if child_data['type'] in self.child_blocks
+        ], is_lazy=True)
+
+
+def api_stream_fields(model):
+    """ The StreamFields the model shows in the API """
+    names = {api_field.name for api_field in getattr(model, 'api_fields', None) or []}
+    return [
+        field for field in model._meta.concrete_fields
+        if isinstance(field, StreamField) and field.name in names
+    ]
+
+
+def raw_stream(field, value):
+    # A stream loaded from the database still has its raw data, without generated block ids
+    if getattr(value, 'is_lazy', False):
+        return value.stream_data
+    return field.stream_block.get_prep_value(value)
+
+
+def stream_hash(field, value):
+    data = raw_stream(field, value)
+    return hashlib.md5(json.dumps(data, sort_keys=True, cls=DjangoJSONEncoder).encode()).hexdigest()
+
+
+def store_stream_representations(pages):
+    """ Serialize the API representation of every StreamField of the pages, replacing what's stored """
+    rows = []
+    for page in pages:
+        for field in api_stream_fields(type(page)):
+            value = getattr(page, field.attname)
+            rows.append(StreamFieldRepresentation(
+                page_id=page.pk,
+                field_name=field.name,
+                source_hash=stream_hash(field, value),
+                data=field.stream_block.get_api_representation(value),
+            ))
+    with transaction.atomic():
+        StreamFieldRepresentation.objects.filter(page_id__in=[page.pk for page in pages]).delete()
+        StreamFieldRepresentation.objects.bulk_create(rows)
+    return len(rows)
+
+
+def prefetch_stream_representations(pages):
+    """ Load the stored representations of many pages in one query """
+    stored = defaultdict(dict)
+    rows = StreamFieldRepresentation.objects.filter(page_id__in=[page.pk for page in pages])
+    for row in rows:
+        stored[row.page_id][row.field_name] = row
+    for page in pages:
+        page.stream_representations = stored[page.pk]
+
+
+def get_stream_representation(page, field_name, context=None):
+    """ The stored API representation of a page's StreamField, or a fresh one when it's out of date """
+    field = page._meta.get_field(field_name)
+    value = getattr(page, field.attname)
+    if not hasattr(page, 'stream_representations'):
+        prefetch_stream_representations([page])
+
+    row = page.stream_representations.get(field_name)
+    if row is not None and row.source_hash == stream_hash(field, value):
+        return row.data
+    return field.stream_block.get_api_representation(value, context=context)
+
+
+class StreamRepresentationField(Field):
+    """ Serializes a StreamField api field from its stored representation
+
+    APIField('content', serializer=StreamRepresentationField())
+    """
+
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, page):
+        return get_stream_representation(page, self.field_name, self.context)
+
+
+def rendering_enabled():
+    return getattr(settings, 'STREAMFIELD_RENDER_ON_PUBLISH', False)
+
+
+def rendered_stream_fields(model):
+    """ The StreamFields the model stores the HTML of, named by its rendered_stream_fields """
+    names = getattr(model, 'rendered_stream_fields', [])
+    return [model._meta.get_field(name) for name in names]
+
+
+def walk_blocks(block):
+    """ A block and every block inside it """
+    yield block
+    if isinstance(block, (blocks.StructBlock, blocks.StreamBlock)):
+        for child_block in block.child_blocks.values():
+            yield from walk_blocks(child_block)
+    elif isinstance(block, blocks.ListBlock):
+        yield from walk_blocks(block.child_block)
+
+
+@functools.lru_cache()
+def _templates_hash(names):
+    sources = [get_template(name).template.source for name in names]
+    return hashlib.md5('\0'.join(sources).encode()).hexdigest()
+
+
+def templates_hash(field):
+    # Templates only change with a deploy, so once per process is enough
+    names = {
+        block.meta.template for block in walk_blocks(field.stream_block)
+        if getattr(block.meta, 'template', None)
+    }
+    return _templates_hash(tuple(sorted(names)))
+
+
+@functools.lru_cache()
+def referenced_models():
+    """ Every model a rendered stream can show, changes to these render streams again """
+    models = {Page, get_image_model(), get_document_model()}
+    for page_model in get_page_models():
+        for field in rendered_stream_fields(page_model):
+            models |= {
+                block.target_model for block in walk_blocks(field.stream_block)
+                if isinstance(block, blocks.ChooserBlock)
+            }
+    return frozenset(models)
+
+
+def render_stream(value, context=None):
+    """ The blocks of a stream, rendered the same as a loop over {% include_block %} """
+    return mark_safe('\n'.join(child.render(context) for child in value))
+
+
+def _reference_content_type(model):
+    # Pages are recorded by their base type, as they change as any of their specific types
+    return ContentType.objects.get_for_model(Page if issubclass(model, Page) else model)
+
+
+def stream_fields(model):
+    """ Every StreamField of the model """
+    return [field for field in model._meta.concrete_fields if isinstance(field, StreamField)]
+
+
+def chosen_in_streams(page, fields):
+    """ The ids of everything the fields of a page show, chosen or in rich text, by model """
+    chosen = defaultdict(set)
+    for field in fields:
+        value = raw_stream(field, getattr(page, field.attname))
+        collect_references(field.stream_block, value, chosen, rich_text=True)
+    return chosen
+
+
+def store_stream_references(pages):
+    """ Record what the StreamFields of the pages show, replacing what's stored, and return it """
+    references = [
+        StreamFieldReference(page_id=page.pk, content_type=_reference_content_type(model), object_id=pk)
+        for page in pages
+        for model, pks in chosen_in_streams(page, stream_fields(type(page))).items() for pk in pks
+    ]
+    with transaction.atomic():
+        StreamFieldReference.objects.filter(page_id__in=[page.pk for page in pages]).delete()
+        StreamFieldReference.objects.bulk_create(references)
+    return references
+
+
+@invalidation.register(Page)
+def pages_showing(page):
+    """ The pages whose streams link to a page or its descendants, which show their urls """
+    below = Page.objects.filter(path__startswith=Subquery(Page.objects.filter(pk=page.pk).values('path')))
+    yield from Page.objects.filter(pk__in=StreamFieldReference.objects.filter(
+        content_type=_reference_content_type(Page), object_id__in=below.values('pk'),
+    ).values('page_id'))
+
+
+def store_stream_renderings(pages):
+    """ Render the rendered_stream_fields of the pages, replacing what's stored, and return them """
+    renderings = []
+    for page in pages:
+        for field in rendered_stream_fields(type(page)):
+            value = getattr(page, field.attname)
+            renderings.append(StreamFieldRendering(
+                page_id=page.pk,
+                field_name=field.name,
+                source_hash=stream_hash(field, value),
+                templates_hash=templates_hash(field),
+                html=render_stream(value, {'page': page}),
+            ))
+
+    with transaction.atomic():
+        StreamFieldRendering.objects.filter(page_id__in=[page.pk for page in pages]).delete()
+        StreamFieldRendering.objects.bulk_create(renderings)
+    return renderings
+
+
+def render_referencing(model, pks):
+    """ Render the streams showing any of the objects again, returns the pages they're on """
+    page_ids = StreamFieldReference.objects.filter(
+        content_type=_reference_content_type(model), object_id__in=pks,
+    ).values_list('page_id', flat=True)
+    pages = list(Page.objects.live().filter(pk__in=page_ids.distinct()).specific())
+    if pages:
+        store_stream_renderings(pages)
+    return pages
+
+
+def get_stream_html(page, field_name, context=None, request=None):
+    """ The stored HTML of a page's StreamField, rendered again when it's out of date """
+    field = page._meta.get_field(field_name)
+    value = getattr(page, field.attname)
+    if not rendering_enabled() or field not in rendered_stream_fields(type(page)):
+        return render_stream(value, context)
+
+    source_hash = stream_hash(field, value)
+    rendering = StreamFieldRendering.objects.filter(page_id=page.pk, field_name=field_name).first()
+    if rendering is not None and (rendering.source_hash, rendering.templates_hash) == (
+        source_hash, templates_hash(field),
+    ):
+        return mark_safe(rendering.html)
+
+    # Previews show a draft, only the live stream is stored
+    if not page.live or getattr(request, 'is_preview', False):
+        return render_stream(value, context)
+    for rendering in store_stream_renderings([page]):
+        if rendering.field_name == field_name:
+            return mark_safe(rendering.html)
@@ -0,0 +1,117 @@
+from django import template
+from django.db.models import Model, prefetch_related_objects
+from django.forms.utils import flatatt
+from django.utils.html import format_html
+
+from wagtail.core.rich_text import RichText
+
+from ..cache import get_generations
+from ..images import prefetch_renditions, prefetch_responsive_renditions
+from ..page_urls import get_page_url
+from ..rich_text import CachedRichText
+from ..streams import get_stream_html
+
+register = template.Library()
+
+
+@register.simple_tag()
+def fragment_generation(*namespaces):
+    """ The current generation of one or more fragment namespaces, for use in {% cache %} keys
+
+    {% fragment_generation 'navigation' as navigation_generation %}
+    {% cache 604800 navigation navigation_generation %}
+    """
+    generations = get_generations(*namespaces)
+    return ':'.join(str(generations[namespace]) for namespace in namespaces)
+
+
+@register.simple_tag()
+def page_url(page, full=False):
+    """ Like {% pageurl page %}, from the page url index instead of the page's tree position """
+    return get_page_url(page, full=full) or ''
+
+
+@register.simple_tag()
+def image_renditions(items, filter_spec, image_attr=None, responsive=False):
+    """ Pair each item with the rendition of its image, fetching them all in one query
+
+    {% image_renditions self.blog_authors.all 'fill-50x50' 'author.image' as authors %}
+    {% for iter, img in authors %}<img src="{{ img.url }}">{% endfor %}
+
+    image_attr is a dotted path from an item to its image, leave it out when
+    the items are images. Items without an image are paired with None. With
+    responsive=True the renditions are ResponsiveImages, for {% picture %}.
+    """
+    items = list(items)
+    path = image_attr.split('.') if image_attr else []
+    if len(path) > 1 and items and isinstance(items[0], Model):
+        prefetch_related_objects(items, '__'.join(path))
+
+    images = [_resolve(item, path) for item in items]
+    prefetch = prefetch_responsive_renditions if responsive else prefetch_renditions
+    renditions = prefetch(images, filter_spec)
+    return [
+        (item, renditions.get(image.pk) if image is not None else None)
+        for item, image in zip(items, images)
+    ]
+
+
+@register.simple_tag()
+def responsive_image(image, filter_spec):
+    """ The ResponsiveImage of a single image, for {% picture %}
+
+    {% responsive_image self.banner_image 'fill-1200x300' as banner %}
+    """
+    if image is None:
+        return None
+    return prefetch_responsive_renditions([image], filter_spec)[image.pk]
+
+
+@register.simple_tag()
+def picture(image, sizes='100vw', **attrs):
+    """ A <picture> with WebP and original format srcsets, the browser picks the best fit
+
+    {% picture banner sizes='(min-width: 1200px) 1200px, 100vw' class='w-100' %}
+    """
+    if image is None:
+        return ''
+    attrs.setdefault('alt', image.alt)
+    return format_html(
+        '<picture>'
+        '<source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" width="{}" height="{}"{}>'
+        '</picture>',
+        image.webp_srcset, sizes,
+        image.url, image.srcset, sizes, image.width, image.height, flatatt(attrs),
+    )
+
+
+def _resolve(item, path):
+    for name in path:
+        if item is None:
+            break
+        item = item[name] if isinstance(item, dict) else getattr(item, name, None)
+    return item
+
+
+@register.simple_tag(takes_context=True)
+def render_stream(context, page, field_name):
+    """ The blocks of a page's StreamField, from the HTML stored when the page was published
+
+    {% render_stream page 'content' %}
+
+    Renders the same as {% for block in page.content %}{% include_block block %}{% endfor %},
+    which is what happens for page types that don't store their HTML.
+    """
+    return get_stream_html(page, field_name, context.flatten(), request=context.get('request'))
+
+
+@register.filter()
+def cached_richtext(value):
+    """ Like |richtext, with the HTML from the rich text cache
+
+    {{ page.intro|cached_richtext }}
+    """
+    if isinstance(value, RichText):
+        return value
+    return CachedRichText(value)
@@ -1,3 +1,641 @@
-from django.test import TestCase
+import gzip
+import json
+import shutil
+import tempfile
 
-# Create your tests here.
+from io import StringIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.template import Context, Template
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from wagtail.core.models import PageViewRestriction, Site
+from wagtail.images.models import Image
+from wagtail.images.tests.utils import get_test_image_file
+
+from flex.models import FlexPage
+from home.models import HomePage, HomePageCarouselImages
+
+from .cache import bump_generation, get_generation, get_generations
+from .checks import check_atomic_cache
+from .models import SitemapEntry, StreamFieldRendering, StreamFieldRepresentation
+from .page_cache import serve_cached
+from .page_urls import get_page_url, get_page_urls, page_url_scope
+from .renditions import discover_filter_specs
+
+
+@override_settings(
+    PAGE_CACHE_ENABLED=True,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage',
+)
+class PageCacheTestCase(TestCase):
+
+    def setUp(self):
+        root = Site.objects.get(is_default_site=True).root_page
+        self.page = root.add_child(instance=FlexPage(title='About', slug='about', subtitle='Before'))
+
+    def test_anonymous_responses_are_cached_until_publish(self):
+        first = self.client.get(self.page.url)
+        self.assertContains(first, 'Before')
+
+        FlexPage.objects.filter(pk=self.page.pk).update(subtitle='Sneaky')
+        self.assertContains(self.client.get(self.page.url), 'Before')
+
+        self.page.subtitle = 'After'
+        self.page.save_revision().publish()
+        self.assertContains(self.client.get(self.page.url), 'After')
+
+    def test_conditional_get(self):
+        etag = self.client.get(self.page.url)['ETag']
+        response = self.client.get(self.page.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_if_modified_since_is_not_enough(self):
+        last_modified = self.client.get(self.page.url)['Last-Modified']
+        response = self.client.get(self.page.url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+
+    def test_pages_linking_below_a_renamed_page_are_purged(self):
+        root = Site.objects.get(is_default_site=True).root_page
+        contact = root.add_child(instance=FlexPage(title='Contact', slug='get-touch'))
+        form = contact.add_child(instance=FlexPage(title='Form', slug='form'))
+        self.page.content = json.dumps([{'type': 'cta', 'value': {
+            'title': 'CTA', 'text': '<p>Text</p>', 'button_page': form.pk, 'button_text': 'Go',
+        }}])
+        self.page.save_revision().publish()
+        self.assertContains(self.client.get(self.page.url), 'href="/get-touch/form/"')
+
+        contact.slug = 'get-in-touch'
+        contact.save_revision().publish()
+        self.assertContains(self.client.get(self.page.url), 'href="/get-in-touch/form/"')
+
+    def test_responses_using_the_csrf_token_are_not_cached(self):
+        renders = []
+
+        def render():
+            renders.append(get_token(request))
+            return HttpResponse('<input value="%s">' % renders[-1])
+
+        for i in range(2):
+            request = RequestFactory().get('/form/')
+            serve_cached(request, render)
+        self.assertEqual(len(renders), 2)
+
+    def test_unknown_query_params_bypass_the_cache(self):
+        self.client.get(self.page.url)
+        FlexPage.objects.filter(pk=self.page.pk).update(subtitle='Fresh')
+        self.assertContains(self.client.get(self.page.url + '?utm_source=x'), 'Fresh')
+
+
+class GenerationTestCase(TestCase):
+
+    def setUp(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location, ignore_errors=True)
+        self.filebased = {'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location,
+        }}
+
+    def test_bumps_without_an_atomic_incr_still_move_forward(self):
+        with override_settings(CACHES=self.filebased):
+            before = get_generation('test')
+            bumped = bump_generation('test')
+            self.assertGreater(bumped, before)
+            latest = bump_generation('test')
+            self.assertGreater(latest, bumped)
+            self.assertEqual(get_generation('test'), latest)
+
+    def test_an_atomic_cache_can_be_required(self):
+        with override_settings(CACHES=self.filebased):
+            self.assertEqual(check_atomic_cache(None), [])
+            with override_settings(CACHE_REQUIRE_ATOMIC=True):
+                [error] = check_atomic_cache(None)
+                self.assertEqual(error.id, 'core.E001')
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+)
+class PageUrlIndexTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        root = Site.objects.get(is_default_site=True).root_page
+        self.parent = root.add_child(instance=FlexPage(title='Parent', slug='parent'))
+        self.child = self.parent.add_child(instance=FlexPage(title='Child', slug='child'))
+
+    def test_lookups_are_batched_and_memoized(self):
+        # The pages, plus the site root paths that wagtail caches itself
+        with self.assertNumQueries(2):
+            urls = get_page_urls([self.parent.pk, self.child.pk])
+        self.assertEqual(urls[self.child.pk][0], self.child.url)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_page_url(self.child.pk), self.child.url)
+
+    def test_generations_are_checked_once_per_scope(self):
+        get_page_urls([self.parent.pk, self.child.pk])
+        with mock.patch('core.page_urls.get_generations', wraps=get_generations) as checked:
+            with page_url_scope():
+                get_page_url(self.parent)
+                get_page_url(self.child)
+            self.assertEqual(checked.call_count, 1)
+
+            with page_url_scope():
+                get_page_url(self.child)
+                self.parent.slug = 'renamed'
+                self.parent.save_revision().publish()
+                self.assertEqual(get_page_url(self.child), '/renamed/child/')
+
+    def test_descendants_follow_a_slug_change(self):
+        get_page_urls([self.parent.pk, self.child.pk])
+        self.parent.slug = 'renamed'
+        self.parent.save_revision().publish()
+        self.assertEqual(get_page_url(self.child.pk), '/renamed/child/')
+
+    def test_deleted_pages_have_no_url(self):
+        get_page_url(self.child)
+        self.child.delete()
+        self.assertIsNone(get_page_url(self.child.pk))
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+)
+class APICacheTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        root = Site.objects.get(is_default_site=True).root_page
+        self.page = root.add_child(instance=FlexPage(title='About', slug='about'))
+
+    def get(self, **headers):
+        return self.client.get('/api/v2/pages/', {'type': 'flex.FlexPage'}, **headers)
+
+    def test_payloads_are_cached_until_publish(self):
+        first = self.get()
+        self.assertEqual(first.json()['items'][0]['title'], 'About')
+
+        FlexPage.objects.filter(pk=self.page.pk).update(title='Sneaky')
+        with self.assertNumQueries(0):
+            cached = self.get()
+        self.assertEqual(cached.json(), first.json())
+        self.assertEqual(cached['ETag'], first['ETag'])
+
+        self.page.refresh_from_db()
+        self.page.title = 'After'
+        self.page.save_revision().publish()
+        published = self.get()
+        self.assertEqual(published.json()['items'][0]['title'], 'After')
+        self.assertNotEqual(published['ETag'], first['ETag'])
+
+    def test_if_none_match(self):
+        etag = self.get()['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        detail = self.client.get('/api/v2/pages/%d/' % self.page.pk)
+        self.assertEqual(detail.json()['title'], 'About')
+        not_modified = self.client.get(
+            '/api/v2/pages/%d/' % self.page.pk, HTTP_IF_NONE_MATCH=detail['ETag'],
+        )
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_if_modified_since_is_not_enough(self):
+        self.page.save_revision().publish()
+        last_modified = self.get()['Last-Modified']
+        self.assertEqual(self.get(HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 200)
+
+    def test_view_restrictions_drop_cached_payloads(self):
+        child = self.page.add_child(instance=FlexPage(title='Team', slug='team'))
+        self.assertEqual(len(self.get().json()['items']), 2)
+
+        restriction = PageViewRestriction.objects.create(
+            page=self.page, restriction_type=PageViewRestriction.PASSWORD, password='secret',
+        )
+        self.assertEqual(self.get().json()['items'], [])
+        self.assertEqual(self.client.get('/api/v2/pages/%d/' % child.pk).status_code, 404)
+
+        restriction.delete()
+        self.assertEqual(len(self.get().json()['items']), 2)
+
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(
+    MEDIA_ROOT=MEDIA_ROOT,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+)
+class PrefetchingStreamTestCase(TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        Site.get_site_root_paths()
+        self.root = Site.objects.get(is_default_site=True).root_page
+        self.image = Image.objects.create(title='Card', file=get_test_image_file())
+
+    def make_page(self, slug, card_count):
+        cards = []
+        for i in range(card_count):
+            target = self.root.add_child(instance=FlexPage(title='Target', slug='%s-%d' % (slug, i)))
+            cards.append({'image': self.image.pk, 'title': 'Card', 'text': 'Text', 'button_page': target.pk})
+        page = self.root.add_child(instance=FlexPage(
+            title='Cards', slug=slug,
+            content=json.dumps([
+                {'type': 'cards', 'value': {'title': 'Cards', 'cards': cards}},
+                {'type': 'cta', 'value': {
+                    'title': 'CTA', 'text': 'Text', 'button_page': self.root.pk, 'button_text': 'Go',
+                }},
+            ]),
+        ))
+        return FlexPage.objects.get(pk=page.pk)
+
+    def load_cards(self, page):
+        with CaptureQueriesContext(connection) as queries:
+            cards = [card for block in page.content if block.block_type == 'cards' for card in block.value['cards']]
+            urls = [card.url() for card in cards]
+        return cards, urls, len(queries)
+
+    def test_choosers_are_loaded_in_bulk(self):
+        cards, urls, one_card_queries = self.load_cards(self.make_page('one', 1))
+        self.assertEqual(urls, ['/one-0/'])
+        self.assertEqual(cards[0]['image'], self.image)
+
+        cards, urls, many_card_queries = self.load_cards(self.make_page('many', 5))
+        self.assertEqual(urls, ['/many-%d/' % i for i in range(5)])
+        self.assertEqual(many_card_queries, one_card_queries)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ImageRenditionsTagTestCase(TestCase):
+
+    template = Template(
+        "{% load core_tags %}"
+        "{% image_renditions cards 'fill-50x50' 'image' as pairs %}"
+        "{% for card, img in pairs %}{{ img.url }} {% endfor %}"
+    )
+
+    def test_existing_renditions_are_fetched_in_one_query(self):
+        images = [Image.objects.create(title='Card', file=get_test_image_file()) for i in range(4)]
+        cards = [{'image': image} for image in images] + [{'image': None}]
+        first = self.template.render(Context({'cards': cards}))
+        self.assertEqual(first.count('.png'), 4)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.template.render(Context({'cards': cards})), first)
+
+    def test_missing_original_gets_a_placeholder(self):
+        image = Image.objects.create(title='Card', file=get_test_image_file())
+        image.file.storage.delete(image.file.name)
+        image = Image.objects.get(pk=image.pk)
+        html = self.template.render(Context({'cards': [{'image': image}]}))
+        self.assertEqual(html, '/media/not-found ')
+
+    @override_settings(IMAGE_SRCSET_WIDTHS=[100])
+    def test_picture_offers_narrower_and_webp_variants(self):
+        image = Image.objects.create(title='Banner', file=get_test_image_file())
+        template = Template(
+            "{% load core_tags %}"
+            "{% responsive_image image 'width-400' as banner %}{% picture banner class='w-100' %}"
+        )
+        html = template.render(Context({'image': image}))
+        self.assertIn('<source type="image/webp" srcset="', html)
+        self.assertIn('width-100.format-webp.webp 100w', html)
+        self.assertIn('width-100.png 100w', html)
+        self.assertIn('class="w-100"', html)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(template.render(Context({'image': image})), html)
+
+    def test_picture_of_a_missing_original(self):
+        image = Image.objects.create(title='Banner', file=get_test_image_file())
+        image.file.storage.delete(image.file.name)
+        image = Image.objects.get(pk=image.pk)
+        template = Template(
+            "{% load core_tags %}"
+            "{% responsive_image image 'width-400' as banner %}{% picture banner %}"
+        )
+        html = template.render(Context({'image': image}))
+        self.assertIn('<source type="image/webp" srcset=""', html)
+        self.assertIn('<img src="/media/not-found" srcset=""', html)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class GenerateRenditionsTestCase(TestCase):
+
+    def test_specs_are_discovered(self):
+        specs = discover_filter_specs()
+        # Templates, ImageRenditionField and register_filter_spec respectively
+        for spec in ['fill-500x300', 'width-1500', 'fill-200x250', 'fill-250x250']:
+            self.assertIn(spec, specs)
+
+    def test_missing_renditions_are_generated(self):
+        image = Image.objects.create(title='Upload', file=get_test_image_file())
+        image.get_rendition('fill-50x50')
+
+        call_command('generate_renditions', '--dry-run', stdout=StringIO())
+        self.assertEqual(image.renditions.count(), 1)
+
+        call_command('generate_renditions', '--workers', '1', stdout=StringIO())
+        self.assertEqual(image.renditions.count(), len(discover_filter_specs()))
+
+    def test_images_are_checked_in_batches(self):
+        images = [Image.objects.create(title='Upload', file=get_test_image_file()) for i in range(3)]
+        out = StringIO()
+        call_command('generate_renditions', '--workers', '1', '--batch-size', '2', '--spec', 'fill-50x50', stdout=out)
+        self.assertIn('Generated 3 renditions for 3 images', out.getvalue())
+        self.assertEqual([image.renditions.count() for image in images], [1, 1, 1])
+
+
+@override_settings(
+    MEDIA_ROOT=MEDIA_ROOT,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+)
+class APIExpandTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        root = Site.objects.get(is_default_site=True).root_page
+        self.about = root.add_child(instance=FlexPage(title='About', slug='about'))
+        self.home = root.add_child(instance=HomePage(
+            title='Home', slug='home', banner_title='Hi', banner_subtitle='<p>There</p>',
+            banner_image=self.make_image(), banner_cta=self.about,
+        ))
+
+    def make_image(self):
+        return Image.objects.create(title='Test image', file=get_test_image_file())
+
+    def get(self, **params):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/v2/pages/%d/' % self.home.pk, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json(), len(queries)
+
+    def test_related_images_and_pages_are_inlined(self):
+        HomePageCarouselImages.objects.create(page=self.home, carousel_image=self.make_image())
+        data, queries = self.get(
+            expand='banner_image,banner_cta,carousel_images.carousel_image', rendition='fill-250x250',
+        )
+        self.assertEqual(data['banner_image']['width'], 640)
+        self.assertEqual(data['banner_image']['rendition']['width'], 250)
+        self.assertEqual(data['carousel_images'][0]['carousel_image']['rendition']['height'], 250)
+        self.assertEqual(data['banner_cta']['meta']['type'], 'flex.FlexPage')
+        self.assertEqual(data['banner_cta']['meta']['slug'], 'about')
+
+        # Only renditions the site already uses can be asked for
+        response = self.client.get(
+            '/api/v2/pages/%d/' % self.home.pk, {'expand': 'banner_image', 'rendition': 'fill-9x9'},
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_missing_original_is_an_error(self):
+        image = self.home.banner_image
+        image.file.storage.delete(image.file.name)
+        data, queries = self.get(expand='banner_image', rendition='fill-250x250')
+        self.assertEqual(data['banner_image']['rendition'], {'error': 'SourceImageIOError'})
+
+    def test_expanding_more_images_costs_no_more_queries(self):
+        HomePageCarouselImages.objects.create(page=self.home, carousel_image=self.make_image())
+        params = {'expand': 'banner_image,carousel_images.carousel_image', 'rendition': 'fill-250x250'}
+        self.get(**params)
+        few = self.get(**params)[1] - self.get()[1]
+
+        for i in range(3):
+            HomePageCarouselImages.objects.create(page=self.home, carousel_image=self.make_image())
+        self.get(**params)
+        many = self.get(**params)[1] - self.get()[1]
+        self.assertEqual(few, many)
+
+
+@override_settings(
+    MEDIA_ROOT=MEDIA_ROOT,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+)
+class StreamRepresentationTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.root = Site.objects.get(is_default_site=True).root_page
+        self.home = self.root.add_child(instance=HomePage(
+            title='Home', slug='home', banner_title='Hi', banner_subtitle='<p>There</p>',
+            banner_image=Image.objects.create(title='Banner', file=get_test_image_file()),
+            content=self.cta('Go'), live=False,
+        ))
+        self.home.save_revision().publish()
+
+    def cta(self, button_text):
+        return json.dumps([{'type': 'cta', 'value': {
+            'title': 'CTA', 'text': '<p>Text</p>', 'button_page': self.root.pk, 'button_text': button_text,
+        }}])
+
+    def content(self):
+        cache.clear()
+        return self.client.get('/api/v2/pages/%d/' % self.home.pk).json()['content']
+
+    def test_representations_are_stored_on_publish(self):
+        stored = StreamFieldRepresentation.objects.get(page=self.home, field_name='content')
+        self.assertEqual(stored.data[0]['value']['button_text'], 'Go')
+
+        # What's stored is served as it is
+        stored.data[0]['value']['button_text'] = 'Stored'
+        stored.save()
+        self.assertEqual(self.content()[0]['value']['button_text'], 'Stored')
+
+        # Unless the stream has changed without a publish
+        self.home.refresh_from_db()
+        self.home.content = self.cta('Changed')
+        self.home.save()
+        self.assertEqual(self.content()[0]['value']['button_text'], 'Changed')
+
+    def test_backfill(self):
+        StreamFieldRepresentation.objects.all().delete()
+        call_command('store_stream_representations', '--batch-size', '1', stdout=StringIO())
+        self.assertEqual(
+            StreamFieldRepresentation.objects.get(page=self.home).data[0]['value']['button_page'],
+            self.root.pk,
+        )
+
+
+@override_settings(
+    MEDIA_ROOT=MEDIA_ROOT,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage',
+    STREAMFIELD_RENDER_ON_PUBLISH=True,
+)
+class StreamRenderingTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.root = Site.objects.get(is_default_site=True).root_page
+        self.target = self.root.add_child(instance=FlexPage(title='Target', slug='target'))
+        self.image = Image.objects.create(title='Walrus', file=get_test_image_file())
+        self.page = self.root.add_child(instance=FlexPage(title='Cards', slug='cards', live=False, content=json.dumps([
+            {'type': 'cards', 'value': {'title': 'Cards', 'cards': [
+                {'image': self.image.pk, 'title': 'Card', 'text': 'Text', 'button_page': self.target.pk},
+            ]}},
+            {'type': 'full_richtext', 'value': '<p><a linktype="page" id="%d">Linked</a></p>' % self.target.pk},
+        ])))
+        self.page.save_revision().publish()
+
+    def html(self):
+        return StreamFieldRendering.objects.get(page=self.page, field_name='content').html
+
+    def test_html_is_stored_on_publish(self):
+        self.assertIn('alt="Walrus"', self.html())
+        self.assertIn('<a href="/target/">Linked</a>', self.html())
+
+        with override_settings(STREAMFIELD_RENDER_ON_PUBLISH=False):
+            self.client.get('/cards/')
+            with CaptureQueriesContext(connection) as rendered:
+                response = self.client.get('/cards/')
+        with CaptureQueriesContext(connection) as stored:
+            self.assertEqual(self.client.get('/cards/').content, response.content)
+        self.assertLess(len(stored), len(rendered))
+
+    def test_changes_to_what_streams_show_render_them_again(self):
+        self.image.title = 'Seal'
+        self.image.save()
+        self.assertIn('alt="Seal"', self.html())
+
+        self.target.slug = 'moved'
+        self.target.save_revision().publish()
+        self.assertIn('href="/moved/"', self.html())
+        self.assertNotIn('/target/', self.html())
+
+    def test_changed_templates_render_again_when_viewed(self):
+        StreamFieldRendering.objects.filter(page=self.page).update(html='Stale', templates_hash='old')
+        response = self.client.get('/cards/')
+        self.assertNotContains(response, 'Stale')
+        self.assertIn('alt="Walrus"', self.html())
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+)
+class RichTextCacheTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        root = Site.objects.get(is_default_site=True).root_page
+        self.walrus = root.add_child(instance=FlexPage(title='Walrus', slug='walrus'))
+        self.seal = root.add_child(instance=FlexPage(title='Seal', slug='seal'))
+        self.source = (
+            '<p><a linktype="page" id="%d">Walrus</a> and <a linktype="page" id="%d">seal</a>, '
+            '<a linktype="page" id="999">gone</a> <code>x</code></p>' % (self.walrus.pk, self.seal.pk)
+        )
+
+    def render(self, source):
+        return Template('{% load core_tags %}{{ source|cached_richtext }}').render(Context({'source': source}))
+
+    def test_expansion_matches_wagtail(self):
+        expected = Template('{% load wagtailcore_tags %}{{ source|richtext }}').render(
+            Context({'source': self.source})
+        )
+        with self.assertNumQueries(1):
+            self.assertEqual(self.render(self.source), expected)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.render(self.source), expected)
+        self.assertIn('<a href="/walrus/">Walrus</a>', expected)
+
+    def test_expanded_again_when_a_linked_page_moves(self):
+        self.render(self.source)
+        self.walrus.slug = 'tusks'
+        self.walrus.save_revision().publish()
+        html = self.render(self.source)
+        self.assertIn('<a href="/tusks/">Walrus</a>', html)
+        self.assertIn('<a href="/seal/">seal</a>', html)
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage',
+)
+class SitemapTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.root = Site.objects.get(is_default_site=True).root_page
+
+    def publish(self, slug):
+        page = self.root.add_child(instance=FlexPage(title=slug, slug=slug, live=False))
+        page.save_revision().publish()
+        return page
+
+    def get(self, path, **headers):
+        response = self.client.get(path, **headers)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_entries_follow_publishing(self):
+        walrus = self.publish('walrus')
+        self.get('/sitemap.xml')
+        with self.assertNumQueries(0):
+            index = self.get('/sitemap.xml').content.decode()
+        root_url = Site.objects.get(is_default_site=True).root_url
+        self.assertIn('<loc>%s/sitemap-0.xml</loc>' % root_url, index)
+        self.assertIn('<loc>%s/walrus/</loc>' % root_url, self.get('/sitemap-0.xml').content.decode())
+
+        walrus.refresh_from_db()
+        walrus.unpublish()
+        self.publish('seal')
+        shard = self.get('/sitemap-0.xml').content.decode()
+        self.assertNotIn('/walrus/', shard)
+        self.assertIn('/seal/</loc>', shard)
+
+    def test_shards_are_cached_separately(self):
+        with override_settings(SITEMAP_SHARD_SIZE=1):
+            walrus = self.publish('walrus')
+            seal = self.publish('seal')
+            shards = ['/sitemap-%d.xml' % walrus.pk, '/sitemap-%d.xml' % seal.pk]
+            for shard in shards:
+                self.assertIn(shard, self.get('/sitemap.xml').content.decode())
+                self.get(shard)
+
+            self.publish('tusks')
+            with self.assertNumQueries(0):
+                self.get(shards[0])
+            self.assertEqual(self.client.get('/sitemap-%d.xml' % (seal.pk + 99)).status_code, 404)
+
+    def test_gzip_and_etag(self):
+        self.publish('walrus')
+        plain = self.get('/sitemap-0.xml')
+        gzipped = self.get('/sitemap-0.xml', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(gzipped['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(gzipped.content), plain.content)
+        self.assertNotEqual(gzipped['ETag'], plain['ETag'])
+
+        not_modified = self.client.get('/sitemap-0.xml', HTTP_IF_NONE_MATCH=plain['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_unpublishing_changes_the_etag(self):
+        self.publish('walrus')
+        seal = self.publish('seal')
+        first = self.get('/sitemap-0.xml')
+
+        # The newest lastmod goes back to walrus's
+        seal.refresh_from_db()
+        seal.unpublish()
+        for headers in [
+            {'HTTP_IF_NONE_MATCH': first['ETag']},
+            {'HTTP_IF_MODIFIED_SINCE': first['Last-Modified']},
+        ]:
+            self.assertNotIn('/seal/', self.get('/sitemap-0.xml', **headers).content.decode())
+
+    def test_build_sitemap(self):
+        self.publish('walrus')
+        SitemapEntry.objects.all().delete()
+        call_command('build_sitemap', stdout=StringIO())
+        self.assertIn('/walrus/</loc>', self.get('/sitemap-0.xml').content.decode())
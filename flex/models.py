@@ -6,11 +6,13 @@ from wagtail.admin.edit_handlers import FieldPanel, StreamFieldPanel
 from wagtail.core.models import Page 
 from wagtail.core.fields import StreamField
 
+from core.page_cache import CachedPageMixin
+from core.streams import PrefetchingStreamBlock
 from streams import blocks
 
 
 
-class FlexPage(Page):
+class FlexPage(CachedPageMixin, Page):
 
     template = 'flex/flex_page.html'
     subpage_types = ['flex.FlexPage', 'contact.ContactPage']
@@ -20,16 +22,17 @@ class FlexPage(Page):
     ]
 
     content = StreamField(
-        [
+        PrefetchingStreamBlock([
             ('title_and_text', blocks.TitleAndTextBlock()),
             ('full_richtext', blocks.RichTextBlock()),
             ('cards', blocks.CardBlock()),
             ('cta', blocks.CTABlock()),
             ('button', blocks.ButtonBlock())
-        ],
+        ], required=False),
         null=True,
         blank=True
     )
+    rendered_stream_fields = ['content']
 
     subtitle = models.CharField(max_length=100, null=True, blank=True)
 
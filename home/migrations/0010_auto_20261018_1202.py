@@ -0,0 +1,21 @@
+# Generated by Django 3.1.1 on 2026-10-18 12:02
+
+import core.rich_text
+from django.db import migrations
+import wagtail.core.blocks
+import wagtail.core.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0009_auto_20200926_1044'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='homepage',
+            name='content',
+            field=wagtail.core.fields.StreamField([('cta', wagtail.core.blocks.StructBlock([('title', wagtail.core.blocks.CharBlock(max_length=50, required=True)), ('text', core.rich_text.CachedRichTextBlock(features=['bold', 'italic'], required=True)), ('button_page', wagtail.core.blocks.PageChooserBlock(required=False)), ('button_url', wagtail.core.blocks.URLBlock(required=False)), ('button_text', wagtail.core.blocks.CharBlock(default='Learn More', max_length=40, requred=True))]))], blank=True, null=True),
+        ),
+    ]
@@ -18,7 +18,11 @@ from wagtail.admin.edit_handlers import (
     PageChooserPanel 
 )
 from wagtail.contrib.routable_page.models import RoutablePageMixin, route
+from wagtail.images.models import Image
 
+from core.cache import invalidation
+from core.page_cache import CachedPageMixin
+from core.streams import PrefetchingStreamBlock, StreamRepresentationField
 from streams import blocks 
 
 class HomePageCarouselImages(Orderable):
@@ -46,7 +50,7 @@ class HomePageCarouselImages(Orderable):
     ]
 
 
-class HomePage(RoutablePageMixin, Page):
+class HomePage(CachedPageMixin, RoutablePageMixin, Page):
     templates = 'home/home_page.html'
 
     subpage_types = [
@@ -77,12 +81,13 @@ class HomePage(RoutablePageMixin, Page):
     )
 
     content = StreamField(
-        [
+        PrefetchingStreamBlock([
             ('cta', blocks.CTABlock()),
-        ],
+        ], required=False),
         null=True,
         blank=True
     )
+    rendered_stream_fields = ['content']
 
     api_fields = [
         APIField('banner_title'),
@@ -90,7 +95,7 @@ class HomePage(RoutablePageMixin, Page):
         APIField('banner_image'),
         APIField('banner_cta'),
         APIField('carousel_images'),
-        APIField('content'),
+        APIField('content', serializer=StreamRepresentationField()),
     ]
 
     max_count = 1
@@ -129,3 +134,10 @@ class HomePage(RoutablePageMixin, Page):
         context = self.get_context(request, *args, **kwargs)
         return render(request, 'home/subscribe.html', context)
 
+
+@invalidation.register(Image)
+def home_image_changed(image):
+    """ The banner and carousel images are rendered into the home page """
+    yield from HomePage.objects.filter(
+        models.Q(banner_image=image) | models.Q(carousel_images__carousel_image=image)
+    ).distinct()
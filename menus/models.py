@@ -1,7 +1,8 @@
 """Menus models."""
-from django.db import models
+from collections import namedtuple
+
 from django.core.cache import cache
-from django.core.cache.utils import make_template_fragment_key
+from django.db import models
 
 from django_extensions.db.fields import AutoSlugField
 from modelcluster.fields import ParentalKey
@@ -12,9 +13,19 @@ from wagtail.admin.edit_handlers import (
     FieldPanel,
     PageChooserPanel,
 )
-from wagtail.core.models import Orderable
+from wagtail.core.models import Orderable, Page
 from wagtail.snippets.models import register_snippet
 
+from core.cache import EVERY_PAGE, Fragment, get_generation, invalidation
+from core.page_urls import get_page_url
+
+# What templates get from get_menu: plain, immutable values with nothing left to load
+MenuLink = namedtuple('MenuLink', ['title', 'link', 'open_in_new_tab'])
+ResolvedMenu = namedtuple('ResolvedMenu', ['title', 'slug', 'menu_items'])
+
+# slug -> (generation, ResolvedMenu), shared by every request this process serves
+_resolved_menus = {}
+
 
 class MenuItem(Orderable):
 
@@ -45,15 +56,10 @@ class MenuItem(Orderable):
         FieldPanel("open_in_new_tab"),
     ]
 
-    def save(self, *args, **kwargs):
-        key = make_template_fragment_key('navigation')
-        cache.delete(key)
-        return super().save(*args, **kwargs)
-
     @property
     def link(self):
-        if self.link_page:
-            return self.link_page.url
+        if self.link_page_id:
+            return get_page_url(self.link_page_id)
         elif self.link_url:
             return self.link_url
         return '#'
@@ -85,3 +91,59 @@ class Menu(ClusterableModel):
 
     def __str__(self):
         return self.title
+
+    @classmethod
+    def resolve(cls, slug=None):
+        """ Load a menu with all its links resolved, or the first menu when there's no slug """
+        if slug is None:
+            slug = cls.objects.order_by('pk').values_list('slug', flat=True).first()
+            if slug is None:
+                return None
+
+        items = list(
+            MenuItem.objects.filter(page__slug=slug).select_related('page', 'link_page')
+        )
+        menu = items[0].page if items else cls.objects.filter(slug=slug).first()
+        if menu is None:
+            return None
+
+        return ResolvedMenu(
+            title=menu.title,
+            slug=menu.slug,
+            menu_items=tuple(
+                MenuLink(item.title, item.link, item.open_in_new_tab) for item in items
+            ),
+        )
+
+    @classmethod
+    def get_resolved(cls, slug=None):
+        """ Menu.resolve(), memoized in this process and in the shared cache """
+        generation = get_generation('menu')
+        memoized = _resolved_menus.get(slug)
+        if memoized and memoized[0] == generation:
+            return memoized[1]
+
+        key = 'menu:%s:%s' % (slug or '', generation)
+        menu = cache.get(key)
+        if menu is None:
+            menu = cls.resolve(slug)
+            cache.set(key, menu, None)
+        _resolved_menus[slug] = (generation, menu)
+        return menu
+
+
+@invalidation.register(Menu, MenuItem)
+def menu_changed(menu):
+    """ The menu is cached in the navigation fragment on every page """
+    yield Fragment('menu')
+    yield Fragment('navigation')
+    yield EVERY_PAGE
+
+
+@invalidation.register(Page)
+def menu_page_changed(page):
+    """ Menu items show the title and url of the page they link to """
+    if MenuItem.objects.filter(link_page__path__startswith=page.path).exists():
+        yield Fragment('menu')
+        yield Fragment('navigation')
+        yield EVERY_PAGE
@@ -6,5 +6,5 @@ register = template.Library()
 
 
 @register.simple_tag()
-def get_menu():
-    return Menu.objects.first()
\ No newline at end of file
+def get_menu(slug=None):
+    return Menu.get_resolved(slug)
@@ -1,3 +1,57 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
-# Create your tests here.
+from wagtail.core.models import Site
+
+from core.cache import get_generation
+from flex.models import FlexPage
+
+from .models import Menu, MenuItem, MenuLink
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class MenuCacheInvalidationTestCase(TestCase):
+
+    def setUp(self):
+        root = Site.objects.get(is_default_site=True).root_page
+        self.page = root.add_child(instance=FlexPage(title='About', slug='about'))
+        self.menu = Menu.objects.create(title='Main')
+
+    def test_saving_a_menu_item_purges_navigation(self):
+        before = get_generation('navigation')
+        MenuItem.objects.create(page=self.menu, link_page=self.page)
+        self.assertGreater(get_generation('navigation'), before)
+
+    def test_publishing_a_linked_page_purges_navigation(self):
+        MenuItem.objects.create(page=self.menu, link_page=self.page)
+        before = get_generation('navigation')
+
+        self.page.title = 'About us'
+        self.page.save_revision().publish()
+
+        self.assertGreater(get_generation('navigation'), before)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ResolvedMenuTestCase(TestCase):
+
+    def setUp(self):
+        root = Site.objects.get(is_default_site=True).root_page
+        self.page = root.add_child(instance=FlexPage(title='About', slug='about'))
+        self.menu = Menu.objects.create(title='Main')
+        MenuItem.objects.create(page=self.menu, link_page=self.page, sort_order=0)
+        MenuItem.objects.create(page=self.menu, link_title='Docs', link_url='https://example.com', sort_order=1)
+
+    def test_menu_is_resolved_once(self):
+        menu = Menu.get_resolved(self.menu.slug)
+        self.assertEqual(
+            menu.menu_items,
+            (MenuLink('About', self.page.url, False), MenuLink('Docs', 'https://example.com', False)),
+        )
+        with self.assertNumQueries(0):
+            self.assertEqual(Menu.get_resolved(self.menu.slug), menu)
+
+    def test_renaming_a_linked_page_rebuilds_the_menu(self):
+        Menu.get_resolved(self.menu.slug)
+        self.page.title = 'About us'
+        self.page.save_revision().publish()
+        self.assertEqual(Menu.get_resolved(self.menu.slug).menu_items[0].title, 'About us')
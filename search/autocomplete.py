@@ -0,0 +1,219 @@
+""" In-memory prefix index for the navbar's search suggestions.
+
+Each process keeps live page titles, blog categories and blog tags in a
+sorted array, with one key per word of each label, so "fac" finds "Walrus
+facts". Lookups are a bisect into that array and never query the database.
+
+Changes are shared between processes through the cache, the same way as
+search hits: every publish, unpublish, delete or category change takes the
+next numbered slot. On each lookup a process compares the slot counter with
+the last change it applied and applies the ones it missed. It only rebuilds
+from the database when it starts, after a page move (which can change many
+urls) or when some of the changes it missed have been evicted.
+"""
+import logging
+import threading
+from bisect import bisect_left, insort
+
+from django.core.cache import cache
+
+from wagtail.core.models import Page
+
+from blog.models import BlogCategory, BlogListingPage, BlogPageTag
+from core.cache import initial_generation
+from core.page_urls import get_page_url, get_page_urls
+from .backends import TOKEN_RE
+
+logger = logging.getLogger(__name__)
+
+NEXT_CHANGE_KEY = 'autocomplete:next'
+
+# More missed changes than this and a rebuild is cheaper than catching up
+MAX_CHANGES = 1000
+
+CHANGE_TIMEOUT = 60 * 60 * 24
+
+REBUILD = 'rebuild'
+
+
+def change_key(number):
+    return 'autocomplete:change:%d' % number
+
+
+def normalise(text):
+    return ' '.join(TOKEN_RE.findall(text.casefold()))
+
+
+class PrefixIndex:
+    """ Suggestions, each {'title', 'url', 'type'}, found by the start of any word of their title """
+
+    def __init__(self):
+        self.keys = []
+        self.suggestions = {}
+        self.titles = {}
+
+    def __len__(self):
+        return len(self.suggestions)
+
+    def copy(self):
+        index = PrefixIndex()
+        index.keys = list(self.keys)
+        index.suggestions = dict(self.suggestions)
+        index.titles = dict(self.titles)
+        return index
+
+    @staticmethod
+    def _keys(item, title):
+        words = title.split(' ')
+        return [(' '.join(words[i:]), item) for i in range(len(words)) if words[i]]
+
+    def add(self, item, suggestion):
+        """ Add or replace the suggestion for item, a (type, id) pair """
+        self.remove(item)
+        self.suggestions[item] = suggestion
+        self.titles[item] = normalise(suggestion['title'])
+        for key in self._keys(item, self.titles[item]):
+            insort(self.keys, key)
+
+    def remove(self, item):
+        if item not in self.suggestions:
+            return
+        for key in self._keys(item, self.titles[item]):
+            i = bisect_left(self.keys, key)
+            if i < len(self.keys) and self.keys[i] == key:
+                del self.keys[i]
+        del self.suggestions[item], self.titles[item]
+
+    def lookup(self, prefix, limit=8):
+        """ Suggestions with a word starting with prefix, those whose title starts with it first """
+        prefix = normalise(prefix)
+        if not prefix:
+            return []
+        found = set()
+        for i in range(bisect_left(self.keys, (prefix,)), len(self.keys)):
+            key, item = self.keys[i]
+            if not key.startswith(prefix):
+                break
+            found.add(item)
+        found = sorted(found, key=lambda item: (
+            not self.titles[item].startswith(prefix), self.titles[item],
+        ))
+        return [self.suggestions[item] for item in found[:limit]]
+
+
+def page_suggestion(page, url=None):
+    return {'title': page.title, 'url': url or page.get_url(), 'type': 'page'}
+
+
+def listing_suggestion(route, obj, listing=None):
+    """ A suggestion for a blog category or tag, linking to its posts on the blog listing page """
+    listing = listing or BlogListingPage.objects.live().first()
+    listing_url = get_page_url(listing) if listing else None
+    if not listing_url:
+        return None
+    path = listing.reverse_subpage(route, kwargs={route: obj.slug})
+    return {'title': obj.name, 'url': listing_url + path, 'type': route}
+
+
+def build_index():
+    """ A full PrefixIndex, in a fixed number of queries """
+    index = PrefixIndex()
+    pages = list(Page.objects.live().public().filter(depth__gt=1).only('pk', 'title', 'url_path'))
+    urls = get_page_urls(page.pk for page in pages)
+    for page in pages:
+        index.add(('page', page.pk), page_suggestion(page, urls[page.pk][0]))
+
+    listing = BlogListingPage.objects.live().first()
+    if listing is not None:
+        tags = {
+            tagged_item.tag for tagged_item in
+            BlogPageTag.objects.filter(content_object__live=True).select_related('tag')
+        }
+        for route, objects in [('category', BlogCategory.objects.all()), ('tag', tags)]:
+            for obj in objects:
+                suggestion = listing_suggestion(route, obj, listing)
+                if suggestion:
+                    index.add((route, obj.pk), suggestion)
+    return index
+
+
+def _next_change():
+    try:
+        return cache.incr(NEXT_CHANGE_KEY)
+    except ValueError:
+        cache.add(NEXT_CHANGE_KEY, initial_generation(), None)
+        return cache.incr(NEXT_CHANGE_KEY)
+
+
+def record_change(item, suggestion=None):
+    """ Share an added (with its suggestion), removed (without) or REBUILD item with every process """
+    # Where incr() isn't atomic two changes can get the same number. add()
+    # then keeps the first, and the other one moves on to the next number
+    # rather than overwriting it
+    for attempt in range(5):
+        if cache.add(change_key(_next_change()), (item, suggestion), CHANGE_TIMEOUT):
+            return
+    logger.warning("Couldn't record an autocomplete change, every number taken was in use")
+
+
+_local = {'applied': None, 'index': None}
+_lock = threading.Lock()
+
+
+def get_index():
+    """ This process's PrefixIndex, caught up with the changes other processes have recorded """
+    latest = cache.get(NEXT_CHANGE_KEY)
+    if latest is None:
+        cache.add(NEXT_CHANGE_KEY, initial_generation(), None)
+        latest = cache.get(NEXT_CHANGE_KEY)
+
+    with _lock:
+        applied, index = _local['applied'], _local['index']
+        if index is not None and applied == latest:
+            return index
+
+        changes = None
+        if index is not None and applied < latest <= applied + MAX_CHANGES:
+            keys = [change_key(number) for number in range(applied + 1, latest + 1)]
+            found = cache.get_many(keys)
+            if len(found) == len(keys):
+                changes = [found[key] for key in keys]
+
+        if changes is None or any(item == REBUILD for item, suggestion in changes):
+            index = build_index()
+        else:
+            # Other threads may be looking up in the current index
+            index = index.copy()
+            for item, suggestion in changes:
+                if suggestion is None:
+                    index.remove(item)
+                else:
+                    index.add(item, suggestion)
+
+        _local['applied'], _local['index'] = latest, index
+        return index
+
+
+def suggest(prefix, limit=8):
+    return get_index().lookup(prefix, limit)
+
+
+def page_published(page):
+    """ Record the suggestions of a newly published page, and of the tags of a blog post """
+    if page.depth <= 1 or page.get_view_restrictions().exists():
+        record_change(('page', page.pk))
+        return
+
+    suggestion = page_suggestion(page)
+    old = get_index().suggestions.get(('page', page.pk))
+    if isinstance(page, BlogListingPage) or (
+        old and old['url'] != suggestion['url'] and not page.is_leaf()
+    ):
+        # Category, tag or descendant urls have changed as well
+        record_change(REBUILD)
+        return
+    record_change(('page', page.pk), suggestion)
+
+    if hasattr(page, 'tags'):
+        for tag in page.tags.all():
+            record_change(('tag', tag.pk), listing_suggestion('tag', tag))
@@ -0,0 +1,311 @@
+""" A self-contained page search backend on SQLite's FTS5.
+
+Every live page has one row in the search_page_fts table, keyed on its id,
+with its text split into title, subtitle and body columns so matches in the
+title rank highest. Use it with Page.objects.live().search(query, backend='pages'),
+the search app's signal handlers keep it up to date as pages are published.
+
+    WAGTAILSEARCH_BACKENDS = {
+        'pages': {'BACKEND': 'search.backends', 'AUTO_UPDATE': False},
+    }
+"""
+import re
+from html import unescape
+
+from django.db import connections, router
+from django.db.models import FloatField
+from django.db.models.expressions import RawSQL
+from django.utils.html import escape, strip_tags
+from django.utils.safestring import mark_safe
+
+from wagtail.core import blocks
+from wagtail.core.fields import RichTextField, StreamField
+from wagtail.core.models import Page
+from wagtail.search.backends.base import (
+    BaseSearchBackend, BaseSearchQueryCompiler, BaseSearchResults, EmptySearchResults,
+)
+from wagtail.search.query import MatchAll, Phrase, PlainText
+
+TABLE = 'search_page_fts'
+
+# bm25() weights for the title, subtitle and body columns
+WEIGHTS = (10.0, 4.0, 1.0)
+
+TOKEN_RE = re.compile(r'\w+')
+
+# snippet() wraps matches in these, so the text can be escaped before they become <mark>s
+MARK_START, MARK_END = '\x02', '\x03'
+
+
+def html_text(html):
+    return unescape(strip_tags(html or ''))
+
+
+def block_text(block, value):
+    """ The searchable text in a raw (JSON-ish) block value """
+    if value is None:
+        return []
+    if isinstance(block, blocks.RichTextBlock):
+        return [html_text(value)]
+    if isinstance(block, (blocks.CharBlock, blocks.TextBlock)):
+        return [value]
+    if isinstance(block, blocks.StructBlock):
+        return [
+            text for name, child_block in block.child_blocks.items()
+            for text in block_text(child_block, value.get(name))
+        ]
+    if isinstance(block, blocks.ListBlock):
+        return [text for item in value for text in block_text(block.child_block, item)]
+    if isinstance(block, blocks.StreamBlock):
+        return [
+            text for item in value if item['type'] in block.child_blocks
+            for text in block_text(block.child_blocks[item['type']], item['value'])
+        ]
+    return []
+
+
+def page_document(page):
+    """ (title, subtitle, body) text of a specific page """
+    title = [page.title, getattr(page, 'custom_title', None), page.seo_title]
+    subtitle = [getattr(page, 'subtitle', None), page.search_description]
+    body = []
+    for field in page._meta.concrete_fields:
+        value = getattr(page, field.attname)
+        if isinstance(field, StreamField) and value:
+            body += block_text(field.stream_block, field.stream_block.get_prep_value(value))
+        elif isinstance(field, RichTextField):
+            body.append(html_text(value))
+    return tuple(' '.join(text for text in texts if text) for texts in (title, subtitle, body))
+
+
+class PageIndex:
+    """ The FTS5 table, with the index interface wagtail's update_index expects """
+
+    name = TABLE
+
+    def __init__(self, using=None):
+        self.using = using or router.db_for_write(Page)
+
+    def cursor(self):
+        return connections[self.using].cursor()
+
+    def add_model(self, model):
+        pass
+
+    def refresh(self):
+        pass
+
+    def reset(self):
+        with self.cursor() as cursor:
+            cursor.execute('DELETE FROM %s' % TABLE)
+
+    def add_item(self, item):
+        self.add_items(type(item), [item])
+
+    def add_items(self, model, items):
+        if not issubclass(model, Page):
+            return
+        live, gone = [], []
+        for page in items:
+            # Only the page's own type has all of its fields, and drafts aren't searchable
+            if type(page) is not page.specific_class:
+                continue
+            (live if page.live else gone).append(page)
+
+        if gone:
+            self.delete_ids([page.pk for page in gone])
+        if live:
+            self.add_documents([(page.pk,) + page_document(page) for page in live])
+
+    def add_documents(self, documents):
+        """ Index (page id, title, subtitle, body) rows, replacing the pages' old ones """
+        with self.cursor() as cursor:
+            cursor.executemany(
+                'INSERT OR REPLACE INTO %s (rowid, title, subtitle, body) '
+                'VALUES (%%s, %%s, %%s, %%s)' % TABLE,
+                documents,
+            )
+
+    def delete_item(self, item):
+        self.delete_ids([item.pk])
+
+    def delete_ids(self, page_ids):
+        with self.cursor() as cursor:
+            cursor.executemany(
+                'DELETE FROM %s WHERE rowid = %%s' % TABLE, [(page_id,) for page_id in page_ids]
+            )
+
+    def page_ids(self):
+        with self.cursor() as cursor:
+            cursor.execute('SELECT rowid FROM %s' % TABLE)
+            return {row[0] for row in cursor.fetchall()}
+
+    def snippets(self, match, page_ids, tokens=24):
+        """ {page id: HTML excerpt of the body with the matches in <mark>s} """
+        page_ids = list(page_ids)
+        if not page_ids:
+            return {}
+        with self.cursor() as cursor:
+            cursor.execute(
+                'SELECT rowid, snippet(%s, 2, %%s, %%s, %%s, %%s) FROM %s '
+                'WHERE %s MATCH %%s AND rowid IN (%s)'
+                % (TABLE, TABLE, TABLE, ', '.join(['%s'] * len(page_ids))),
+                [MARK_START, MARK_END, '\u2026', tokens, match] + page_ids,
+            )
+            return {
+                page_id: mark_safe(
+                    escape(text).replace(MARK_START, '<mark>').replace(MARK_END, '</mark>')
+                )
+                for page_id, text in cursor.fetchall()
+            }
+
+
+class PageIndexRebuilder:
+    """ Empties the table, for update_index --backend pages """
+
+    def __init__(self, index):
+        self.index = index
+
+    def start(self):
+        self.index.reset()
+        return self.index
+
+    def finish(self):
+        pass
+
+
+class FTS5SearchQueryCompiler(BaseSearchQueryCompiler):
+    DEFAULT_OPERATOR = 'and'
+
+    def check(self):
+        # The queryset is filtered by the database itself, so any filter works
+        pass
+
+    def _term(self, term):
+        return '"%s"%s' % (term, '*' if self.partial_match else '')
+
+    def match_expression(self):
+        """ The FTS5 MATCH string for the query, None when it can't match anything """
+        query = self.query
+        if isinstance(query, PlainText):
+            terms = TOKEN_RE.findall(query.query_string)
+            joiner = ' OR ' if query.operator == 'or' else ' AND '
+            return joiner.join(self._term(term) for term in terms) or None
+        if isinstance(query, Phrase):
+            terms = TOKEN_RE.findall(query.query_string)
+            return '"%s"' % ' '.join(terms) if terms else None
+        raise NotImplementedError(
+            '%s is not supported by the FTS5 search backend' % type(query).__name__
+        )
+
+
+class FTS5SearchResults(BaseSearchResults):
+
+    def _matching(self):
+        queryset = self.query_compiler.queryset
+        if isinstance(self.query_compiler.query, MatchAll):
+            return queryset, None
+        match = self.query_compiler.match_expression()
+        if match is None:
+            return queryset.none(), None
+        subquery = RawSQL('SELECT rowid FROM %s WHERE %s MATCH %%s' % (TABLE, TABLE), [match])
+        return queryset.filter(pk__in=subquery), match
+
+    def _do_search(self):
+        queryset, match = self._matching()
+        if self.prefetch_related:
+            queryset = queryset.prefetch_related(*self.prefetch_related)
+
+        if match is None:
+            results = list(queryset[self.start:self.stop])
+            scores = {}
+        else:
+            scored = queryset.annotate(search_score=self.backend.score(queryset.model, match))
+            if self.query_compiler.order_by_relevance:
+                scored = scored.order_by('search_score', 'pk')
+            # The database sorts and slices, only the page's ids and scores come
+            # back, then the pages themselves from the caller's queryset
+            ranked = list(scored.values_list('pk', 'search_score')[self.start:self.stop])
+            scores = dict(ranked)
+            objects = queryset.order_by().in_bulk(scores.keys())
+            results = [objects[pk] for pk, score in ranked if pk in objects]
+
+        if self._score_field:
+            for obj in results:
+                # bm25 is negative, higher is better everywhere else in wagtail
+                setattr(obj, self._score_field, -(scores.get(obj.pk) or 0))
+        return results
+
+    def _do_count(self):
+        queryset, match = self._matching()
+        count = queryset.count()
+        if self.stop is not None:
+            count = min(count, self.stop)
+        return max(count - self.start, 0)
+
+
+class FTS5SearchBackend(BaseSearchBackend):
+    query_compiler_class = FTS5SearchQueryCompiler
+    results_class = FTS5SearchResults
+    rebuilder_class = PageIndexRebuilder
+
+    def __init__(self, params):
+        super().__init__(params)
+        self.index = PageIndex(params.get('DATABASE'))
+
+    def get_index_for_model(self, model):
+        return self.index if issubclass(model, Page) else None
+
+    def reset_index(self):
+        self.index.reset()
+
+    def refresh_index(self):
+        pass
+
+    def add(self, obj):
+        if isinstance(obj, Page):
+            self.index.add_item(obj)
+
+    def add_bulk(self, model, obj_list):
+        self.index.add_items(model, obj_list)
+
+    def delete(self, obj):
+        if isinstance(obj, Page):
+            self.index.delete_item(obj)
+
+    def scored(self, queryset, query):
+        """ The pages of queryset that match query, with their bm25 search_score, lower is better.
+
+        Unlike search() this is a plain queryset, so it can be filtered and
+        ordered on the score, e.g. for keyset pagination.
+        """
+        match = self.query_compiler_class(queryset, query).match_expression()
+        if match is None:
+            return queryset.none()
+        matching = RawSQL('SELECT rowid FROM %s WHERE %s MATCH %%s' % (TABLE, TABLE), [match])
+        return queryset.filter(pk__in=matching).annotate(search_score=self.score(queryset.model, match))
+
+    def score(self, model, match):
+        """ An expression for the bm25 score of the model's rows against a MATCH expression """
+        quote_name = connections[self.index.using].ops.quote_name
+        page_id = '%s.%s' % (quote_name(model._meta.db_table), quote_name(model._meta.pk.column))
+        return RawSQL(
+            'SELECT bm25(%s, %s) FROM %s WHERE %s MATCH %%s AND rowid = %s'
+            % (TABLE, ', '.join(map(str, WEIGHTS)), TABLE, TABLE, page_id),
+            [match],
+            output_field=FloatField(),
+        )
+
+    def snippets(self, query, page_ids):
+        """ Highlighted body excerpts for the given pages' matches of query """
+        match = self.query_compiler_class(Page.objects.none(), query).match_expression()
+        return self.index.snippets(match, page_ids) if match else {}
+
+    def _search(self, query_compiler_class, query, model_or_queryset, **kwargs):
+        model = getattr(model_or_queryset, 'model', model_or_queryset)
+        if not issubclass(model, Page):
+            return EmptySearchResults()
+        return super()._search(query_compiler_class, query, model_or_queryset, **kwargs)
+
+
+SearchBackend = FTS5SearchBackend
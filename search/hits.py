@@ -0,0 +1,184 @@
+""" Buffered search hit recording.
+
+Query.get() and add_hit() write twice per search, and on SQLite every write
+waits for the database lock. Instead each hit takes the next numbered slot
+in the cache, and a flush turns all the slots recorded since the last one
+into a handful of bulk statements against wagtailsearch's tables. Flushes
+run in a background thread once SEARCH_HITS_FLUSH_SIZE hits are waiting or
+SEARCH_HITS_FLUSH_INTERVAL seconds have passed, and the flush_search_hits
+command flushes whatever is left, e.g. on shutdown. The buffer lives in the
+default cache, so it needs a backend every process shares, whose incr() and
+add() are atomic, like production's memcached (see core.checks).
+
+At most SEARCH_HITS_BUFFER_SIZE hits wait in the cache, hits beyond that
+are dropped rather than letting the buffer grow while flushes are failing.
+A slot is taken before its hit is written, so a flush stops at the first
+slot it finds empty and picks it up next time, only giving up on it (e.g.
+when the cache evicted it) once it's been empty for SEARCH_HITS_SLOT_GRACE
+seconds.
+"""
+import logging
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils import timezone
+
+from wagtail.search.models import Query, QueryDailyHits
+from wagtail.search.utils import normalise_query_string
+
+logger = logging.getLogger(__name__)
+
+NEXT_SLOT_KEY = 'search_hits:next'
+FLUSHED_SLOT_KEY = 'search_hits:flushed'
+FLUSHED_AT_KEY = 'search_hits:flushed_at'
+GAP_KEY = 'search_hits:gap'
+LOCK_KEY = 'search_hits:lock'
+
+# Stored in the slots of dropped hits, so flushes don't wait for them
+DROPPED = 'dropped'
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def slot_key(slot):
+    return 'search_hits:slot:%d' % slot
+
+
+def _next_slot():
+    try:
+        return cache.incr(NEXT_SLOT_KEY)
+    except ValueError:
+        cache.add(NEXT_SLOT_KEY, 0, None)
+        return cache.incr(NEXT_SLOT_KEY)
+
+
+def record_hit(query_string):
+    """ Buffer a hit for query_string, kicking off a flush when one is due """
+    query_string = normalise_query_string(query_string)
+    if not query_string:
+        return
+
+    flushed = cache.get(FLUSHED_SLOT_KEY, 0)
+    slot = _next_slot()
+    pending = slot - flushed
+    timeout = _setting('SEARCH_HITS_SLOT_TIMEOUT', 60 * 60 * 24 * 7)
+    if pending > _setting('SEARCH_HITS_BUFFER_SIZE', 10000):
+        logger.warning("Search hit buffer is full, dropping a hit for %r", query_string)
+        cache.set(slot_key(slot), DROPPED, timeout)
+    else:
+        cache.set(slot_key(slot), (query_string, timezone.now().date()), timeout)
+
+    flushed_at = cache.get(FLUSHED_AT_KEY)
+    if flushed_at is None:
+        cache.add(FLUSHED_AT_KEY, time.time(), None)
+    elif (pending >= _setting('SEARCH_HITS_FLUSH_SIZE', 100)
+            or time.time() - flushed_at >= _setting('SEARCH_HITS_FLUSH_INTERVAL', 60)):
+        flush_in_background()
+
+
+def buffered_slots(first, last, chunk_size):
+    """ (slot, what's in it) for the slots first to last, None for the empty ones """
+    for start in range(first, last + 1, chunk_size):
+        slots = range(start, min(start + chunk_size, last + 1))
+        found = cache.get_many([slot_key(slot) for slot in slots])
+        for slot in slots:
+            yield slot, found.get(slot_key(slot))
+
+
+def given_up(slot):
+    """ Whether an empty slot has been empty for long enough that its hit was lost """
+    gap = cache.get(GAP_KEY)
+    if gap is None or gap[0] != slot:
+        cache.set(GAP_KEY, (slot, time.time()), None)
+        return False
+    return time.time() - gap[1] >= _setting('SEARCH_HITS_SLOT_GRACE', 60)
+
+
+def flush_hits(chunk_size=500):
+    """ Write the buffered hits to the database, returning how many were written """
+    # Only one flush at a time, or the same slots would be counted twice
+    if not cache.add(LOCK_KEY, True, 300):
+        return 0
+    try:
+        first = cache.get(FLUSHED_SLOT_KEY, 0) + 1
+        flushed = first - 1
+
+        hits = Counter()
+        for slot, hit in buffered_slots(first, cache.get(NEXT_SLOT_KEY, 0), chunk_size):
+            # Its hit is usually still on its way, written right after the slot was taken
+            if hit is None and not given_up(slot):
+                break
+            if hit is not None and hit != DROPPED:
+                hits[hit] += 1
+            flushed = slot
+
+        save_hits(hits)
+        for start in range(first, flushed + 1, chunk_size):
+            cache.delete_many([slot_key(slot) for slot in range(start, min(start + chunk_size, flushed + 1))])
+        cache.set(FLUSHED_SLOT_KEY, flushed, None)
+        cache.set(FLUSHED_AT_KEY, time.time(), None)
+        return sum(hits.values())
+    finally:
+        cache.delete(LOCK_KEY)
+
+
+def save_hits(hits):
+    """ Add {(query string, date): count} to the query tables in a few bulk statements """
+    if not hits:
+        return
+    query_strings = {query_string for query_string, date in hits}
+    dates = {date for query_string, date in hits}
+
+    with transaction.atomic():
+        Query.objects.bulk_create(
+            [Query(query_string=query_string) for query_string in query_strings],
+            ignore_conflicts=True,
+        )
+        query_ids = dict(
+            Query.objects.filter(query_string__in=query_strings).values_list('query_string', 'pk')
+        )
+
+        daily_hits = {
+            (row.query_id, row.date): row
+            for row in QueryDailyHits.objects.select_for_update().filter(
+                query_id__in=query_ids.values(), date__in=dates,
+            )
+        }
+        new_rows = []
+        for (query_string, date), count in hits.items():
+            row = daily_hits.get((query_ids[query_string], date))
+            if row is None:
+                new_rows.append(QueryDailyHits(query_id=query_ids[query_string], date=date, hits=count))
+            else:
+                row.hits += count
+
+        QueryDailyHits.objects.bulk_update(daily_hits.values(), ['hits'])
+        QueryDailyHits.objects.bulk_create(new_rows)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _flush():
+    try:
+        flush_hits()
+    except Exception:
+        logger.exception("Couldn't flush search hits")
+    finally:
+        connection.close()
+
+
+def flush_in_background():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='search-hits')
+    _executor.submit(_flush)
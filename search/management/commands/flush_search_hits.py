@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from core.cache import cache_is_shared
+from search.hits import flush_hits
+
+
+class Command(BaseCommand):
+    help = "Write the search hits buffered in the cache to the database"
+
+    def handle(self, *args, **options):
+        if not cache_is_shared():
+            self.stderr.write(self.style.WARNING(
+                "The default cache is private to this process, so it has no hits buffered by the site"
+            ))
+        count = flush_hits()
+        self.stdout.write("Flushed %d search hits" % count)
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+
+from wagtail.core.models import Page
+from wagtail.search.backends import get_search_backend
+
+from core.pages import specific_in_bulk
+
+
+class Command(BaseCommand):
+    help = "Rebuild the FTS5 page search index, loading live pages a batch at a time"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backend', default='pages', help="Name of the FTS5 search backend")
+        parser.add_argument('--batch-size', type=int, default=200)
+
+    def batches(self, batch_size):
+        """ Specific live pages, batch_size at a time, with one query per page type per batch """
+        last_pk = 0
+        while True:
+            rows = list(
+                Page.objects.live().filter(pk__gt=last_pk).order_by('pk')
+                .values_list('pk', 'content_type_id')[:batch_size]
+            )
+            if not rows:
+                return
+            yield list(specific_in_bulk(rows).values())
+            last_pk = rows[-1][0]
+
+    def handle(self, *args, **options):
+        index = get_search_backend(options['backend']).index
+
+        indexed = set()
+        for pages in self.batches(options['batch_size']):
+            index.add_items(Page, pages)
+            indexed.update(page.pk for page in pages)
+            self.stdout.write("Indexed %d pages" % len(indexed))
+
+        # The index stays searchable while it's rebuilt, so stale rows go last
+        stale = index.page_ids() - indexed
+        index.delete_ids(stale)
+        self.stdout.write(self.style.SUCCESS(
+            "Indexed %d pages, removed %d stale entries" % (len(indexed), len(stale))
+        ))
@@ -0,0 +1,48 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.db.models import Sum
+from django.utils import timezone
+
+from wagtail.search.models import Query
+
+from core.cache import cache_is_shared
+from search.results import warm_result_pages
+
+
+class Command(BaseCommand):
+    help = "Cache the results of the most popular searches, e.g. after a deploy or a big publish"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--top', type=int, default=50, help="How many of the most popular queries to warm",
+        )
+        parser.add_argument(
+            '--pages', type=int, default=1, help="How many pages of results to warm for each query",
+        )
+        parser.add_argument(
+            '--days', type=int, default=None,
+            help="Only count hits from the last few days, all of them by default",
+        )
+
+    def handle(self, *args, **options):
+        if not cache_is_shared():
+            self.stderr.write(self.style.WARNING(
+                "The default cache is private to this process, so the site won't see what's warmed"
+            ))
+        # Query.get_most_popular() ignores its date_since. The conditions go in
+        # one filter() so the sum only joins the daily hits once
+        filters = {'daily_hits__isnull': False}
+        if options['days'] is not None:
+            since = timezone.now().date() - datetime.timedelta(days=options['days'])
+            filters['daily_hits__date__gte'] = since
+        queries = (
+            Query.objects.filter(**filters)
+            .annotate(_hits=Sum('daily_hits__hits'))
+            .order_by('-_hits')[:options['top']]
+        )
+
+        warmed = 0
+        for query in queries:
+            warmed += warm_result_pages(query.query_string, options['pages'])
+        self.stdout.write("Warmed %d pages of results for %d queries" % (warmed, len(queries)))
@@ -0,0 +1,26 @@
+from django.db import migrations
+
+
+def create_fts_table(apps, schema_editor):
+    # FTS5 is SQLite's, other databases need another search backend
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE search_page_fts USING fts5("
+            "title, subtitle, body, tokenize = 'porter unicode61')"
+        )
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE search_page_fts")
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = []
+
+    operations = [
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
@@ -0,0 +1,178 @@
+""" Running, caching and loading page search results.
+
+A page of results is cached as the ids and content types of its pages plus
+its pagination links, keyed on the normalised query and the requested page.
+The key includes the 'search_results' generation, which search.signals
+bumps whenever a page is published, unpublished, moved or deleted.
+"""
+import hashlib
+import re
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from wagtail.core.models import Page
+from wagtail.search.backends import get_search_backend
+from wagtail.search.utils import normalise_query_string
+
+from blog.models import BlogDetailPage
+from core.cache import get_generation
+from core.images import prefetch_renditions
+from core.pages import specific_in_bulk
+from core.pagination import KeysetPaginator
+from .backends import TOKEN_RE
+
+SEARCH_BACKEND = 'pages'
+
+RESULTS_PER_PAGE = 10
+
+RESULTS_NAMESPACE = 'search_results'
+
+RESULTS_TIMEOUT = 60 * 60 * 24
+
+
+class SearchKeysetPaginator(KeysetPaginator):
+    """ Seeks on (relevance, page id), so cursor pages list matches best first like numbered ones """
+
+    def __init__(self, queryset, per_page, search_query):
+        backend = get_search_backend(SEARCH_BACKEND)
+        super().__init__(backend.scored(queryset, search_query), per_page, ['search_score', 'id'])
+
+
+class ResultPage:
+    """ A page of results as (page id, content type id) pairs, with the links around it """
+
+    def __init__(self, pages, has_next=False, has_previous=False, next_page_number=None,
+                 previous_page_number=None, next_cursor=None, previous_cursor=None):
+        self.pages = pages
+        self.has_next = has_next
+        self.has_previous = has_previous
+        self.next_page_number = next_page_number
+        self.previous_page_number = previous_page_number
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __len__(self):
+        return len(self.pages)
+
+
+def run_search(search_query, page=None, cursor=None):
+    """ Search for one page of results, by page number or by cursor when one is given """
+    if cursor is not None:
+        paginator = SearchKeysetPaginator(Page.objects.live(), RESULTS_PER_PAGE, search_query)
+        results = paginator.page(cursor)
+        return ResultPage(
+            [(page.pk, page.content_type_id) for page in results],
+            has_next=results.has_next(),
+            has_previous=results.has_previous(),
+            next_cursor=results.next_cursor,
+            previous_cursor=results.previous_cursor,
+        )
+
+    paginator = Paginator(
+        Page.objects.live().search(search_query, backend=SEARCH_BACKEND), RESULTS_PER_PAGE,
+    )
+    try:
+        results = paginator.page(page)
+    except PageNotAnInteger:
+        results = paginator.page(1)
+    except EmptyPage:
+        results = paginator.page(paginator.num_pages)
+    return ResultPage(
+        [(page.pk, page.content_type_id) for page in results],
+        has_next=results.has_next(),
+        has_previous=results.has_previous(),
+        next_page_number=results.next_page_number() if results.has_next() else None,
+        previous_page_number=results.previous_page_number() if results.has_previous() else None,
+    )
+
+
+def page_number(page):
+    """ A page parameter as a page number, 1 when it isn't a positive number """
+    try:
+        return max(int(page), 1)
+    except (TypeError, ValueError):
+        return 1
+
+
+def result_cache_key(search_query, page=None, cursor=None):
+    # '02', ' 2' and '2' are the same page, anything but a positive number the first
+    position = 'cursor:%s' % cursor if cursor is not None else 'page:%d' % page_number(page)
+    key = '%s|%s' % (search_query, position)
+    return 'search_results:%s:%s' % (
+        get_generation(RESULTS_NAMESPACE), hashlib.md5(key.encode()).hexdigest(),
+    )
+
+
+def get_result_page(search_query, page=None, cursor=None):
+    """ run_search() for the normalised query, from the cache when it's been run since the last publish """
+    search_query = normalise_query_string(search_query)
+    # The same number the key was built from, so a page is cached under its own key
+    page = page_number(page)
+    key = result_cache_key(search_query, page, cursor)
+    result_page = cache.get(key)
+    if result_page is None:
+        result_page = run_search(search_query, page, cursor)
+        cache.set(key, result_page, RESULTS_TIMEOUT)
+    return result_page
+
+
+def warm_result_pages(search_query, pages=1):
+    """ Cache the first few pages of results for a query, in the view's pagination mode.
+
+    Returns how many pages weren't cached yet.
+    """
+    search_query = normalise_query_string(search_query)
+    cursor_mode = getattr(settings, 'PAGINATION_MODE', 'page') == 'cursor'
+    page, cursor, warmed = 1, '' if cursor_mode else None, 0
+    for _ in range(pages):
+        key = result_cache_key(search_query, page, cursor)
+        result_page = cache.get(key)
+        if result_page is None:
+            result_page = run_search(search_query, page, cursor)
+            cache.set(key, result_page, RESULTS_TIMEOUT)
+            warmed += 1
+        if not result_page.has_next:
+            break
+        page, cursor = page + 1, result_page.next_cursor if cursor_mode else None
+    return warmed
+
+
+def highlight(text, search_query):
+    """ Escape text, wrapping words that start with one of the query's terms in <mark>s """
+    terms = TOKEN_RE.findall(search_query)
+    if not terms:
+        return escape(text)
+    pattern = re.compile(r'\b(%s\w*)' % '|'.join(map(re.escape, terms)), re.IGNORECASE)
+    parts = pattern.split(text)
+    # split() alternates between the text around matches and the matches themselves
+    return mark_safe(''.join(
+        '<mark>%s</mark>' % escape(part) if i % 2 else escape(part)
+        for i, part in enumerate(parts)
+    ))
+
+
+def load_results(pks_and_types, search_query):
+    """ The specific pages behind a page of results, with what the template shows.
+
+    One query per page type, one for blog banners and one for the snippets.
+    """
+    specific = specific_in_bulk(pks_and_types, select_related=['banner_image'])
+    results = [specific[pk] for pk, _ in pks_and_types if pk in specific]
+
+    posts = [result for result in results if isinstance(result, BlogDetailPage)]
+    renditions = prefetch_renditions(
+        [post.banner_image for post in posts], BlogDetailPage.listing_rendition,
+    )
+    snippets = get_search_backend(SEARCH_BACKEND).snippets(search_query, specific.keys())
+
+    for result in results:
+        title = getattr(result, 'custom_title', None) or result.title
+        result.search_title = highlight(title, search_query)
+        result.search_snippet = snippets.get(result.pk)
+        if isinstance(result, BlogDetailPage):
+            result.banner_rendition = renditions.get(result.banner_image_id)
+    return results
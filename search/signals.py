@@ -0,0 +1,83 @@
+""" Keeps the FTS5 page index, cached search results and autocomplete suggestions up to date """
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from wagtail.core.models import Page
+from wagtail.core.signals import page_published, page_unpublished, post_page_move
+from wagtail.search.backends import get_search_backends
+
+from blog.models import BlogCategory
+from core.cache import bump_generation
+from . import autocomplete
+from .backends import FTS5SearchBackend
+from .results import RESULTS_NAMESPACE
+
+
+def page_indexes():
+    for backend in get_search_backends():
+        if isinstance(backend, FTS5SearchBackend):
+            yield backend.index
+
+
+@receiver(page_published)
+def page_published_indexed(sender, instance, **kwargs):
+    for index in page_indexes():
+        index.add_item(instance)
+    # Only once the index has changed, or a search in between would cache the old results again
+    bump_generation(RESULTS_NAMESPACE)
+
+
+@receiver(page_unpublished)
+def page_unpublished_indexed(sender, instance, **kwargs):
+    for index in page_indexes():
+        index.delete_item(instance)
+    bump_generation(RESULTS_NAMESPACE)
+
+
+@receiver(post_page_move)
+def page_moved_results(sender, instance, **kwargs):
+    # Like a publish, a move changes what the result pages show
+    bump_generation(RESULTS_NAMESPACE)
+
+
+@receiver(post_delete)
+def page_deleted_indexed(sender, instance, **kwargs):
+    if isinstance(instance, Page):
+        for index in page_indexes():
+            index.delete_item(instance)
+        bump_generation(RESULTS_NAMESPACE)
+
+
+@receiver(page_published)
+def page_published_autocomplete(sender, instance, **kwargs):
+    autocomplete.page_published(instance)
+
+
+@receiver(page_unpublished)
+def page_unpublished_autocomplete(sender, instance, **kwargs):
+    autocomplete.record_change(('page', instance.pk))
+
+
+@receiver(post_page_move)
+def page_moved_autocomplete(sender, instance, **kwargs):
+    # Every page below it has a new url too
+    autocomplete.record_change(autocomplete.REBUILD)
+
+
+@receiver(post_delete)
+def page_deleted_autocomplete(sender, instance, **kwargs):
+    if isinstance(instance, Page):
+        autocomplete.record_change(('page', instance.pk))
+
+
+@receiver(post_save, sender=BlogCategory)
+def category_saved_autocomplete(sender, instance, raw=False, **kwargs):
+    if not raw:
+        autocomplete.record_change(
+            ('category', instance.pk), autocomplete.listing_suggestion('category', instance),
+        )
+
+
+@receiver(post_delete, sender=BlogCategory)
+def category_deleted_autocomplete(sender, instance, **kwargs):
+    autocomplete.record_change(('category', instance.pk))
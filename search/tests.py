@@ -0,0 +1,283 @@
+import json
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from wagtail.core.models import Page, Site
+from wagtail.search.models import Query
+
+from blog.models import BlogCategory
+from core.cache import bump_generation
+from flex.models import FlexPage
+
+from .backends import PageIndex
+from . import autocomplete
+from .hits import _next_slot, flush_hits, record_hit, slot_key
+from .results import SearchKeysetPaginator, get_result_page, result_cache_key
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage',
+)
+class PageSearchTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.root = Site.objects.get(is_default_site=True).root_page
+        self.index = PageIndex()
+        self.index.reset()
+
+    def publish(self, title, **kwargs):
+        page = self.root.add_child(instance=FlexPage(title=title, live=False, **kwargs))
+        page.save_revision().publish()
+        return page
+
+    def search(self, query):
+        return [page.title for page in Page.objects.live().search(query, backend='pages')]
+
+    def test_title_matches_rank_above_body_matches(self):
+        self.publish('Walrus facts', slug='walrus')
+        self.publish('Sea life', slug='sea-life', content=json.dumps([
+            {'type': 'cta', 'value': {'title': 'Meet the walrus', 'text': '<p>and friends</p>', 'button_text': 'Go'}},
+        ]))
+        self.publish('Unrelated', slug='unrelated', subtitle='Nothing here')
+
+        self.assertEqual(self.search('walrus'), ['Walrus facts', 'Sea life'])
+        self.assertEqual(self.search('friend'), ['Sea life'])
+        self.assertEqual(self.search('wal'), ['Walrus facts', 'Sea life'])
+
+        results = Page.objects.live().search('walrus', backend='pages').annotate_score('score')
+        [second] = results[1:2]
+        self.assertEqual(second.title, 'Sea life')
+        self.assertGreater(results[0].score, second.score)
+
+    def test_cursor_pages_follow_relevance(self):
+        self.publish('Sea life', slug='sea-life', subtitle='The walrus')
+        for i in range(3):
+            self.publish('Walrus', slug='walrus-%d' % i)
+        self.publish('Walrus walrus', slug='walrus-twice')
+        expected = self.search('walrus')
+
+        paginator = SearchKeysetPaginator(Page.objects.live(), 2, 'walrus')
+        pages = [paginator.page()]
+        while pages[-1].has_next():
+            pages.append(paginator.page(pages[-1].next_cursor))
+        self.assertEqual([page.title for results in pages for page in results], expected)
+        self.assertEqual(paginator.count, 5)
+
+        previous = paginator.page(pages[-1].previous_cursor)
+        self.assertEqual([page.title for page in previous], [page.title for page in pages[-2]])
+
+    def test_unpublished_pages_leave_the_index(self):
+        page = self.publish('Walrus facts', slug='walrus')
+        page.refresh_from_db()
+        page.unpublish()
+        self.assertEqual(self.search('walrus'), [])
+
+    def test_rebuild(self):
+        self.publish('Walrus facts', slug='walrus')
+        self.index.reset()
+        with self.index.cursor() as cursor:
+            cursor.execute("INSERT INTO search_page_fts (rowid, title, subtitle, body) VALUES (999, 'Walrus', '', '')")
+
+        call_command('rebuild_search_index', '--batch-size', '1', stdout=StringIO())
+        self.assertEqual(self.search('walrus'), ['Walrus facts'])
+        self.assertNotIn(999, self.index.page_ids())
+
+    def test_results_are_specific_and_highlighted(self):
+        self.publish('Walrus facts', slug='walrus', subtitle='All about them', content=json.dumps([
+            {'type': 'full_richtext', 'value': '<p>The walrus &amp; the <b>carpenter</b></p>'},
+        ]))
+        response = self.client.get('/search/', {'query': 'walrus'})
+        result = response.context['results'][0]
+
+        self.assertIsInstance(result, FlexPage)
+        self.assertEqual(result.search_title, '<mark>Walrus</mark> facts')
+        self.assertEqual(result.search_snippet, 'The <mark>walrus</mark> &amp; the carpenter')
+        self.assertContains(response, 'All about them')
+
+    def test_result_queries_do_not_grow_with_the_results(self):
+        self.publish('Walrus 0', slug='walrus-0')
+        self.client.get('/search/', {'query': 'walrus'})
+        bump_generation('search_results')
+        with CaptureQueriesContext(connection) as one_result:
+            self.client.get('/search/', {'query': 'walrus'})
+
+        for i in range(1, 5):
+            self.publish('Walrus %d' % i, slug='walrus-%d' % i)
+        with CaptureQueriesContext(connection) as many_results:
+            response = self.client.get('/search/', {'query': 'walrus'})
+
+        self.assertEqual(len(response.context['results']), 5)
+        self.assertEqual(len(many_results), len(one_result))
+
+    def test_result_pages_are_cached_until_a_publish(self):
+        self.publish('Walrus facts', slug='walrus')
+        self.client.get('/search/', {'query': 'walrus'})
+        with CaptureQueriesContext(connection) as searched:
+            bump_generation('search_results')
+            self.client.get('/search/', {'query': 'walrus'})
+        with CaptureQueriesContext(connection) as cached:
+            response = self.client.get('/search/', {'query': '  WALRUS '})
+        self.assertEqual([result.title for result in response.context['results']], ['Walrus facts'])
+        self.assertLess(len(cached), len(searched))
+
+        self.publish('Walrus tusks', slug='tusks')
+        response = self.client.get('/search/', {'query': 'walrus'})
+        self.assertEqual(len(response.context['results']), 2)
+
+        self.assertEqual(result_cache_key('walrus', '02'), result_cache_key('walrus', 2))
+        self.assertEqual(result_cache_key('walrus', 'x'), result_cache_key('walrus'))
+
+        sea_life = self.publish('Sea life', slug='sea-life')
+        key = result_cache_key('walrus')
+        Page.objects.get(slug='tusks').move(sea_life, pos='last-child')
+        self.assertNotEqual(result_cache_key('walrus'), key)
+
+    def test_warm_popular_queries(self):
+        self.publish('Walrus facts', slug='walrus')
+        self.publish('Seal facts', slug='seal')
+        for i in range(3):
+            Query.get('walrus').add_hit()
+        Query.get('seal').add_hit()
+
+        out = StringIO()
+        call_command('warm_search_cache', '--top', '1', stdout=out, stderr=StringIO())
+        self.assertIn("Warmed 1 pages of results for 1 queries", out.getvalue())
+        self.assertIsNotNone(cache.get(result_cache_key('walrus', 1)))
+        self.assertIsNone(cache.get(result_cache_key('seal', 1)))
+
+        with self.assertNumQueries(0):
+            result_page = get_result_page('walrus')
+        self.assertEqual(len(result_page), 1)
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    SEARCH_HITS_FLUSH_SIZE=1000,
+    SEARCH_HITS_BUFFER_SIZE=5,
+)
+class SearchHitsTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_hits_are_buffered_until_flushed(self):
+        with self.assertNumQueries(0):
+            record_hit('Walrus')
+            record_hit('walrus ')
+            record_hit('seal')
+        self.assertFalse(Query.objects.exists())
+
+        Query.get('walrus').add_hit()
+        call_command('flush_search_hits', stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(Query.get('walrus').hits, 3)
+        self.assertEqual(Query.get('seal').hits, 1)
+
+        self.assertEqual(flush_hits(), 0)
+        self.assertEqual(Query.get('walrus').hits, 3)
+
+    def test_buffer_is_bounded(self):
+        for i in range(8):
+            record_hit('walrus')
+        self.assertEqual(flush_hits(), 5)
+
+    def test_flushes_wait_for_hits_being_recorded(self):
+        record_hit('walrus')
+        # A slot taken by a hit that hasn't been written yet
+        pending = _next_slot()
+        record_hit('walrus')
+        self.assertEqual(flush_hits(), 1)
+
+        cache.set(slot_key(pending), ('seal', timezone.now().date()))
+        self.assertEqual(flush_hits(), 2)
+        self.assertEqual(Query.get('walrus').hits, 2)
+        self.assertEqual(Query.get('seal').hits, 1)
+
+    @override_settings(SEARCH_HITS_SLOT_GRACE=0)
+    def test_flushes_give_up_on_lost_hits(self):
+        _next_slot()
+        record_hit('walrus')
+        self.assertEqual(flush_hits(), 0)
+        self.assertEqual(flush_hits(), 1)
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+)
+class AutocompleteTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        autocomplete._local.update(applied=None, index=None)
+        self.root = Site.objects.get(is_default_site=True).root_page
+
+    def publish(self, title, **kwargs):
+        page = self.root.add_child(instance=FlexPage(title=title, live=False, **kwargs))
+        page.save_revision().publish()
+        return page
+
+    def titles(self, prefix):
+        return [suggestion['title'] for suggestion in autocomplete.suggest(prefix)]
+
+    def test_prefix_index(self):
+        index = autocomplete.PrefixIndex()
+        index.add(('page', 1), {'title': 'Walrus facts', 'url': '/walrus/', 'type': 'page'})
+        index.add(('page', 2), {'title': 'Fact-checking walruses', 'url': '/facts/', 'type': 'page'})
+        index.add(('page', 3), {'title': 'Seals', 'url': '/seals/', 'type': 'page'})
+
+        self.assertEqual([s['url'] for s in index.lookup('fac')], ['/facts/', '/walrus/'])
+        self.assertEqual([s['url'] for s in index.lookup('  WALRUS f')], ['/walrus/'])
+        index.remove(('page', 1))
+        self.assertEqual([s['url'] for s in index.lookup('walrus')], ['/facts/'])
+        self.assertEqual(len(index.keys), 4)
+
+    def test_suggestions_follow_publishing_without_queries(self):
+        walrus = self.publish('Walrus facts', slug='walrus')
+        self.assertEqual(self.titles('walr'), ['Walrus facts'])
+
+        self.publish('Walrus tusks', slug='tusks')
+        BlogCategory.objects.create(name='Walrus care', slug='walrus-care')
+        walrus.refresh_from_db()
+        walrus.unpublish()
+        with self.assertNumQueries(0):
+            response = self.client.get('/search/autocomplete/', {'q': 'walr'})
+        self.assertEqual(
+            [result['title'] for result in response.json()['results']], ['Walrus tusks'],
+        )
+
+    def test_changes_are_shared_between_processes(self):
+        self.publish('Walrus facts', slug='walrus')
+        self.assertEqual(self.titles('walr'), ['Walrus facts'])
+
+        # Another process publishes, this one catches up from the cache
+        autocomplete.record_change(
+            ('page', 999), {'title': 'Walrus tusks', 'url': '/tusks/', 'type': 'page'},
+        )
+        with self.assertNumQueries(0):
+            self.assertEqual(self.titles('walr'), ['Walrus facts', 'Walrus tusks'])
+
+        # Changes that were evicted before this process saw them mean a rebuild
+        autocomplete.record_change(('page', 998), {'title': 'Walrus', 'url': '/', 'type': 'page'})
+        cache.delete(autocomplete.change_key(cache.get(autocomplete.NEXT_CHANGE_KEY)))
+        self.assertEqual(self.titles('walr'), ['Walrus facts'])
+
+    def test_changes_sharing_a_number_are_both_kept(self):
+        self.publish('Walrus facts', slug='walrus')
+        self.titles('walr')
+
+        # Another process's incr() raced this one's and wrote the same number
+        taken = cache.get(autocomplete.NEXT_CHANGE_KEY) + 1
+        tusks = {'title': 'Walrus tusks', 'url': '/tusks/', 'type': 'page'}
+        cache.set(autocomplete.change_key(taken), (('page', 999), tusks))
+        cache.set(autocomplete.NEXT_CHANGE_KEY, taken - 1)
+        autocomplete.record_change(('page', 998), {'title': 'Walrus', 'url': '/', 'type': 'page'})
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.titles('walr'), ['Walrus', 'Walrus facts', 'Walrus tusks'])
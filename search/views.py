@@ -1,34 +1,39 @@
-from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
+from django.conf import settings
+from django.http import JsonResponse
 from django.template.response import TemplateResponse
+from django.views.decorators.cache import cache_control
 
-from wagtail.core.models import Page
-from wagtail.search.models import Query
+from .autocomplete import suggest
+from .hits import record_hit
+from .results import get_result_page, load_results
 
 
 def search(request):
     search_query = request.GET.get('query', None)
     page = request.GET.get('page', 1)
+    cursor = request.GET.get('cursor')
 
-    # Search
+    # Record hit, it's written to the database later along with others
     if search_query:
-        search_results = Page.objects.live().search(search_query)
-        query = Query.get(search_query)
-
-        # Record hit
-        query.add_hit()
-    else:
-        search_results = Page.objects.none()
+        record_hit(search_query)
 
     # Pagination
-    paginator = Paginator(search_results, 10)
-    try:
-        search_results = paginator.page(page)
-    except PageNotAnInteger:
-        search_results = paginator.page(1)
-    except EmptyPage:
-        search_results = paginator.page(paginator.num_pages)
+    if not cursor:
+        cursor = '' if getattr(settings, 'PAGINATION_MODE', 'page') == 'cursor' else None
+
+    if search_query:
+        search_results = get_result_page(search_query, page=page, cursor=cursor)
+    else:
+        search_results = []
 
     return TemplateResponse(request, 'search/search.html', {
         'search_query': search_query,
         'search_results': search_results,
+        'results': load_results(search_results.pages, search_query) if search_query else [],
     })
+
+
+@cache_control(max_age=60, public=True)
+def autocomplete(request):
+    """ Suggestions for the navbar search box, from the in-memory prefix index """
+    return JsonResponse({'results': suggest(request.GET.get('q', ''))})
@@ -3,6 +3,8 @@ from django.db import models
 from wagtail.admin.edit_handlers import FieldPanel, MultiFieldPanel
 from wagtail.contrib.settings.models import BaseSetting, register_setting
 
+from core.cache import EVERY_PAGE, Fragment, invalidation
+
 @register_setting
 class SocialMediaSettings(BaseSetting):
     """ Social media settings for our custom website """
@@ -17,4 +19,11 @@ class SocialMediaSettings(BaseSetting):
             FieldPanel('instagram'),
             FieldPanel('github'),
         ], heading='Social Meida Settings'),
-    ]
\ No newline at end of file
+    ]
+
+
+@invalidation.register(SocialMediaSettings)
+def social_media_settings_changed(settings):
+    """ The social links are cached in the footer fragment on every page """
+    yield Fragment('footer')
+    yield EVERY_PAGE
@@ -3,6 +3,24 @@
 from wagtail.core import blocks
 from wagtail.images.blocks import ImageChooserBlock
 
+from core.page_urls import get_page_url
+from core.rich_text import CachedRichTextBlock
+
+
+class LinkStructValue(blocks.StructValue):
+    """ Additional logic for our urls """
+
+    def url(self):
+        button_page = self.get('button_page')
+        button_url = self.get('button_url')
+        if button_page:
+            return get_page_url(button_page)
+        if button_url:
+            return button_url
+
+        return None
+
+
 class TitleAndTextBlock(blocks.StructBlock):
     """ Title and text and nothing else """
 
@@ -28,7 +46,8 @@ class CardBlock(blocks.StructBlock):
                 ('text', blocks.TextBlock(required=True, max_length=200)),
                 ('button_page', blocks.PageChooserBlock(required=False)),
                 ('button_url', blocks.URLBlock(required=False, help_text='If the button page above is selected, that will be used first.')),
-            ]
+            ],
+            value_class=LinkStructValue,
         )
     )
 
@@ -38,7 +57,7 @@ class CardBlock(blocks.StructBlock):
         label = 'Staff Cards'
 
 
-class RichTextBlock(blocks.RichTextBlock):
+class RichTextBlock(CachedRichTextBlock):
     """ Richtext with all the features """
 
     class Meta:
@@ -50,7 +69,7 @@ class RichTextBlock(blocks.RichTextBlock):
 class CTABlock(blocks.StructBlock):
 
     title = blocks.CharBlock(required=True, max_length=50)
-    text = blocks.RichTextBlock(required=True, features=['bold', 'italic'])
+    text = CachedRichTextBlock(required=True, features=['bold', 'italic'])
     button_page = blocks.PageChooserBlock(required=False)
     button_url = blocks.URLBlock(required=False)
     button_text = blocks.CharBlock(requred=True, default='Learn More', max_length=40)
@@ -59,20 +78,7 @@ class CTABlock(blocks.StructBlock):
         template = 'streams/cta_block.html'
         icon = 'placeholder'
         label = 'Call to Action'
-
-    
-class LinkStructValue(blocks.StructValue):
-    """ Additional logic for our urls """
-
-    def url(self):
-        button_page = self.get('button_page')
-        button_url = self.get('button_url')
-        if button_page:
-            return button_page.url
-        if button_url:
-            return button_url
-
-        return None
+        value_class = LinkStructValue
 
 
 
@@ -1,10 +1,15 @@
 from wagtail.api.v2.router import WagtailAPIRouter
-from wagtail.api.v2.views import PagesAPIViewSet
-from wagtail.images.api.v2.views import ImagesAPIViewSet
-from wagtail.documents.api.v2.views import DocumentsAPIViewSet
+
+from blog.models import BlogDetailPage
+from core.api import (
+    CachedDocumentsAPIViewSet, CachedImagesAPIViewSet, CachedPagesAPIViewSet, PageExportView,
+)
+from flex.models import FlexPage
 
 api_router = WagtailAPIRouter('wagtailapi')
 
-api_router.register_endpoint('pages', PagesAPIViewSet)
-api_router.register_endpoint('images', ImagesAPIViewSet)
-api_router.register_endpoint('documents', DocumentsAPIViewSet)
\ No newline at end of file
+api_router.register_endpoint('pages', CachedPagesAPIViewSet)
+api_router.register_endpoint('images', CachedImagesAPIViewSet)
+api_router.register_endpoint('documents', CachedDocumentsAPIViewSet)
+
+api_export = PageExportView.as_view(router=api_router, models=[BlogDetailPage, FlexPage])
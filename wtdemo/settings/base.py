@@ -80,6 +80,8 @@ MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
 
     'wagtail.contrib.redirects.middleware.RedirectMiddleware',
+
+    'core.page_urls.PageUrlsMiddleware',
 ]
 
 ROOT_URLCONF = 'wtdemo.urls'
@@ -182,6 +184,57 @@ WAGTAIL_SITE_NAME = "wtdemo"
 # e.g. in notification emails. Don't include '/admin' or a trailing slash
 BASE_URL = 'http://example.com'
 
+# How listings and search results are paginated: 'page' for numbered pages,
+# 'cursor' for keyset pagination that stays fast on deep pages
+PAGINATION_MODE = 'page'
+
+# Fail the system checks unless the default cache has an atomic incr() and
+# add(), which the search hit buffer and the cache generations rely on once
+# several processes share the cache, see core.checks.
+CACHE_REQUIRE_ATOMIC = False
+
+# Whole-response cache for anonymous visitors to pages using CachedPageMixin.
+# Only requests whose query parameters are all in the allow-list are cached.
+PAGE_CACHE_ENABLED = False
+PAGE_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+PAGE_CACHE_QUERY_PARAMS = ['page', 'cursor', 'category', 'tag']
+
+# Generate the renditions templates and the API use as soon as an image is
+# uploaded, in a background thread. See also the generate_renditions command.
+RENDITIONS_GENERATE_ON_UPLOAD = True
+
+# Store the HTML of the page types' rendered_stream_fields when a page is
+# published, and render it again when something it shows changes. See also
+# the render_streams command.
+STREAMFIELD_RENDER_ON_PUBLISH = False
+
+# Pages per sitemap shard, by page id. sitemap.xml is an index of the shards.
+SITEMAP_SHARD_SIZE = 1000
+
+# Narrower variants {% picture %} offers alongside each fill-/width- rendition
+IMAGE_SRCSET_WIDTHS = [480, 960]
+
+
+# Page search runs on the FTS5 index in search.backends, kept up to date on
+# publish. Rebuild it with the rebuild_search_index command.
+WAGTAILSEARCH_BACKENDS = {
+    'default': {
+        'BACKEND': 'wagtail.search.backends.db',
+    },
+    'pages': {
+        'BACKEND': 'search.backends',
+        'AUTO_UPDATE': False,
+    },
+}
+
+# Search hits are buffered in the cache and written in bulk, see search.hits.
+# Run flush_search_hits on shutdown to write out what's still buffered.
+SEARCH_HITS_FLUSH_SIZE = 100
+SEARCH_HITS_FLUSH_INTERVAL = 60
+SEARCH_HITS_BUFFER_SIZE = 10000
+SEARCH_HITS_SLOT_TIMEOUT = 60 * 60 * 24 * 7
+SEARCH_HITS_SLOT_GRACE = 60
+
 
 # Recaptcha settings
 # This key only allows localhost. For production, you'll want your own API keys.
@@ -2,6 +2,21 @@ from .base import *
 
 DEBUG = False
 
+PAGE_CACHE_ENABLED = True
+
+# Shared by every worker process and the management commands, which the
+# cached pages, the search hit buffer and the generation counters rely on.
+# They also need incr() and add() to be atomic, which the file based cache's
+# aren't, so the system checks refuse to start without memcached
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        'LOCATION': os.environ.get('MEMCACHED_LOCATION', '127.0.0.1:11211'),
+    }
+}
+
+CACHE_REQUIRE_ATOMIC = True
+
 try:
     from .local import *
 except ImportError:
@@ -0,0 +1,83 @@
+// Search suggestions for the navbar search box
+(function () {
+    var form = document.querySelector('form[data-autocomplete]');
+    if (!form) {
+        return;
+    }
+    var input = form.querySelector('input[name="query"]');
+    var menu = form.querySelector('.dropdown-menu');
+    var timer = null;
+    var latest = 0;
+
+    function hide() {
+        menu.classList.remove('show');
+        menu.innerHTML = '';
+    }
+
+    function show(results) {
+        menu.innerHTML = '';
+        results.forEach(function (result) {
+            var link = document.createElement('a');
+            link.className = 'dropdown-item';
+            link.href = result.url;
+            link.textContent = result.title;
+            if (result.type !== 'page') {
+                var type = document.createElement('small');
+                type.className = 'text-muted ml-2';
+                type.textContent = result.type;
+                link.appendChild(type);
+            }
+            menu.appendChild(link);
+        });
+        menu.classList.toggle('show', results.length > 0);
+    }
+
+    input.addEventListener('input', function () {
+        clearTimeout(timer);
+        var query = input.value.trim();
+        if (!query) {
+            hide();
+            return;
+        }
+        timer = setTimeout(function () {
+            // Responses can arrive out of order, only the newest request counts
+            var request = ++latest;
+            fetch(form.dataset.autocomplete + '?q=' + encodeURIComponent(query))
+                .then(function (response) { return response.json(); })
+                .then(function (data) {
+                    if (request === latest) {
+                        show(data.results);
+                    }
+                });
+        }, 150);
+    });
+
+    input.addEventListener('keydown', function (event) {
+        if (event.key === 'Escape') {
+            hide();
+        } else if (event.key === 'ArrowDown' && menu.firstChild) {
+            event.preventDefault();
+            menu.firstChild.focus();
+        }
+    });
+
+    menu.addEventListener('keydown', function (event) {
+        var item = document.activeElement;
+        if (event.key === 'ArrowDown' && item.nextSibling) {
+            event.preventDefault();
+            item.nextSibling.focus();
+        } else if (event.key === 'ArrowUp') {
+            event.preventDefault();
+            (item.previousSibling || input).focus();
+        } else if (event.key === 'Escape') {
+            hide();
+            input.focus();
+        }
+    });
+
+    document.addEventListener('click', function (event) {
+        if (!form.contains(event.target)) {
+            hide();
+        }
+    });
+})();
@@ -6,11 +6,11 @@ from django.urls import path
 from wagtail.admin import urls as wagtailadmin_urls
 from wagtail.core import urls as wagtail_urls
 from wagtail.documents import urls as wagtaildocs_urls
-from wagtail.contrib.sitemaps.views import sitemap
 
+from core.sitemaps import sitemap_index, sitemap_shard
 from search import views as search_views
 
-from .api import api_router
+from .api import api_export, api_router
 
 urlpatterns = [
     path('django-admin/', admin.site.urls),
@@ -19,10 +19,13 @@ urlpatterns = [
     path('documents/', include(wagtaildocs_urls)),
 
     path('search/', search_views.search, name='search'),
+    path('search/autocomplete/', search_views.autocomplete, name='search_autocomplete'),
 
+    path('api/v2/export/', api_export, name='api_export'),
     path('api/v2/', api_router.urls),
 
-    path('sitemap.xml', sitemap),
+    path('sitemap.xml', sitemap_index, name='sitemap'),
+    path('sitemap-<int:shard>.xml', sitemap_shard, name='sitemap_shard'),
 
 ]
 